@@ -1,22 +1,32 @@
 # Import necessary libraries
 import os
+import sys
 import json
+import abc
+import sqlite3
+import multiprocessing
 import datetime
-import pandas as pd
-import torch
-from transformers import pipeline
-from langdetect import detect
-from deep_translator import GoogleTranslator
-import google.generativeai as genai
-import speech_recognition as sr
-import pyaudio
+import subprocess
 import wave
 import numpy as np
 from time import sleep
 import threading
 import queue
+import asyncio
+import functools
+import hashlib
+import random
+import secrets
 import io
 import tempfile
+import re
+import time
+import atexit
+import bisect
+import itertools
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, Future
 
 # Available languages with their codes
 LANGUAGES = {
@@ -62,35 +72,1168 @@ ADDITIONAL_LANGS = {
 }
 
 #cell4
+# Heavy libraries (transformers/torch, pyaudio, speech_recognition, Gemini, translators) are
+# imported inside the functions that use them so the first prompt appears quickly.
+
+# Instrumentation settings. Metrics are cheap enough to stay on; traces are written as JSON lines
+# when VIRTUAL_DOCTOR_TRACE_FILE is set, and /metrics is served when a port is given.
+METRICS_ENABLED = os.environ.get("VIRTUAL_DOCTOR_METRICS", "1") == "1"
+TRACE_FILE = os.environ.get("VIRTUAL_DOCTOR_TRACE_FILE")
+METRICS_FILE = os.environ.get("VIRTUAL_DOCTOR_METRICS_FILE")  # JSON-lines snapshot appended at exit
+METRICS_PORT = int(os.environ.get("VIRTUAL_DOCTOR_METRICS_PORT", "0"))
+METRICS_RECENT_SAMPLES = 4096  # Per histogram, for percentiles over recent traffic
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    """Prometheus-style cumulative buckets plus a window of recent samples for p50/p95/p99"""
+    def __init__(self, buckets=METRICS_BUCKETS, recent=METRICS_RECENT_SAMPLES):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=recent)
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+            self.recent.append(value)
+
+    def percentiles(self, quantiles=(0.5, 0.95, 0.99)):
+        with self.lock:
+            values = sorted(self.recent)
+        if not values:
+            return {f"p{int(q * 100)}": None for q in quantiles}
+        return {f"p{int(q * 100)}": values[min(len(values) - 1, int(q * len(values)))] for q in quantiles}
+
+class Metrics:
+    """Counters and latency histograms keyed by (name, labels)"""
+    def __init__(self, prefix="virtual_doctor"):
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self.key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        histogram.observe(value)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def items(self):
+        """(counters, histograms) as lists copied under the lock, so exporters never iterate a growing dict"""
+        with self.lock:
+            return list(self.counters.items()), list(self.histograms.items())
+
+    def stage_report(self):
+        """{stage: {count, mean, p50, p95, p99}} for every stage timer, in seconds"""
+        report = {}
+        for (name, labels), histogram in self.items()[1]:
+            if name != "stage_seconds":
+                continue
+            stage = dict(labels)["stage"]
+            report[stage] = {
+                "count": histogram.count,
+                "mean": histogram.sum / histogram.count if histogram.count else None,
+                **histogram.percentiles()
+            }
+        return report
+
+    def snapshot(self):
+        counters, histograms = self.items()
+        rows = []
+        for (name, labels), histogram in histograms:
+            with histogram.lock:
+                count, total = histogram.count, histogram.sum
+            rows.append({"name": name, "labels": dict(labels), "count": count, "sum": total,
+                         **histogram.percentiles()})
+        return {
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in counters
+            ],
+            "histograms": rows
+        }
+
+    def export_jsonl(self, path):
+        """Append one JSON line per counter/histogram, stamped with the current time"""
+        timestamp = datetime.datetime.now().isoformat()
+        snapshot = self.snapshot()
+        with open(path, "a", encoding="utf-8") as f:
+            for kind in ("counters", "histograms"):
+                for row in snapshot[kind]:
+                    f.write(json.dumps({"timestamp": timestamp, "type": kind[:-1], **row}) + "\n")
+
+    def to_prometheus(self):
+        """Prometheus text exposition format"""
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{key}="{str(value)}"' for key, value in pairs) + "}"
+
+        counters, histograms = self.items()
+        lines = []
+        for (name, labels), value in sorted(counters):
+            lines.append(f"{self.prefix}_{name}_total{label_text(labels)} {value}")
+        for (name, labels), histogram in sorted(histograms, key=lambda item: item[0]):
+            with histogram.lock:
+                counts, total, count = list(histogram.counts), histogram.sum, histogram.count
+            cumulative = 0
+            for bound, bucket_count in zip(list(histogram.buckets) + ["+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f"{self.prefix}_{name}_bucket{label_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.prefix}_{name}_sum{label_text(labels)} {total}")
+            lines.append(f"{self.prefix}_{name}_count{label_text(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+if METRICS_FILE:
+    atexit.register(lambda: metrics.export_jsonl(METRICS_FILE))
+
+# Per-session traces: spans carry the trace id and their parent span id through contextvars,
+# so they follow the session across asyncio tasks and executor calls made with copy_context()
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+recent_traces = deque(maxlen=100)
+
+def new_span_id():
+    return secrets.token_urlsafe(16)
+
+class Trace:
+    def __init__(self, name, **attributes):
+        self.trace_id = secrets.token_urlsafe(16)
+        self.name = name
+        self.attributes = attributes
+        self.spans = []
+        self.start = time.time()
+        self.lock = threading.Lock()
+
+    def add(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def to_dict(self):
+        with self.lock:
+            spans = list(self.spans)
+        return {"trace_id": self.trace_id, "name": self.name, "start": self.start,
+                "attributes": self.attributes, "spans": spans}
+
+class start_trace:
+    """Context manager giving one session (and everything it calls) a trace"""
+    def __init__(self, name, **attributes):
+        self.trace = Trace(name, **attributes)
+
+    def __enter__(self):
+        self.trace_token = _current_trace.set(self.trace)
+        self.span_token = _current_span.set(None)
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_trace.reset(self.trace_token)
+        _current_span.reset(self.span_token)
+        metrics.observe("stage_seconds", time.time() - self.trace.start, stage="session")
+        recent_traces.append(self.trace)
+        if TRACE_FILE:
+            try:
+                with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(self.trace.to_dict(), ensure_ascii=False, default=str) + "\n")
+            except Exception as e:
+                print(f"Error writing trace: {e}")
+        return False
+
+class stage_timer:
+    """Time one pipeline stage: records stage_seconds{stage}, counts errors, and adds a span to the current trace"""
+    def __init__(self, stage, **attributes):
+        self.stage = stage
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.trace = _current_trace.get()
+        if self.trace is not None:
+            self.span_id = new_span_id()
+            self.parent_id = _current_span.get()
+            self.token = _current_span.set(self.span_id)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        metrics.observe("stage_seconds", elapsed, stage=self.stage)
+        if exc_type is not None:
+            record_error(self.stage, exc)
+        if self.trace is not None:
+            try:
+                _current_span.reset(self.token)
+            except ValueError:
+                pass  # A generator finished in a different context than it started in
+            span = {"span_id": self.span_id, "parent_id": self.parent_id, "stage": self.stage,
+                    "start": time.time() - elapsed, "seconds": elapsed}
+            if self.attributes:
+                span["attributes"] = self.attributes
+            if exc_type is not None:
+                span["error"] = f"{exc_type.__name__}: {exc}"
+            self.trace.add(span)
+        return False
+
+    def annotate(self, **attributes):
+        self.attributes.update(attributes)
+
+def traced(name):
+    """Decorator running each call of a session function inside its own trace"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with start_trace(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def record_span(stage, seconds, error=None, **attributes):
+    """Record a stage that finished elsewhere (e.g. in a callback) as if it had been timed with stage_timer"""
+    metrics.observe("stage_seconds", seconds, stage=stage)
+    if error is not None:
+        record_error(stage, error)
+    trace = _current_trace.get()
+    if trace is not None:
+        span = {"span_id": new_span_id(), "parent_id": _current_span.get(), "stage": stage,
+                "start": time.time() - seconds, "seconds": seconds}
+        if attributes:
+            span["attributes"] = attributes
+        if error is not None:
+            span["error"] = str(error)
+        trace.add(span)
+
+def record_error(stage, error):
+    """Count an error for a stage (and mark it on the current trace) instead of only printing it"""
+    metrics.inc("errors", stage=stage, error=type(error).__name__ if isinstance(error, BaseException) else str(error))
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add({"span_id": new_span_id(), "parent_id": _current_span.get(), "stage": stage,
+                   "start": time.time(), "seconds": 0.0, "error": str(error)})
+
+def submit_in_context(pool, func, *args):
+    """pool.submit that keeps the caller's trace context in the worker thread"""
+    return pool.submit(contextvars.copy_context().run, func, *args)
+
+def print_stage_report(report=None):
+    report = report if report is not None else metrics.stage_report()
+    print(f"{'stage':<16}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, row in sorted(report.items()):
+        cells = [f"{row[p] * 1000:>10.1f}" if row[p] is not None else f"{'-':>10}" for p in ("p50", "p95", "p99")]
+        print(f"{stage:<16}{row['count']:>8}" + "".join(cells))
+
+def start_metrics_server(port=METRICS_PORT, host="127.0.0.1"):
+    """Serve /metrics (Prometheus text) and /metrics.json from a daemon thread"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = metrics.to_prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body = json.dumps({"stages": metrics.stage_report(), **metrics.snapshot()}).encode("utf-8")
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Process-wide registry of heavy models, created on first real use and shared by every session
+class ModelRegistry:
+    def __init__(self):
+        self.factories = {}
+        self.instances = {}
+        self.load_seconds = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def register(self, name, factory):
+        with self.lock:
+            self.factories[name] = factory
+            self.locks.setdefault(name, threading.Lock())
+
+    def get(self, name):
+        """Return the shared instance, building it once even if many sessions ask at the same time"""
+        if name in self.instances:
+            return self.instances[name]
+        with self.lock:
+            model_lock = self.locks.setdefault(name, threading.Lock())
+        with model_lock:
+            if name not in self.instances:
+                start = time.perf_counter()
+                self.instances[name] = self.factories[name]()
+                self.load_seconds[name] = time.perf_counter() - start
+            return self.instances[name]
+
+    def is_loaded(self, name):
+        return name in self.instances
+
+    def unload(self, name):
+        with self.lock:
+            self.instances.pop(name, None)
+
+model_registry = ModelRegistry()
+
+def _load_sentiment_analyzer():
+    try:
+        from transformers import pipeline
+        return pipeline("sentiment-analysis")
+    except Exception as e:
+        print(f"Sentiment analyzer initialization failed: {e}")
+        return None
+
+model_registry.register("sentiment-analysis", _load_sentiment_analyzer)
+
+# Fixed UI strings sent to the patient in every consultation
+UI_MESSAGES = {
+    "text_welcome": "Welcome to the Virtual Doctor Assistant. I'm here to help with your health concerns.",
+    "voice_welcome": "Welcome to the Voice-based Virtual Doctor Assistant. I'll help assess your health concerns through voice interaction.",
+    "patient_info": "First, I need to collect some basic information.",
+    "ask_name": "Please enter your name: ",
+    "ask_age": "Please enter your age: ",
+    "ask_gender": "Please enter your gender (Male/Female/Other): ",
+    "ask_phone": "Please enter your phone number (optional): ",
+    "text_symptoms_prompt": "Please describe your symptoms or health concerns in detail:",
+    "voice_symptoms_prompt": "Please describe your symptoms or health concerns when recording starts.",
+    "language_switch": "I detected that you're writing in a different language. I'll continue in this language.",
+    "followup": "Do you have any follow-up questions? (yes/no)",
+    "text_followup_prompt": "What else would you like to know?",
+    "voice_followup_prompt": "Please ask your follow-up question when recording starts.",
+    "closing": "Thank you for using Virtual Doctor Assistant. Remember, this is not a replacement for professional medical advice. Please consult a healthcare provider for proper diagnosis and treatment.",
+    # {placeholders} are filled in after translation and never sent to the translator
+    "transcribed_symptoms": "Transcribed symptoms: {text}",
+    "transcribed_followup": "Transcribed follow-up: {text}"
+}
+
+# Translation cache settings
+TRANSLATION_CACHE_FILE = "translation_cache.json"
+TRANSLATION_CACHE_SIZE = 5000
+TRANSLATION_CACHE_TTL = 30 * 24 * 3600  # 30 days
+
+# Write JSON crash-safely: temp file in the same directory, fsync, then atomic rename
+def atomic_write_json(path, obj, indent=None):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump(obj, file, indent=indent, ensure_ascii=False)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    if hasattr(os, "O_DIRECTORY"):
+        # Persist the rename itself
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+# Bounded LRU cache with optional expiry and hit/miss counters
+class LRUCache:
+    def __init__(self, max_entries=1000, ttl_seconds=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()  # key -> (value, stored_at)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    def _expired(self, stored_at):
+        return self.ttl_seconds is not None and time.time() - stored_at > self.ttl_seconds
+
+    def get(self, key):
+        """Return the cached value (or None) and count the lookup as a hit or miss"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._expired(entry[1]):
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def contains(self, key):
+        """Check for a live entry without touching the counters or LRU order"""
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and not self._expired(entry[1])
+
+    def set(self, key, value, stored_at=None):
+        with self.lock:
+            self.entries[key] = (value, stored_at if stored_at is not None else time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+# Translation cache keyed on (text, source, target) with an optional on-disk store
+class TranslationCache(LRUCache):
+    def __init__(self, max_entries=TRANSLATION_CACHE_SIZE, ttl_seconds=TRANSLATION_CACHE_TTL, file_path=None):
+        super().__init__(max_entries, ttl_seconds)
+        self.file_path = file_path
+        self.persistent_keys = set()  # Only fixed UI strings are written to disk, never patient text
+        self.dirty = False
+        if file_path:
+            self.load()
+
+    def get_translation(self, text, source_lang, target_lang):
+        return self.get((text, source_lang, target_lang))
+
+    def has_translation(self, text, source_lang, target_lang):
+        return self.contains((text, source_lang, target_lang))
+
+    def set_translation(self, text, source_lang, target_lang, translated, persist=False):
+        key = (text, source_lang, target_lang)
+        with self.lock:
+            self.set(key, translated)
+            if persist:
+                self.persistent_keys.add(key)
+                self.dirty = True
+
+    def load(self):
+        try:
+            if os.path.exists(self.file_path):
+                with open(self.file_path, 'r', encoding='utf-8') as file:
+                    stored = json.load(file)
+                with self.lock:
+                    for text, source_lang, target_lang, translated, stored_at in stored:
+                        key = (text, source_lang, target_lang)
+                        if self._expired(stored_at):
+                            continue
+                        self.set(key, translated, stored_at)
+                        self.persistent_keys.add(key)
+        except Exception as e:
+            print(f"Error loading translation cache: {e}")
+
+    def save(self):
+        """Write persistent entries to disk atomically"""
+        if not self.file_path or not self.dirty:
+            return
+        try:
+            with self.lock:
+                stored = [
+                    [key[0], key[1], key[2], value, stored_at]
+                    for key, (value, stored_at) in self.entries.items()
+                    if key in self.persistent_keys
+                ]
+                self.dirty = False
+            atomic_write_json(self.file_path, stored)
+        except Exception as e:
+            print(f"Error saving translation cache: {e}")
+
+translation_cache = TranslationCache(file_path=TRANSLATION_CACHE_FILE)
+atexit.register(translation_cache.save)
+
+# Reuse one translator per language pair instead of creating one per call
+_translators = {}
+_translators_lock = threading.Lock()
+
+def get_translator(source_lang, target_lang):
+    with _translators_lock:
+        translator = _translators.get((source_lang, target_lang))
+        if translator is None:
+            from deep_translator import GoogleTranslator
+            translator = GoogleTranslator(source=source_lang, target=target_lang)
+            _translators[(source_lang, target_lang)] = translator
+        return translator
+
+# Translation backend selection: "auto" routes each language pair to the faster available
+# backend, "remote" prefers Google, "local" prefers on-device models. Offline mode never
+# touches the network.
+TRANSLATION_BACKEND = os.environ.get("VIRTUAL_DOCTOR_TRANSLATION", "auto")
+OFFLINE_MODE = os.environ.get("VIRTUAL_DOCTOR_OFFLINE", "0") == "1"
+LOCAL_TRANSLATION_BATCH = 16
+
+# MarianMT models for common pairs; NLLB covers every other pair among LANGUAGES/ADDITIONAL_LANGS
+MARIAN_MODELS = {
+    (source, target): f"Helsinki-NLP/opus-mt-{source}-{target}"
+    for source, target in [
+        ("en", "es"), ("es", "en"), ("en", "fr"), ("fr", "en"), ("en", "de"), ("de", "en"),
+        ("en", "ru"), ("ru", "en"), ("en", "ar"), ("ar", "en"), ("en", "hi"), ("hi", "en"),
+        ("en", "mr"), ("mr", "en"), ("ja", "en"), ("ko", "en")
+    ]
+}
+MARIAN_MODELS[("en", "zh-CN")] = "Helsinki-NLP/opus-mt-en-zh"
+MARIAN_MODELS[("zh-CN", "en")] = "Helsinki-NLP/opus-mt-zh-en"
+NLLB_MODEL = "facebook/nllb-200-distilled-600M"
+NLLB_CODES = {
+    "en": "eng_Latn", "hi": "hin_Deva", "es": "spa_Latn", "fr": "fra_Latn", "de": "deu_Latn",
+    "zh-CN": "zho_Hans", "ar": "arb_Arab", "ru": "rus_Cyrl", "pt": "por_Latn", "bn": "ben_Beng",
+    "ja": "jpn_Jpan", "ko": "kor_Hang", "ta": "tam_Taml", "te": "tel_Telu", "mr": "mar_Deva",
+    "ur": "urd_Arab", "pa": "pan_Guru", "gu": "guj_Gujr", "ml": "mal_Mlym", "kn": "kan_Knda",
+    "or": "ory_Orya", "as": "asm_Beng", "th": "tha_Thai", "vi": "vie_Latn", "id": "ind_Latn",
+    "ms": "zsm_Latn", "tr": "tur_Latn", "it": "ita_Latn", "nl": "nld_Latn", "sv": "swe_Latn",
+    "pl": "pol_Latn", "uk": "ukr_Cyrl", "el": "ell_Grek", "he": "heb_Hebr", "fa": "pes_Arab"
+}
+
+class TranslationBackend:
+    """Translates texts for one language pair; failures are returned as None"""
+    name = "base"
+
+    def supports(self, source_lang, target_lang):
+        return True
+
+    def is_loaded(self, source_lang, target_lang):
+        return True
+
+    def translate(self, text, source_lang, target_lang):
+        return self.translate_many([text], source_lang, target_lang)[0]
+
+    def translate_many(self, texts, source_lang, target_lang):
+        return [self.translate(text, source_lang, target_lang) for text in texts]
+
+class GoogleTranslationBackend(TranslationBackend):
+    name = "remote"
+
+    def supports(self, source_lang, target_lang):
+        return not OFFLINE_MODE
+
+    def translate(self, text, source_lang, target_lang):
+        try:
+            translated = get_translator(source_lang, target_lang).translate(text)
+            
+            # If translation failed or returned None/empty
+            if not translated:
+                raise Exception("Empty translation result")
+                
+            return translated
+        except Exception as e:
+            record_error("translate_remote", e)
+            return None
+
+class LocalTranslationBackend(TranslationBackend):
+    """On-device MarianMT/NLLB models via transformers, loaded lazily per pair and kept warm in model_registry"""
+    name = "local"
+
+    def __init__(self, max_batch=LOCAL_TRANSLATION_BATCH):
+        self.max_batch = max_batch
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def model_name(self, source_lang, target_lang):
+        if (source_lang, target_lang) in MARIAN_MODELS:
+            return MARIAN_MODELS[(source_lang, target_lang)]
+        if source_lang in NLLB_CODES and target_lang in NLLB_CODES:
+            return NLLB_MODEL
+        return None
+
+    def supports(self, source_lang, target_lang):
+        return self.model_name(source_lang, target_lang) is not None
+
+    def is_loaded(self, source_lang, target_lang):
+        name = self.model_name(source_lang, target_lang)
+        return name is not None and model_registry.is_loaded(f"translation:{name}")
+
+    def load(self, model_name):
+        key = f"translation:{model_name}"
+        if key not in model_registry.factories:
+            def factory():
+                from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+                tokenizer = AutoTokenizer.from_pretrained(model_name)
+                model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+                model.eval()
+                return tokenizer, model
+            model_registry.register(key, factory)
+        with self.lock:
+            model_lock = self.locks.setdefault(model_name, threading.Lock())
+        return model_registry.get(key), model_lock
+
+    def translate_many(self, texts, source_lang, target_lang):
+        model_name = self.model_name(source_lang, target_lang)
+        if model_name is None:
+            return [None] * len(texts)
+        try:
+            import torch
+
+            (tokenizer, model), model_lock = self.load(model_name)
+            results = []
+            generate_args = {}
+            if model_name == NLLB_MODEL:
+                tokenizer.src_lang = NLLB_CODES[source_lang]
+                generate_args["forced_bos_token_id"] = tokenizer.convert_tokens_to_ids(NLLB_CODES[target_lang])
+            for start in range(0, len(texts), self.max_batch):
+                batch = texts[start:start + self.max_batch]
+                # One forward pass per batch; the lock keeps concurrent callers from oversubscribing the CPU
+                with model_lock, torch.inference_mode():
+                    inputs = tokenizer(batch, return_tensors="pt", padding=True, truncation=True, max_length=512)
+                    outputs = model.generate(**inputs, max_new_tokens=512, **generate_args)
+                results.extend(tokenizer.batch_decode(outputs, skip_special_tokens=True))
+            return [result or None for result in results]
+        except Exception as e:
+            record_error("translate_local", e)
+            return [None] * len(texts)
+
+# Picks a backend per language pair from measured latency and recent failures
+class TranslationRouter:
+    def __init__(self, backends, mode=TRANSLATION_BACKEND, failure_cooldown=60.0, explore_rate=0.05):
+        self.backends = {backend.name: backend for backend in backends}
+        self.mode = mode
+        self.failure_cooldown = failure_cooldown
+        self.explore_rate = explore_rate
+        self.latency = {}  # (backend, source, target) -> EWMA seconds per text
+        self.unavailable_until = {}  # (backend, source, target) -> monotonic time
+        self.lock = threading.Lock()
+
+    def candidates(self, source_lang, target_lang):
+        """Backends to try for this pair, best first"""
+        now = time.monotonic()
+        available = [
+            backend for backend in self.backends.values()
+            if backend.supports(source_lang, target_lang)
+            and self.unavailable_until.get((backend.name, source_lang, target_lang), 0) <= now
+        ]
+        if self.mode in ("remote", "local"):
+            return sorted(available, key=lambda backend: backend.name != self.mode)
+
+        def expected_latency(backend):
+            measured = self.latency.get((backend.name, source_lang, target_lang))
+            if measured is not None:
+                return measured
+            # Unmeasured: a warm local model is assumed fast, a cold one pays its load time first
+            if backend.name == "local":
+                return 0.2 if backend.is_loaded(source_lang, target_lang) else 2.0
+            return 0.5
+
+        ranked = sorted(available, key=expected_latency)
+        if len(ranked) > 1 and random.random() < self.explore_rate:
+            # Occasionally try the runner-up so its measurement stays current
+            ranked[0], ranked[1] = ranked[1], ranked[0]
+        return ranked
+
+    def record(self, backend, source_lang, target_lang, seconds_per_text, ok):
+        key = (backend.name, source_lang, target_lang)
+        with self.lock:
+            if not ok:
+                self.unavailable_until[key] = time.monotonic() + self.failure_cooldown
+                return
+            previous = self.latency.get(key)
+            self.latency[key] = seconds_per_text if previous is None else 0.8 * previous + 0.2 * seconds_per_text
+
+    def translate_many(self, texts, source_lang, target_lang):
+        """Translate with the best backend, retrying what failed on the next one; None marks failures"""
+        results = [None] * len(texts)
+        pending = list(range(len(texts)))
+        with stage_timer("translate", pair=f"{source_lang}->{target_lang}", texts=len(texts)) as timer:
+            for backend in self.candidates(source_lang, target_lang):
+                if not pending:
+                    break
+                start = time.perf_counter()
+                translated = backend.translate_many([texts[i] for i in pending], source_lang, target_lang)
+                elapsed = time.perf_counter() - start
+                succeeded = sum(1 for result in translated if result is not None)
+                self.record(backend, source_lang, target_lang, elapsed / len(pending), succeeded > 0)
+                metrics.observe("translate_backend_seconds", elapsed, backend=backend.name)
+                timer.annotate(backend=backend.name)
+                for index, result in zip(pending, translated):
+                    results[index] = result
+                pending = [i for i in pending if results[i] is None]
+
+            # Last resort: let Google detect the source language
+            remote = self.backends.get("remote")
+            if pending and remote is not None and remote.supports('auto', target_lang):
+                for index in pending:
+                    results[index] = remote.translate(texts[index], 'auto', target_lang)
+            failed = sum(1 for result in results if result is None)
+            if failed:
+                metrics.inc("translate_failures", failed)
+        return results
+
+    def translate(self, text, source_lang, target_lang):
+        return self.translate_many([text], source_lang, target_lang)[0]
+
+    def prefers_local(self, source_lang, target_lang):
+        candidates = self.candidates(source_lang, target_lang)
+        return bool(candidates) and candidates[0].name == "local"
+
+translation_router = TranslationRouter([GoogleTranslationBackend(), LocalTranslationBackend()])
+
+def warm_local_translation(lang_codes=None):
+    """Load the local models for en<->code pairs so offline sessions do not wait for them"""
+    if lang_codes is None:
+        lang_codes = [lang["code"] for lang in LANGUAGES.values()]
+    local = translation_router.backends["local"]
+    for lang_code in lang_codes:
+        for pair in (("en", lang_code), (lang_code, "en")):
+            if lang_code != "en" and local.supports(*pair):
+                try:
+                    local.load(local.model_name(*pair))
+                except Exception as e:
+                    print(f"Error loading local translation model {pair}: {e}")
+
+# An engine can bring its own router and cache (benchmarks, tests); its calls see them through this context
+_translation_override = contextvars.ContextVar("translation_override", default=None)
+
+def current_translation():
+    """(router, cache) for the running session: its engine's own, or the process-wide ones"""
+    router, cache = _translation_override.get() or (None, None)
+    return (router if router is not None else translation_router,
+            cache if cache is not None else translation_cache)
+
 # Translation functions with better error handling
-def safe_translate(text, source_lang, target_lang):
+def _translate_uncached(text, source_lang, target_lang):
+    """Translate through the router (best backend first, then the others, then auto-detection); None if all fail"""
+    return current_translation()[0].translate(text, source_lang, target_lang)
+
+def safe_translate(text, source_lang, target_lang, persist=False):
     """Safely translate text between languages with fallbacks"""
     if not text or source_lang == target_lang:
         return text
-        
-    try:
-        # Try with specified source language
-        translator = GoogleTranslator(source=source_lang, target=target_lang)
-        translated = translator.translate(text)
-        
-        # If translation failed or returned None/empty
-        if not translated:
-            raise Exception("Empty translation result")
-            
+
+    cache = current_translation()[1]
+    cached = cache.get_translation(text, source_lang, target_lang)
+    if cached is not None:
+        metrics.inc("translate_cache_hits")
+        return cached
+
+    translated = _translate_uncached(text, source_lang, target_lang)
+    if translated is None:
+        return text
+
+    cache.set_translation(text, source_lang, target_lang, translated, persist)
+    return translated
+
+# Message catalogs: per-language UI bundles built offline with `python main21.py build-catalogs`
+MESSAGE_CATALOG_DIR = os.environ.get("VIRTUAL_DOCTOR_CATALOGS", "locales")
+PLACEHOLDER_PATTERN = re.compile(r"\{(\w+)\}")
+
+def message_hash(message):
+    """Identifies the English source of a catalog entry so stale entries are ignored"""
+    return hashlib.sha256(message.encode('utf-8')).hexdigest()[:16]
+
+def translate_template(message, translate):
+    """Translate a UI template with translate(text) -> str/None, keeping its {placeholders} intact"""
+    names = PLACEHOLDER_PATTERN.findall(message)
+    if not names:
+        return translate(message)
+
+    # Send numbered markers instead of the placeholder names, then put the names back
+    protected = message
+    for index, name in enumerate(names):
+        protected = protected.replace("{" + name + "}", f"[{index}]", 1)
+    translated = translate(protected)
+    if translated and all(translated.count(f"[{index}]") == 1 for index in range(len(names))):
+        for index, name in enumerate(names):
+            translated = translated.replace(f"[{index}]", "{" + name + "}")
         return translated
-    except Exception as e:
-        print(f"First translation attempt failed: {e}")
+
+    # The translator mangled a marker: translate the text around the placeholders piece by piece
+    parts = PLACEHOLDER_PATTERN.split(message)  # literal, name, literal, ...
+    pieces = []
+    for index, part in enumerate(parts):
+        if index % 2:
+            pieces.append("{" + part + "}")
+        elif part.strip():
+            piece = translate(part.strip())
+            if not piece:
+                return None
+            pieces.append(part[:len(part) - len(part.lstrip())] + piece + part[len(part.rstrip()):])
+        else:
+            pieces.append(part)
+    return "".join(pieces)
+
+def catalog_path(lang_code, directory=None):
+    return os.path.join(directory or MESSAGE_CATALOG_DIR, f"{lang_code}.json")
+
+class MessageCatalog:
+    def __init__(self, lang_code, messages=None):
+        self.lang_code = lang_code
+        self.messages = messages or {}  # key -> {"source_hash": ..., "text": ...}
+
+    @classmethod
+    def load(cls, lang_code, directory=None):
+        """Read one language's bundle; a missing or unreadable bundle gives an empty catalog"""
+        path = catalog_path(lang_code, directory)
         try:
-            # Try with auto-detection as fallback
-            translator = GoogleTranslator(source='auto', target=target_lang)
-            translated = translator.translate(text)
-            if translated:
-                return translated
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as file:
+                    return cls(lang_code, json.load(file).get("messages", {}))
+        except Exception as e:
+            print(f"Error loading message catalog {path}: {e}")
+        return cls(lang_code)
+
+    def get(self, key):
+        """The translated template for key, or None if missing or built from older English text"""
+        entry = self.messages.get(key)
+        if entry and entry.get("source_hash") == message_hash(UI_MESSAGES[key]):
+            return entry["text"]
+        return None
+
+    def covers(self, keys):
+        return all(self.get(key) is not None for key in keys)
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+def get_message_catalog(lang_code):
+    """Load a language's bundle the first time that language is used"""
+    with _catalogs_lock:
+        if lang_code not in _catalogs:
+            _catalogs[lang_code] = MessageCatalog.load(lang_code)
+        return _catalogs[lang_code]
+
+def translate_ui(key, lang_code, **values):
+    """Render one of the fixed UI_MESSAGES in the patient's language from its prebuilt catalog"""
+    template = UI_MESSAGES[key]
+    if lang_code != "en":
+        localized = get_message_catalog(lang_code).get(key)
+        if localized is None:
+            # Not in the bundle yet: translate at runtime and keep it in the persistent cache
+            localized = translate_template(
+                template, lambda text: safe_translate(text, "en", lang_code, persist=True))
+        template = localized or template
+    return template.format(**values) if values else template
+
+def build_message_catalogs(directory=None, lang_codes=None):
+    """Offline build step: translate every UI message for every supported language into locales/<code>.json"""
+    directory = directory or MESSAGE_CATALOG_DIR
+    if lang_codes is None:
+        lang_codes = [lang["code"] for lang in LANGUAGES.values()]
+        lang_codes += [lang["code"] for lang in ADDITIONAL_LANGS.values()]
+    os.makedirs(directory, exist_ok=True)
+
+    def build(lang_code):
+        catalog = MessageCatalog.load(lang_code, directory)
+        messages, missing = {}, []
+        for key, message in UI_MESSAGES.items():
+            text = catalog.get(key)
+            if text is None:
+                # Untranslated entries are left out so the runtime falls back instead of showing English
+                text = translate_template(message, lambda part: _translate_uncached(part, "en", lang_code))
+            if text:
+                messages[key] = {"source_hash": message_hash(message), "source": message, "text": text}
             else:
-                return text
-        except Exception as e2:
-            print(f"Fallback translation failed: {e2}")
-            return text
+                missing.append(key)
+        atomic_write_json(catalog_path(lang_code, directory),
+                          {"language": lang_code, "messages": messages}, indent=2)
+        return lang_code, len(messages), missing
+
+    results = {}
+    for lang_code, built, missing in get_translation_pool().map(
+            build, [code for code in dict.fromkeys(lang_codes) if code != "en"]):
+        results[lang_code] = {"messages": built, "missing": missing}
+        print(f"{lang_code}: {built}/{len(UI_MESSAGES)} messages" + (f", missing {missing}" if missing else ""))
+    return results
+
+# Batch translation settings
+TRANSLATION_WORKERS = 8
+TRANSLATION_RETRIES = 2
+TRANSLATION_SEGMENT_CHARS = 4500  # GoogleTranslator rejects texts over 5000 characters
+
+_translation_pool = None
+_translation_pool_lock = threading.Lock()
+
+def get_translation_pool():
+    """Shared, bounded worker pool for concurrent translation calls"""
+    global _translation_pool
+    with _translation_pool_lock:
+        if _translation_pool is None:
+            _translation_pool = ThreadPoolExecutor(max_workers=TRANSLATION_WORKERS, thread_name_prefix="translate")
+        return _translation_pool
+
+def translate_segment(text, source_lang, target_lang, retries=TRANSLATION_RETRIES, persist=False):
+    """Translate one segment with its own retries, falling back to the original segment"""
+    if not text or not text.strip() or source_lang == target_lang:
+        return text
+
+    cache = current_translation()[1]
+    cached = cache.get_translation(text, source_lang, target_lang)
+    if cached is not None:
+        metrics.inc("translate_cache_hits")
+        return cached
+
+    for attempt in range(retries + 1):
+        translated = _translate_uncached(text, source_lang, target_lang)
+        if translated is not None:
+            cache.set_translation(text, source_lang, target_lang, translated, persist)
+            return translated
+        if attempt < retries:
+            sleep(0.5 * (2 ** attempt))
+    return text
+
+def translate_batch(segments, source_lang, target_lang, retries=TRANSLATION_RETRIES, persist=False):
+    """Translate a list of segments concurrently, returning them in the original order"""
+    segments = list(segments)
+    if source_lang == target_lang:
+        return segments
+
+    router, cache = current_translation()
+    if router.prefers_local(source_lang, target_lang):
+        # Local models are fastest with one batched forward pass instead of per-segment calls
+        results = list(segments)
+        missing = []
+        for index, segment in enumerate(segments):
+            if not segment or not segment.strip():
+                continue
+            cached = cache.get_translation(segment, source_lang, target_lang)
+            if cached is not None:
+                results[index] = cached
+            else:
+                missing.append(index)
+        if missing:
+            translated = router.translate_many([segments[i] for i in missing], source_lang, target_lang)
+            for index, result in zip(missing, translated):
+                if result is not None:
+                    cache.set_translation(segments[index], source_lang, target_lang, result, persist)
+                    results[index] = result
+        return results
+
+    pool = get_translation_pool()
+    futures = [
+        submit_in_context(pool, translate_segment, segment, source_lang, target_lang, retries, persist)
+        for segment in segments
+    ]
+    return [future.result() for future in futures]
+
+def split_into_segments(text, max_chars=TRANSLATION_SEGMENT_CHARS):
+    """Split text into paragraphs (and long paragraphs into sentences), keeping separators"""
+    pieces = re.split(r'(\n\s*)', text)
+    segments, separators = [], []
+    for index in range(0, len(pieces), 2):
+        paragraph = pieces[index]
+        separator = pieces[index + 1] if index + 1 < len(pieces) else ""
+        if len(paragraph) <= max_chars:
+            segments.append(paragraph)
+            separators.append(separator)
+            continue
+
+        # Break oversized paragraphs at sentence ends, then hard-wrap anything still too long
+        chunk = ""
+        for sentence in re.split(r'(?<=[.!?\u0964\u3002])\s+', paragraph):
+            while len(sentence) > max_chars:
+                if chunk:
+                    segments.append(chunk)
+                    separators.append(" ")
+                    chunk = ""
+                segments.append(sentence[:max_chars])
+                separators.append("")
+                sentence = sentence[max_chars:]
+            if chunk and len(chunk) + len(sentence) + 1 > max_chars:
+                segments.append(chunk)
+                separators.append(" ")
+                chunk = sentence
+            else:
+                chunk = f"{chunk} {sentence}" if chunk else sentence
+        segments.append(chunk)
+        separators.append(separator)
+    return segments, separators
+
+def translate_long_text(text, source_lang, target_lang):
+    """Translate a long text (e.g. a medical response) paragraph by paragraph in parallel"""
+    if not text or source_lang == target_lang:
+        return text
+
+    segments, separators = split_into_segments(text)
+    translated = translate_batch(segments, source_lang, target_lang)
+    return "".join(segment + separator for segment, separator in zip(translated, separators))
+
+def warm_translation_cache(lang_codes=None):
+    """Pre-translate every fixed UI message for the given (default: all LANGUAGES) codes"""
+    if lang_codes is None:
+        lang_codes = [lang["code"] for lang in LANGUAGES.values()]
+
+    for lang_code in lang_codes:
+        # Languages with a built catalog need no runtime translation at all
+        if lang_code == "en" or os.path.exists(catalog_path(lang_code)):
+            continue
+        missing = [
+            message for message in UI_MESSAGES.values()
+            if not PLACEHOLDER_PATTERN.search(message)
+            and not translation_cache.has_translation(message, "en", lang_code)
+        ]
+        translate_batch(missing, "en", lang_code, persist=True)
+    translation_cache.save()
+
+def start_translation_warmup(lang_codes=None):
+    """Warm the translation cache (and, offline, the local models) in the background so startup is not delayed"""
+    def warm():
+        if OFFLINE_MODE or TRANSLATION_BACKEND == "local":
+            warm_local_translation(lang_codes)
+        warm_translation_cache(lang_codes)
+
+    warmup_thread = threading.Thread(target=warm, daemon=True)
+    warmup_thread.start()
+    return warmup_thread
+
+# Language identification: Unicode-script fast paths first, then langdetect restricted to the
+# languages the doctor supports. Profiles are loaded once and results are seeded and cached.
+LANGID_CACHE_SIZE = 2048
+LANGID_SEED = 0
+
+# (script regex, language codes that use the script); single-language scripts skip langdetect
+SCRIPT_LANGUAGES = [
+    (re.compile(r"[\u3040-\u30ff]"), ("ja",)),  # Hiragana/Katakana (checked before Han)
+    (re.compile(r"[\uac00-\ud7af\u1100-\u11ff\u3130-\u318f]"), ("ko",)),
+    (re.compile(r"[\u4e00-\u9fff\u3400-\u4dbf]"), ("zh-CN",)),
+    (re.compile(r"[\u0900-\u097f]"), ("hi", "mr")),  # Devanagari
+    (re.compile(r"[\u0980-\u09ff]"), ("bn",)),  # Bengali script (also Assamese, which langdetect cannot tell apart)
+    (re.compile(r"[\u0a00-\u0a7f]"), ("pa",)),
+    (re.compile(r"[\u0a80-\u0aff]"), ("gu",)),
+    (re.compile(r"[\u0b00-\u0b7f]"), ("or",)),
+    (re.compile(r"[\u0b80-\u0bff]"), ("ta",)),
+    (re.compile(r"[\u0c00-\u0c7f]"), ("te",)),
+    (re.compile(r"[\u0c80-\u0cff]"), ("kn",)),
+    (re.compile(r"[\u0d00-\u0d7f]"), ("ml",)),
+    (re.compile(r"[\u0e00-\u0e7f]"), ("th",)),
+    (re.compile(r"[\u0370-\u03ff]"), ("el",)),
+    (re.compile(r"[\u0590-\u05ff]"), ("he",)),
+    (re.compile(r"[\u0600-\u06ff\u0750-\u077f\ufb50-\ufdff\ufe70-\ufeff]"), ("ar", "ur", "fa")),
+    (re.compile(r"[\u0400-\u04ff]"), ("ru", "uk")),
+]
+LATIN_LANGUAGES = ("en", "es", "fr", "de", "pt", "it", "nl", "sv", "pl", "tr", "vi", "id")
+
+# langdetect profile names that differ from our language codes
+LANGDETECT_CODES = {"zh-CN": "zh-cn"}
+
+class LanguageIdentifier:
+    def __init__(self, lang_codes=None, cache_size=LANGID_CACHE_SIZE, seed=LANGID_SEED):
+        if lang_codes is None:
+            lang_codes = [lang["code"] for lang in LANGUAGES.values()]
+            lang_codes += [lang["code"] for lang in ADDITIONAL_LANGS.values()]
+        self.lang_codes = list(dict.fromkeys(lang_codes))
+        self.seed = seed
+        self.cache = LRUCache(cache_size)
+        self.factory = None
+        self.lock = threading.Lock()
+        self.stats_lock = threading.Lock()  # Sessions detect concurrently
+        self.script_hits = 0
+        self.model_calls = 0
+
+    def load(self):
+        """Load the langdetect profiles for the supported languages (once)"""
+        if self.factory is not None:
+            return self.factory
+        with self.lock:
+            if self.factory is None:
+                from langdetect.detector_factory import DetectorFactory, PROFILES_DIRECTORY
+
+                profiles = []
+                for code in self.lang_codes:
+                    profile_path = os.path.join(PROFILES_DIRECTORY, LANGDETECT_CODES.get(code, code))
+                    if os.path.isfile(profile_path):
+                        with open(profile_path, encoding="utf-8") as f:
+                            profiles.append(f.read())
+                factory = DetectorFactory()
+                factory.load_json_profile(profiles)
+                factory.seed = self.seed  # langdetect is random unless seeded
+                self.factory = factory
+        return self.factory
+
+    def script_candidates(self, text):
+        """Languages allowed by the text's dominant non-Latin script, or None for Latin/other text"""
+        best, best_count = None, 0
+        for pattern, codes in SCRIPT_LANGUAGES:
+            count = len(pattern.findall(text))
+            if count > best_count:
+                best, best_count = codes, count
+        if best is None:
+            return None
+        # Kana anywhere means Japanese even when Kanji outnumber it
+        if best == ("zh-CN",) and SCRIPT_LANGUAGES[0][0].search(text):
+            return ("ja",)
+        letters = sum(1 for ch in text if ch.isalpha())
+        return best if best_count * 2 >= letters else None
+
+    def detect_with_model(self, text, candidates):
+        factory = self.load()
+        detector = factory.create()
+        supported = [code for code in candidates if LANGDETECT_CODES.get(code, code) in factory.get_lang_list()]
+        if supported:
+            detector.set_prior_map({LANGDETECT_CODES.get(code, code): 1.0 for code in supported})
+        detector.append(text)
+        detected = detector.detect()
+        with self.stats_lock:
+            self.model_calls += 1
+        return next((code for code, name in LANGDETECT_CODES.items() if name == detected), detected)
+
+    def detect(self, text, default="en"):
+        key = text.strip()
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        candidates = self.script_candidates(key)
+        if candidates is not None and len(candidates) == 1:
+            with self.stats_lock:
+                self.script_hits += 1
+            detected = candidates[0]
+        else:
+            try:
+                detected = self.detect_with_model(key, candidates or LATIN_LANGUAGES)
+            except Exception:
+                detected = default
+        self.cache.set(key, detected)
+        return detected
+
+    def stats(self):
+        with self.stats_lock:
+            counts = {"script_hits": self.script_hits, "model_calls": self.model_calls}
+        return {**counts, **self.cache.stats()}
+
+language_identifier = LanguageIdentifier()
+
+def start_language_id_warmup():
+    """Load the language profiles in the background so the first detection is fast"""
+    warmup_thread = threading.Thread(target=language_identifier.load, daemon=True)
+    warmup_thread.start()
+    return warmup_thread
 
 # Improved language detection function that avoids detecting on proper names
 def detect_language_safely(text):
@@ -103,19 +1246,217 @@ def detect_language_safely(text):
     if len(words) == 1 and words[0][0].isupper():
         return "en"  # Assume proper names are in the user's selected language
         
+    with stage_timer("detect"):
+        return language_identifier.detect(text)
+
+def _legacy_detect_language(text):
+    """The previous detect_language_safely: unseeded langdetect over every profile on each call"""
     try:
-        detected = detect(text)
-        return detected
-    except:
+        from langdetect import detect
+        return detect(text)
+    except Exception:
         return "en"
+
+def benchmark_language_id(repeats=20, results_file=None):
+    """Compare the legacy detector with LanguageIdentifier on a mixed-language symptom sample"""
+    samples = [
+        "I have had a headache and fever for three days",
+        "Tengo dolor de cabeza y fiebre desde hace tres días",
+        "J'ai mal à la tête et de la fièvre depuis trois jours",
+        "Ich habe seit drei Tagen Kopfschmerzen und Fieber",
+        "मुझे तीन दिनों से सिरदर्द और बुखार है",
+        "मला तीन दिवसांपासून डोकेदुखी आणि ताप आहे",
+        "எனக்கு மூன்று நாட்களாக தலைவலி மற்றும் காய்ச்சல் உள்ளது",
+        "నాకు మూడు రోజులుగా తలనొప్పి మరియు జ్వరం ఉంది",
+        "আমার তিন দিন ধরে মাথাব্যথা এবং জ্বর",
+        "我头痛发烧已经三天了",
+        "三日前から頭痛と熱があります",
+        "사흘 동안 두통과 열이 있어요",
+        "أعاني من صداع وحمى منذ ثلاثة أيام",
+        "У меня три дня болит голова и температура",
+        "Estou com dor de cabeça e febre há três dias",
+    ]
+
+    results = {}
+    for name, detect in (("legacy", _legacy_detect_language), ("identifier", None)):
+        identifier = LanguageIdentifier()
+        detect = detect or identifier.detect
+        start = time.perf_counter()
+        first = [detect(text) for text in samples[:1]]
+        first_call = time.perf_counter() - start
+
+        start = time.perf_counter()
+        labels = []
+        for _ in range(repeats):
+            labels = [detect(text) for text in samples]
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            "first_call_ms": round(first_call * 1000, 2),
+            "per_call_us": round(elapsed / (repeats * len(samples)) * 1e6, 1),
+            "labels": first + labels[1:]
+        }
+        if name == "identifier":
+            results[name]["stats"] = identifier.stats()
+
+    # Fresh identifier without the cache, to show the cost of a cold detection per text
+    identifier = LanguageIdentifier(cache_size=0)
+    identifier.load()
+    start = time.perf_counter()
+    for text in samples:
+        identifier.detect(text)
+    results["identifier_uncached"] = {
+        "per_call_us": round((time.perf_counter() - start) / len(samples) * 1e6, 1)
+    }
+
+    for name, result in results.items():
+        print(f"{name}: {json.dumps({k: v for k, v in result.items() if k != 'labels'})}")
+    for text, old, new in zip(samples, results["legacy"]["labels"], results["identifier"]["labels"]):
+        print(f"  {old:>6} -> {new:<6} {text[:40]}")
+
+    if results_file:
+        with open(results_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"timestamp": datetime.datetime.now().isoformat(), **results}) + "\n")
+    return results
+
 #cell5
-# Patient data management
+# Rolling per-patient summaries, updated in the same transaction as each write so prompts
+# never have to re-read a patient's full history
+SUMMARY_RECENT_VISITS = 5
+SUMMARY_TERMS = 20
+SUMMARY_ENTRY_CHARS = 160
+SUMMARY_STOPWORDS = frozenset("""
+    a an and are as at be been but by for from had has have i im in is it its me my of on or so
+    since that the this to was were with very also not no some days day weeks week since about
+    feel feeling having there their they them when what which who will would could should
+    """.split())
+
+# Crisis-risk screening answers stored under a consultation's "screening" key, in the order
+# the suicidal.ipynb risk model was trained on
+SCREENING_FEATURES = [
+    "phq9_score", "gad7_score", "financial_stress", "heart_rate", "sleep_hours", "activity_level",
+    "social_interactions", "internet_access", "substance_use", "community_support",
+    "healthcare_access", "stress_coping"
+]
+RISK_SCORE_CHUNK = 50_000
+
+def screening_value(value):
+    """One stored screening answer as a float; null, text and other non-numbers become NaN"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+def parse_screening(answers):
+    """Validate submitted screening answers: known feature names, numbers or null; raises ValueError"""
+    if not isinstance(answers, dict):
+        raise ValueError("Screening answers must be an object")
+    unknown = sorted(set(answers) - set(SCREENING_FEATURES))
+    if unknown:
+        raise ValueError(f"Unknown screening answers: {', '.join(unknown)}")
+    parsed = {}
+    for name, value in answers.items():
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))
+                                  or not np.isfinite(value)):
+            raise ValueError(f"Screening answer {name} must be a number or null")
+        parsed[name] = value
+    return parsed
+
+def clip_text(text, max_chars):
+    text = " ".join(str(text).split())
+    return text if len(text) <= max_chars else text[:max_chars - 3].rstrip() + "..."
+
+def summarize_consultation(record):
+    """Compact (date, complaint, advice) entry for one consultation or follow-up record"""
+    complaint = record.get("symptoms") or record.get("followup_question") or ""
+    advice = record.get("response") or record.get("followup_response") or ""
+    # The first non-empty line of the answer is usually the headline assessment
+    headline = next((line.strip(" *#-") for line in advice.splitlines() if line.strip(" *#-")), "")
+    return {
+        "date": record.get("timestamp", "Unknown"),
+        "complaint": clip_text(complaint, SUMMARY_ENTRY_CHARS),
+        "advice": clip_text(headline, SUMMARY_ENTRY_CHARS),
+        "followup": "followup_question" in record and "symptoms" not in record
+    }
+
+def update_patient_summary(summary, record):
+    """Fold one new record into a patient's summary; cost does not depend on history length"""
+    summary = summary or {"visits": 0, "first_visit": None, "last_visit": None, "terms": {}, "recent": []}
+    timestamp = record.get("timestamp", "Unknown")
+    summary["visits"] += 1
+    summary["first_visit"] = summary["first_visit"] or timestamp
+    summary["last_visit"] = timestamp
+
+    complaint = record.get("symptoms") or record.get("followup_question") or ""
+    terms = summary["terms"]
+    for term in set(re.findall(r"[a-z]{3,}", complaint.lower())) - SUMMARY_STOPWORDS:
+        terms[term] = terms.get(term, 0) + 1
+    if len(terms) > SUMMARY_TERMS * 2:
+        # Keep the counters bounded; rare terms drop out first
+        summary["terms"] = dict(sorted(terms.items(), key=lambda item: -item[1])[:SUMMARY_TERMS])
+
+    summary["recent"] = (summary["recent"] + [summarize_consultation(record)])[-SUMMARY_RECENT_VISITS:]
+    return summary
+
+# Patient data management backed by an indexed, append-only SQLite store.
+# Several processes may share one store: SQLite's file locks serialize writers, every
+# commit is fsynced, and bursts of add_patient calls are group-committed in one transaction.
 class PatientDatabase:
-    def __init__(self, file_path="patient_records.json"):
-        self.file_path = file_path
-        self.records = self.load_records()
-        
+    def __init__(self, file_path="patient_records.json", db_path=None,
+                 group_commit=True, commit_interval=0.0, max_batch=256):
+        self.file_path = file_path  # Legacy JSON file, migrated into the store on first use
+        self.db_path = db_path or os.path.splitext(file_path)[0] + ".db"
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self.create_schema()
+        self.migrate_json_records()
+        self.build_missing_summaries()
+
+        # Group commit: a writer thread drains queued consultations into one durable transaction
+        self.group_commit = group_commit
+        self.commit_interval = commit_interval
+        self.max_batch = max_batch
+        self.write_queue = queue.Queue()
+        self.writer_thread = None
+        if group_commit:
+            self.writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+            self.writer_thread.start()
+            # The writer is a daemon thread, so commit what wait=False callers queued before exiting
+            atexit.register(self.flush)
+
+    def create_schema(self):
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=FULL")
+            self.conn.execute("PRAGMA busy_timeout=30000")
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS consultations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    patient_id TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_consultations_patient
+                    ON consultations (patient_id, id);
+                CREATE TABLE IF NOT EXISTS store_meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                CREATE TABLE IF NOT EXISTS patient_summaries (
+                    patient_id TEXT PRIMARY KEY,
+                    summary TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS risk_scores (
+                    patient_id TEXT PRIMARY KEY,
+                    consultation_id INTEGER NOT NULL,
+                    risk REAL NOT NULL,
+                    flag INTEGER NOT NULL,
+                    model_version TEXT NOT NULL,
+                    scored_at TEXT NOT NULL
+                );
+            """)
+
     def load_records(self):
+        """Read the legacy JSON file ({patient_id: [consultation, ...]})"""
         try:
             if os.path.exists(self.file_path):
                 with open(self.file_path, 'r', encoding='utf-8') as file:
@@ -124,117 +1465,1477 @@ class PatientDatabase:
         except Exception as e:
             print(f"Error loading records: {e}")
             return {}
-    
-    def save_records(self):
+
+    def migrate_json_records(self):
+        """Import an existing patient_records.json once, then keep it aside as a backup"""
+        if not os.path.exists(self.file_path):
+            return
+        migration_key = f"migrated:{os.path.abspath(self.file_path)}"
         try:
-            with open(self.file_path, 'w', encoding='utf-8') as file:
-                json.dump(self.records, file, indent=4, ensure_ascii=False)
+            with self.lock:
+                # BEGIN IMMEDIATE takes the write lock, so only one worker process migrates
+                self.conn.execute("BEGIN IMMEDIATE")
+                try:
+                    done = self.conn.execute(
+                        "SELECT 1 FROM store_meta WHERE key = ?", (migration_key,)).fetchone()
+                    rows = []
+                    if not done:
+                        records = self.load_records()
+                        rows = [
+                            (patient_id, record.get("timestamp", ""), json.dumps(record, ensure_ascii=False))
+                            for patient_id, consultations in records.items()
+                            for record in consultations
+                        ]
+                        self.conn.executemany(
+                            "INSERT INTO consultations (patient_id, timestamp, data) VALUES (?, ?, ?)", rows)
+                        self._update_summaries(rows)
+                        self.conn.execute(
+                            "INSERT INTO store_meta (key, value) VALUES (?, ?)",
+                            (migration_key, str(len(rows))))
+                    self.conn.execute("COMMIT")
+                except BaseException:
+                    self.conn.execute("ROLLBACK")
+                    raise
+            if os.path.exists(self.file_path):
+                os.replace(self.file_path, f"{self.file_path}.migrated")
+            if not done:
+                print(f"Migrated {len(rows)} records from {self.file_path} to {self.db_path}")
         except Exception as e:
-            print(f"Error saving records: {e}")
-    
-    def add_patient(self, patient_id, data):
-        if patient_id not in self.records:
-            self.records[patient_id] = []
-        
+            print(f"Error migrating records: {e}")
+
+    def build_missing_summaries(self):
+        """One-off pass for stores written before patient summaries existed"""
+        try:
+            with self.lock:
+                self.conn.execute("BEGIN IMMEDIATE")
+                try:
+                    done = self.conn.execute(
+                        "SELECT 1 FROM store_meta WHERE key = 'summaries'").fetchone()
+                    if not done:
+                        self.conn.execute("DELETE FROM patient_summaries")
+                        summaries = {}
+                        for patient_id, data in self.conn.execute(
+                                "SELECT patient_id, data FROM consultations ORDER BY id"):
+                            summaries[patient_id] = update_patient_summary(
+                                summaries.get(patient_id), json.loads(data))
+                        self.conn.executemany(
+                            "INSERT INTO patient_summaries (patient_id, summary) VALUES (?, ?)",
+                            ((patient_id, json.dumps(summary, ensure_ascii=False))
+                             for patient_id, summary in summaries.items()))
+                        self.conn.execute(
+                            "INSERT INTO store_meta (key, value) VALUES ('summaries', ?)", (str(len(summaries)),))
+                    self.conn.execute("COMMIT")
+                except BaseException:
+                    self.conn.execute("ROLLBACK")
+                    raise
+        except Exception as e:
+            print(f"Error building patient summaries: {e}")
+
+    def _update_summaries(self, rows):
+        """Fold newly inserted rows into their patients' summaries (caller holds the transaction)"""
+        summaries = {}
+        for patient_id, _, data in rows:
+            if patient_id not in summaries:
+                row = self.conn.execute(
+                    "SELECT summary FROM patient_summaries WHERE patient_id = ?", (patient_id,)).fetchone()
+                summaries[patient_id] = json.loads(row[0]) if row else None
+            summaries[patient_id] = update_patient_summary(summaries[patient_id], json.loads(data))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO patient_summaries (patient_id, summary) VALUES (?, ?)",
+            ((patient_id, json.dumps(summary, ensure_ascii=False)) for patient_id, summary in summaries.items()))
+
+    def _insert_rows(self, rows):
+        metrics.inc("db_commits")
+        metrics.inc("db_rows_written", len(rows))
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO consultations (patient_id, timestamp, data) VALUES (?, ?, ?)", rows)
+            self._update_summaries(rows)
+
+    def _writer_loop(self):
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                return
+            batch = [item]
+
+            # Take everything queued meanwhile (plus whatever arrives within the optional commit window)
+            deadline = time.monotonic() + self.commit_interval
+            stop = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self.write_queue.get(timeout=max(remaining, 0)) if remaining > 0 else self.write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            error = None
+            try:
+                rows = [row for row, _ in batch if row is not None]  # flush() enqueues a bare marker
+                if rows:
+                    self._insert_rows(rows)
+            except Exception as e:
+                error = e
+                print(f"Error saving records: {e}")
+            for _, waiter in batch:
+                waiter["error"] = error
+                waiter["done"].set()
+            if stop:
+                return
+
+    def add_patient(self, patient_id, data, wait=True):
         # Add timestamp to the consultation
         data["timestamp"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.records[patient_id].append(data)
-        self.save_records()
+        row = (patient_id, data["timestamp"], json.dumps(data, ensure_ascii=False))
+
+        with stage_timer("db_write", wait=wait):
+            if self.writer_thread is None:
+                try:
+                    self._insert_rows([row])
+                except Exception as e:
+                    record_error("db_write", e)
+                    print(f"Error saving records: {e}")
+                    raise
+                return
+
+            waiter = {"done": threading.Event(), "error": None}
+            self.write_queue.put((row, waiter))
+            if wait:
+                # Returns once the batch containing this consultation is durably committed
+                waiter["done"].wait()
+                if waiter["error"] is not None:
+                    record_error("db_write", waiter["error"])
+                    raise waiter["error"]
     
     def get_patient_history(self, patient_id):
-        return self.records.get(patient_id, [])
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT data FROM consultations WHERE patient_id = ? ORDER BY id",
+                (patient_id,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get_recent_history(self, patient_id, limit=10):
+        """The patient's latest consultations, oldest first"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT data FROM consultations WHERE patient_id = ? ORDER BY id DESC LIMIT ?",
+                (patient_id, limit)).fetchall()
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    def get_patient_summary(self, patient_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT summary FROM patient_summaries WHERE patient_id = ?", (patient_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_history_context(self, patient_id, limit=10):
+        """What the prompt builder needs: the rolling summary plus the latest records"""
+        return {
+            "summary": self.get_patient_summary(patient_id),
+            "recent": self.get_recent_history(patient_id, limit)
+        }
+
+    def count_records(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM consultations").fetchone()[0]
+
+    def risk_watermark(self, model_version):
+        """Highest consultation id already scored by this model version (0 if it never ran)"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM store_meta WHERE key = ?", (f"risk_watermark:{model_version}",)).fetchone()
+        return int(row[0]) if row else 0
+
+    def latest_consultation_id(self):
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM consultations").fetchone()[0]
+
+    def iter_screenings(self, after_id=0, until_id=None, chunk_size=RISK_SCORE_CHUNK, features=SCREENING_FEATURES):
+        """Yield (consultation_ids, patient_ids, X) chunks for consultations carrying screening answers.
+
+        Reads with keyset pagination on its own WAL connection, so memory is bounded by
+        chunk_size and writers are never blocked. One multi-path json_extract per row returns
+        the answers as a JSON array, and each chunk is parsed with a single json.loads, so X
+        (float64, NaN where an answer is missing) is built without per-record dicts.
+        """
+        until_id = self.latest_consultation_id() if until_id is None else until_id
+        paths = ", ".join(f"'$.screening.{name}'" for name in features)
+        query = (f"SELECT id, patient_id, json_extract(data, {paths}) FROM consultations "
+                 f"WHERE id > ? AND id <= ? ORDER BY id LIMIT ?")
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        try:
+            while after_id < until_id:
+                rows = conn.execute(query, (after_id, until_id, chunk_size)).fetchall()
+                if not rows:
+                    return
+                ids, patient_ids, answers = zip(*rows)
+                after_id = ids[-1]
+                try:
+                    X = np.array(json.loads("[" + ",".join(answers) + "]"), dtype=np.float64)  # null -> NaN
+                except (TypeError, ValueError):
+                    # Some record holds a non-numeric answer: convert row by row so only that answer
+                    # is lost (NaN, imputed at scoring time) and the watermark still moves past it
+                    X = np.array([[screening_value(value) for value in json.loads(row)] for row in answers],
+                                 dtype=np.float64)
+                screened = ~np.isnan(X).all(axis=1)  # Ordinary consultations have no screening answers
+                if screened.any():
+                    yield np.array(ids, dtype=np.int64)[screened], np.array(patient_ids, dtype=object)[screened], X[screened]
+        finally:
+            conn.close()
+
+    def save_risk_scores(self, consultation_ids, patient_ids, risks, flags, model_version, watermark):
+        """Upsert one chunk of scores and advance the watermark in the same transaction.
+
+        A patient's row only moves forward to a newer consultation, so a run that dies halfway
+        resumes from the last committed chunk without double counting.
+        """
+        scored_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        metrics.inc("db_commits")
+        metrics.inc("db_rows_written", len(consultation_ids))
+        with self.lock, self.conn:
+            self.conn.executemany(
+                """INSERT INTO risk_scores (patient_id, consultation_id, risk, flag, model_version, scored_at)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(patient_id) DO UPDATE SET
+                       consultation_id = excluded.consultation_id, risk = excluded.risk, flag = excluded.flag,
+                       model_version = excluded.model_version, scored_at = excluded.scored_at
+                   WHERE excluded.consultation_id >= risk_scores.consultation_id""",
+                zip(patient_ids.tolist(), consultation_ids.tolist(), risks.tolist(), flags.astype(int).tolist(),
+                    itertools.repeat(model_version), itertools.repeat(scored_at)))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)",
+                (f"risk_watermark:{model_version}", str(int(watermark))))
+
+    def add_screening(self, patient_id, answers, wait=True):
+        """Store crisis-screening answers as a consultation for the next score_population run"""
+        self.add_patient(patient_id, {"input_method": "screening", "screening": parse_screening(answers)}, wait)
+
+    def get_risk_score(self, patient_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT consultation_id, risk, flag, model_version, scored_at FROM risk_scores WHERE patient_id = ?",
+                (patient_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("consultation_id", "risk", "flag", "model_version", "scored_at"), row))
+
+    def flagged_patients(self, model_version=None):
+        """Patients currently flagged as at risk, highest risk first"""
+        query = "SELECT patient_id, risk FROM risk_scores WHERE flag = 1"
+        params = ()
+        if model_version is not None:
+            query += " AND model_version = ?"
+            params = (model_version,)
+        with self.lock:
+            return self.conn.execute(query + " ORDER BY risk DESC", params).fetchall()
+
+    def flush(self):
+        """Block until every queued consultation is committed"""
+        if self.writer_thread is not None:
+            waiter = {"done": threading.Event(), "error": None}
+            self.write_queue.put((None, waiter))
+            waiter["done"].wait()
+
+    def export_json(self, path=None):
+        """Write a snapshot in the legacy {patient_id: [consultation, ...]} format, atomically"""
+        self.flush()
+        records = {}
+        with self.lock:
+            for patient_id, data in self.conn.execute(
+                    "SELECT patient_id, data FROM consultations ORDER BY id"):
+                records.setdefault(patient_id, []).append(json.loads(data))
+        atomic_write_json(path or self.file_path, records, indent=4)
+
+    def close(self):
+        if self.writer_thread is not None:
+            atexit.unregister(self.flush)
+            self.write_queue.put(None)
+            self.writer_thread.join()
+            self.writer_thread = None
+        with self.lock:
+            self.conn.close()
+
+def benchmark_patient_database(sizes=(1_000, 10_000, 100_000, 1_000_000), sample_writes=500, directory=None):
+    """Show that add_patient cost stays flat as the store grows from 1k to 1M records.
+
+    The store lives in a fresh temporary directory (inside directory, if given) that is removed afterwards.
+    """
+    record = json.dumps({"symptoms": "fever and headache for two days", "response": "x" * 500})
+    results = []
+    with tempfile.TemporaryDirectory(prefix="vd-bench-db-", dir=directory) as work_dir:
+        db = PatientDatabase(file_path=os.path.join(work_dir, "patient_records.json"),
+                             db_path=os.path.join(work_dir, "patient_records.db"))
+        try:
+            for size in sizes:
+                # Bulk-fill up to the target size outside the timed section
+                missing = size - db.count_records()
+                with db.lock, db.conn:
+                    db.conn.executemany(
+                        "INSERT INTO consultations (patient_id, timestamp, data) VALUES (?, ?, ?)",
+                        ((f"patient_{i % 50_000}", "2025-01-01 00:00:00", record) for i in range(missing)))
+
+                start = time.perf_counter()
+                for i in range(sample_writes):
+                    db.add_patient(f"patient_{i}", {"symptoms": "cough", "response": "rest"})
+                write_us = (time.perf_counter() - start) / sample_writes * 1e6
+
+                start = time.perf_counter()
+                db.get_patient_history("patient_42")
+                history_us = (time.perf_counter() - start) * 1e6
+
+                results.append({"records": size, "write_us": round(write_us, 1), "history_us": round(history_us, 1)})
+                print(f"{size:>10,} records: {write_us:8.1f} us/write, {history_us:8.1f} us/history lookup")
+        finally:
+            db.close()
+    return results
+
+def _stress_writer(db_path, worker_id, writes):
+    db = PatientDatabase(file_path=f"{db_path}.json", db_path=db_path)
+    for i in range(writes):
+        db.add_patient(f"worker{worker_id}_patient{i % 10}", {"worker": worker_id, "seq": i})
+    db.close()
+
+def stress_test_concurrent_writers(processes=8, writes_per_process=250, db_path="stress_patient_records.db"):
+    """Run several writer processes against one store and check that no consultation is lost"""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+    start = time.perf_counter()
+    workers = [
+        multiprocessing.Process(target=_stress_writer, args=(db_path, worker_id, writes_per_process))
+        for worker_id in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    db = PatientDatabase(file_path=f"{db_path}.json", db_path=db_path)
+    try:
+        with db.lock:
+            seen = {
+                (record["worker"], record["seq"])
+                for (data,) in db.conn.execute("SELECT data FROM consultations")
+                for record in (json.loads(data),)
+            }
+    finally:
+        db.close()
+    expected = {(w, i) for w in range(processes) for i in range(writes_per_process)}
+    lost = expected - seen
+
+    print(f"{processes} writers x {writes_per_process} writes in {elapsed:.2f}s "
+          f"({len(expected) / elapsed:,.0f} writes/s), lost records: {len(lost)}")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    return not lost and all(worker.exitcode == 0 for worker in workers)
     
 #cell6
+# Preallocated float32 ring buffer that recorded chunks are copied straight into
+class AudioRingBuffer:
+    def __init__(self, rate=44100, max_seconds=300):
+        self.rate = rate
+        self.capacity = int(rate * max_seconds)
+        self.data = np.empty(self.capacity, dtype=np.float32)  # Pages are only committed as they are written
+        self.written = 0  # Total samples ever written; the buffer keeps the most recent `capacity`
+        self.stress_analysis = None  # Scores computed while recording, if the recorder ran the analyzer
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def write(self, chunk):
+        """Append raw float32 bytes (or a float32 array), overwriting the oldest audio when full"""
+        samples = np.frombuffer(chunk, dtype=np.float32) if isinstance(chunk, (bytes, bytearray, memoryview)) else chunk
+        if len(samples) >= self.capacity:
+            samples = samples[-self.capacity:]
+        start = self.written % self.capacity
+        first = min(len(samples), self.capacity - start)
+        self.data[start:start + first] = samples[:first]
+        self.data[:len(samples) - first] = samples[first:]
+        self.written += len(samples)
+
+    def samples(self):
+        """Recorded audio in chronological order; a view unless the buffer has wrapped"""
+        if self.written <= self.capacity:
+            return self.data[:self.written]
+        start = self.written % self.capacity
+        return np.concatenate((self.data[start:], self.data[:start]))
+
+    @property
+    def full(self):
+        return self.written >= self.capacity
+
+    def clear(self):
+        self.written = 0
+        self.stress_analysis = None
+
+def float32_to_int16_inplace(samples, block=65536):
+    """Convert float32 samples to int16 inside the same memory and return the int16 view.
+
+    Block k's int16 output lands in bytes already consumed by earlier blocks, so
+    only the first block needs a temporary copy.
+    """
+    output = samples.view(np.int16)[:len(samples)]
+    for start in range(0, len(samples), block):
+        chunk = samples[start:start + block]
+        np.multiply(chunk, 32767, out=chunk)
+        np.clip(chunk, -32768, 32767, out=chunk)
+        output[start:start + len(chunk)] = chunk
+    return output
+
+def float32_to_int16_copy(samples, block=65536):
+    """int16 copy of float32 samples, converted a block at a time so no full-size float temporary is made"""
+    output = np.empty(len(samples), dtype=np.int16)
+    for start in range(0, len(samples), block):
+        output[start:start + block] = np.clip(samples[start:start + block] * 32767, -32768, 32767)
+    return output
+
+# Streaming capture settings: audio is downsampled to 16 kHz int16 as it arrives
+CAPTURE_RATE = 44100
+RECOGNITION_RATE = 16000
+VAD_FRAME_MS = 30
+VAD_START_MS = 90  # Speech must last this long to open a segment
+VAD_HANGOVER_MS = 600  # Silence that closes a segment
+VAD_PREROLL_MS = 300  # Audio kept from before the segment opened
+VAD_MAX_SEGMENT_S = 15  # Long monologues are cut so recognition can start
+VAD_END_OF_TURN_MS = 2000  # Silence after speech that ends the whole utterance
+CAPTURE_CHUNK = 1024
+AUDIO_QUEUE_SECONDS = 10  # Captured audio buffered before the oldest chunks are dropped
+PA_CONTINUE = 0  # pyaudio.paContinue, without importing pyaudio on the audio thread
+
+def lowpass_taps(cutoff, taps):
+    """Hamming-windowed sinc low-pass FIR; cutoff is in cycles per sample (0.5 = Nyquist)"""
+    n = np.arange(taps) - (taps - 1) / 2
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+    return (h / h.sum()).astype(np.float32)
+
+# Streaming linear-interpolation resampler that keeps its phase between chunks. When
+# downsampling, a windowed-sinc FIR first removes everything above 0.4x the target rate so
+# higher frequencies do not fold back into the speech band; its delay is trimmed from the
+# first output, so the result stays aligned with the input.
+class LinearResampler:
+    def __init__(self, from_rate, to_rate):
+        self.step = from_rate / to_rate
+        self.position = 0.0  # Next output position, relative to the previous chunk's last sample
+        self.previous = None
+        self.taps = None
+        if self.step > 1.0:
+            self.taps = lowpass_taps(0.4 / self.step, 2 * int(16 * self.step) + 1)
+            self.history = np.zeros(len(self.taps) - 1, dtype=np.float32)  # Input the filter still needs
+            self.delay = (len(self.taps) - 1) // 2  # Filtered samples still to drop
+
+    def antialias(self, samples):
+        padded = np.concatenate((self.history, samples))
+        self.history = padded[len(padded) - len(self.history):]
+        filtered = np.convolve(padded, self.taps, mode='valid').astype(np.float32)
+        if self.delay:
+            dropped = min(self.delay, len(filtered))
+            filtered = filtered[dropped:]
+            self.delay -= dropped
+        return filtered
+
+    def process(self, samples):
+        if self.step == 1.0:
+            return samples
+        if self.taps is not None:
+            samples = self.antialias(samples)
+        if self.previous is None:
+            buffer = samples
+        else:
+            buffer = np.concatenate(([self.previous], samples))
+        if len(buffer) < 2:
+            self.previous = buffer[-1] if len(buffer) else self.previous
+            return np.empty(0, dtype=np.float32)
+        positions = np.arange(self.position, len(buffer) - 1, self.step)
+        output = np.interp(positions, np.arange(len(buffer)), buffer).astype(np.float32)
+        next_position = positions[-1] + self.step if len(positions) else self.position
+        self.position = next_position - (len(buffer) - 1)
+        self.previous = buffer[-1]
+        return output
+
+def float32_to_int16(samples):
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+
+# Energy-based voice activity detector with an adaptive noise floor
+class EnergyVAD:
+    def __init__(self, rate=RECOGNITION_RATE, frame_ms=VAD_FRAME_MS, start_ms=VAD_START_MS,
+                 hangover_ms=VAD_HANGOVER_MS, preroll_ms=VAD_PREROLL_MS, max_segment_s=VAD_MAX_SEGMENT_S,
+                 min_rms=300.0, noise_ratio=3.0):
+        self.frame = int(rate * frame_ms / 1000)
+        self.start_frames = max(1, start_ms // frame_ms)
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        self.preroll_frames = preroll_ms // frame_ms
+        self.max_frames = int(max_segment_s * 1000 // frame_ms)
+        self.min_rms = min_rms
+        self.noise_ratio = noise_ratio
+        self.noise_floor = min_rms / noise_ratio
+        self.pending = np.empty(0, dtype=np.int16)
+        self.preroll = deque(maxlen=self.preroll_frames + self.start_frames)
+        self.segment = []
+        self.in_speech = False
+        self.speech_run = 0
+        self.silence_run = 0
+        self.heard_speech = False
+        self.trailing_silence_frames = 0
+
+    def is_speech(self, frame):
+        rms = float(np.sqrt(np.mean(frame.astype(np.float32) ** 2)))
+        speech = rms > max(self.min_rms, self.noise_floor * self.noise_ratio)
+        if not speech:
+            # Track background noise slowly so a noisy room does not count as speech
+            self.noise_floor = 0.95 * self.noise_floor + 0.05 * rms
+        return speech
+
+    def process(self, samples):
+        """Feed int16 samples; return the list of segments (int16 arrays) that closed"""
+        closed = []
+        self.pending = np.concatenate((self.pending, samples))
+        usable = len(self.pending) - len(self.pending) % self.frame
+        frames, self.pending = self.pending[:usable], self.pending[usable:]
+
+        for start in range(0, usable, self.frame):
+            frame = frames[start:start + self.frame]
+            speech = self.is_speech(frame)
+            self.trailing_silence_frames = 0 if speech else self.trailing_silence_frames + 1
+
+            if not self.in_speech:
+                self.preroll.append(frame)
+                self.speech_run = self.speech_run + 1 if speech else 0
+                if self.speech_run >= self.start_frames:
+                    self.in_speech = True
+                    self.heard_speech = True
+                    self.segment = list(self.preroll)
+                    self.preroll.clear()
+                    self.silence_run = 0
+                continue
+
+            self.segment.append(frame)
+            self.silence_run = 0 if speech else self.silence_run + 1
+            if self.silence_run >= self.hangover_frames or len(self.segment) >= self.max_frames:
+                closed.append(self.close_segment())
+        return closed
+
+    def close_segment(self):
+        segment = np.concatenate(self.segment)
+        self.segment = []
+        self.in_speech = False
+        self.speech_run = 0
+        self.silence_run = 0
+        return segment
+
+    def flush(self):
+        """Close any open segment once the input has ended"""
+        if self.in_speech and self.segment:
+            return [self.close_segment()]
+        return []
+
+    def end_of_turn(self, rate=RECOGNITION_RATE, end_ms=VAD_END_OF_TURN_MS):
+        """True once the speaker has said something and then stayed quiet for end_ms"""
+        return self.heard_speech and self.trailing_silence_frames * self.frame * 1000 / rate >= end_ms
+
+# Audio sources yield mono float32 chunks at `rate` until exhausted or stopped
+class WavFileSource:
+    """Reads a WAV file in chunks so streaming capture can be tested without a microphone"""
+    def __init__(self, path, chunk=1024, realtime=False):
+        self.path = path
+        self.chunk = chunk
+        self.realtime = realtime
+        self.stopped = False
+        with wave.open(path, 'rb') as wf:
+            self.rate = wf.getframerate()
+
+    def stop(self):
+        self.stopped = True
+
+    def __iter__(self):
+        with wave.open(self.path, 'rb') as wf:
+            channels, width = wf.getnchannels(), wf.getsampwidth()
+            dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[width]
+            scale = float(2 ** (8 * width - 1))
+            while not self.stopped:
+                data = wf.readframes(self.chunk)
+                if not data:
+                    return
+                samples = np.frombuffer(data, dtype=dtype).astype(np.float32)
+                if width == 1:
+                    samples -= 128.0
+                samples /= scale
+                if channels > 1:
+                    samples = samples.reshape(-1, channels).mean(axis=1)
+                if self.realtime:
+                    sleep(len(samples) / self.rate)
+                yield samples
+
+# A PyAudio input stream opened once and started/stopped per utterance. PortAudio's callback
+# thread pushes chunks into a bounded audio_queue; when the consumer falls behind, the oldest
+# audio is dropped (and counted) rather than blocking the real-time callback. Non-real-time
+# producers (fake streams, file replay) can use overflow="block" to be throttled instead.
+class AudioDevice:
+    def __init__(self, rate=CAPTURE_RATE, chunk=CAPTURE_CHUNK, max_queue_seconds=AUDIO_QUEUE_SECONDS,
+                 stream_factory=None, overflow="drop"):
+        self.rate = rate
+        self.chunk = chunk
+        self.audio_queue = queue.Queue(maxsize=max(1, int(max_queue_seconds * rate / chunk)))
+        self.stream_factory = stream_factory or self.open_pyaudio_stream
+        self.overflow = overflow
+        self.pyaudio = None
+        self.stream = None
+        self.capturing = False
+        self.lock = threading.Lock()
+        self.overruns = 0  # Chunks dropped because the queue was full
+        self.chunks = 0
+
+    def open_pyaudio_stream(self, rate, chunk, callback):
+        import pyaudio
+
+        if self.pyaudio is None:
+            self.pyaudio = pyaudio.PyAudio()  # PortAudio initialization, paid once per process
+        return self.pyaudio.open(format=pyaudio.paFloat32, channels=1, rate=rate, input=True,
+                                 frames_per_buffer=chunk, stream_callback=callback, start=False)
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        chunk = np.frombuffer(in_data, dtype=np.float32)
+        if self.overflow == "block":
+            while self.capturing:
+                try:
+                    self.audio_queue.put(chunk, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            self.chunks += 1
+            return None, PA_CONTINUE
+        try:
+            self.audio_queue.put_nowait(chunk)
+        except queue.Full:
+            try:
+                self.audio_queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.overruns += 1
+            try:
+                self.audio_queue.put_nowait(chunk)
+            except queue.Full:
+                pass
+        self.chunks += 1
+        return None, PA_CONTINUE
+
+    def start(self):
+        """Start capturing, discarding anything left over from the previous utterance"""
+        with self.lock:
+            if self.stream is None:
+                self.stream = self.stream_factory(self.rate, self.chunk, self._callback)
+            while True:
+                try:
+                    self.audio_queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.capturing = True
+            if not self.stream.is_active():
+                self.stream.start_stream()
+
+    def stop(self):
+        """Pause capture; the stream and PortAudio stay open for the next utterance"""
+        self.capturing = False  # Releases a callback blocked on a full queue
+        with self.lock:
+            if self.stream is not None and self.stream.is_active():
+                self.stream.stop_stream()
+
+    def read(self, timeout=0.1):
+        """Next captured float32 chunk, or None if nothing arrived within timeout"""
+        try:
+            return self.audio_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.capturing = False
+        with self.lock:
+            if self.stream is not None:
+                try:
+                    self.stream.stop_stream()
+                    self.stream.close()
+                except Exception as e:
+                    print(f"Error closing audio stream: {e}")
+                self.stream = None
+            if self.pyaudio is not None:
+                self.pyaudio.terminate()
+                self.pyaudio = None
+
+    def stats(self):
+        return {"chunks": self.chunks, "overruns": self.overruns, "queued": self.audio_queue.qsize()}
+
+class FakeAudioStream:
+    """Stands in for a PyAudio callback stream: a thread feeds samples (then silence) to the callback"""
+    def __init__(self, samples, rate, chunk, callback, realtime=True):
+        self.samples = np.asarray(samples, dtype=np.float32)
+        self.rate = rate
+        self.chunk = chunk
+        self.callback = callback
+        self.realtime = realtime
+        self.position = 0
+        self.active = threading.Event()
+        self.thread = None
+
+    @classmethod
+    def factory(cls, samples, realtime=True):
+        return lambda rate, chunk, callback: cls(samples, rate, chunk, callback, realtime)
+
+    def run(self):
+        silence = np.zeros(self.chunk, dtype=np.float32)
+        while self.active.is_set():
+            block = self.samples[self.position:self.position + self.chunk]
+            self.position += len(block)
+            if len(block) < self.chunk:
+                block = np.concatenate([block, silence[:self.chunk - len(block)]])
+            self.callback(block.tobytes(), self.chunk, None, 0)
+            if self.realtime:
+                sleep(self.chunk / self.rate)
+
+    def is_active(self):
+        return self.active.is_set()
+
+    def start_stream(self):
+        self.active.set()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop_stream(self):
+        self.active.clear()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        self.stop_stream()
+
+_audio_device = None
+_audio_device_lock = threading.Lock()
+
+def get_audio_device():
+    """The process-wide microphone device; PortAudio is only initialized when capture first starts"""
+    global _audio_device
+    with _audio_device_lock:
+        if _audio_device is None:
+            _audio_device = AudioDevice()
+            atexit.register(_audio_device.close)
+        return _audio_device
+
+def wait_for_enter(cancelled, poll=0.1):
+    """Block until Enter is pressed (True) or cancelled is set (False).
+
+    stdin is polled rather than read by a blocking input(), so a listener whose recording
+    ended some other way never lingers and swallows the patient's next answer.
+    """
+    try:
+        if os.name == "nt":
+            import msvcrt
+
+            while not cancelled.wait(poll):
+                while msvcrt.kbhit():
+                    if msvcrt.getwch() in ("\r", "\n"):
+                        return True
+            return False
+
+        import select
+
+        while not cancelled.is_set():
+            if select.select([sys.stdin], [], [], poll)[0]:
+                if sys.stdin.readline():
+                    return True
+                break  # End of input: no key press will ever come
+    except (OSError, ValueError, AttributeError):
+        pass  # No console to poll (stdin closed, redirected or captured)
+    cancelled.wait()
+    return False
+
+class MicrophoneSource:
+    """Reads the shared microphone device until stop() is called or Enter is pressed"""
+    def __init__(self, stop_on_enter=True, device=None):
+        self.device = device or get_audio_device()
+        self.rate = self.device.rate
+        self.chunk = self.device.chunk
+        self.stop_on_enter = stop_on_enter
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+    def __iter__(self):
+        self.device.start()
+        finished = threading.Event()  # Cancels the Enter listener when capture ends any other way
+        if self.stop_on_enter:
+            threading.Thread(target=lambda: wait_for_enter(finished) and self.stop(), daemon=True).start()
+        try:
+            while not self.stopped:
+                chunk = self.device.read()
+                if chunk is not None:
+                    yield chunk
+        finally:
+            finished.set()
+            self.device.stop()
+
+# Speech recognition backend selection: "google" (remote), "vosk" (local) or "auto" (local when a model exists)
+ASR_BACKEND = os.environ.get("VIRTUAL_DOCTOR_ASR", "google")
+VOSK_MODEL_DIR = os.environ.get("VOSK_MODEL_DIR", os.path.join("models", "vosk"))
+VOSK_MODELS = {
+    "en-US": "vosk-model-small-en-us-0.15",
+    "hi-IN": "vosk-model-small-hi-0.22",
+    "es-ES": "vosk-model-small-es-0.42",
+    "fr-FR": "vosk-model-small-fr-0.22",
+    "de-DE": "vosk-model-small-de-0.15",
+    "zh-CN": "vosk-model-small-cn-0.22",
+    "ar-AE": "vosk-model-ar-mgb2-0.4",
+    "ru-RU": "vosk-model-small-ru-0.22",
+    "pt-BR": "vosk-model-small-pt-0.3",
+    "ja-JP": "vosk-model-small-ja-0.22",
+    "ko-KR": "vosk-model-small-ko-0.22",
+    "te-IN": "vosk-model-small-te-0.42"
+}
+
+class SpeechBackend(abc.ABC):
+    """Turns int16 speech segments into text; recognize returns (text, error) with error None, 'unknown' or 'request'"""
+    name = "base"
+
+    def supports(self, language_code):
+        return True
+
+    @abc.abstractmethod
+    def recognize(self, segment, rate, language_code):
+        pass
+
+    def recognize_batch(self, items):
+        """Recognize a list of (segment, rate, language_code) tuples"""
+        return [self.recognize(*item) for item in items]
+
+    @abc.abstractmethod
+    def submit(self, segment, rate, language_code):
+        """Queue one segment for recognition and return a Future of (text, error)"""
+
+class GoogleSpeechBackend(SpeechBackend):
+    """Google Web Speech API; one network round trip per segment, run concurrently"""
+    name = "google"
+
+    def __init__(self, recognizer=None, workers=4):
+        import speech_recognition as sr
+        self.recognizer = recognizer or sr.Recognizer()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="asr-google")
+
+    def recognize(self, segment, rate, language_code):
+        import speech_recognition as sr
+
+        audio = sr.AudioData(memoryview(segment).cast('B'), rate, 2)
+        try:
+            return self.recognizer.recognize_google(audio, language=language_code), None
+        except sr.UnknownValueError:
+            return "", "unknown"
+        except sr.RequestError:
+            return "", "request"
+
+    def submit(self, segment, rate, language_code):
+        return self.pool.submit(self.recognize, segment, rate, language_code)
+
+class VoskSpeechBackend(SpeechBackend):
+    """Offline Vosk (Kaldi) recognition on the CPU.
+
+    Each language's model is loaded once into the shared model_registry. Segments are
+    recognized concurrently on a pool of worker threads; every worker keeps its own
+    recognizer per (language, rate) over the shared model, reset between utterances, since
+    a KaldiRecognizer is not safe to use from two threads at once.
+    """
+    name = "vosk"
+
+    def __init__(self, model_dir=VOSK_MODEL_DIR, models=None, workers=4):
+        self.model_dir = model_dir
+        self.models = models or VOSK_MODELS
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="asr-vosk")
+        self.local = threading.local()  # Per-worker recognizers
+
+    def model_path(self, language_code):
+        name = self.models.get(language_code)
+        return os.path.join(self.model_dir, name) if name else None
+
+    def supports(self, language_code):
+        path = self.model_path(language_code)
+        return path is not None and os.path.isdir(path)
+
+    def load_model(self, language_code):
+        key = f"vosk:{language_code}"
+        if key not in model_registry.factories:
+            path = self.model_path(language_code)
+
+            def factory():
+                import vosk
+                vosk.SetLogLevel(-1)
+                return vosk.Model(path)
+            model_registry.register(key, factory)
+        return model_registry.get(key)
+
+    def recognizer(self, language_code, rate):
+        """This worker thread's recognizer for (language_code, rate), created on first use"""
+        import vosk
+
+        recognizers = getattr(self.local, "recognizers", None)
+        if recognizers is None:
+            recognizers = self.local.recognizers = {}
+        key = (language_code, rate)
+        if key not in recognizers:
+            recognizers[key] = vosk.KaldiRecognizer(self.load_model(language_code), rate)
+        return recognizers[key]
+
+    def recognize(self, segment, rate, language_code):
+        if not self.supports(language_code):
+            return "", "request"
+        recognizer = self.recognizer(language_code, rate)
+        recognizer.AcceptWaveform(segment.tobytes())
+        text = json.loads(recognizer.FinalResult()).get("text", "")  # FinalResult also resets
+        return (text, None) if text else ("", "unknown")
+
+    def recognize_batch(self, items):
+        return list(self.pool.map(lambda item: self.recognize(*item), items))
+
+    def submit(self, segment, rate, language_code):
+        return self.pool.submit(self.recognize, segment, rate, language_code)
+
+class HybridSpeechBackend(SpeechBackend):
+    """Uses the local backend for languages it has a model for and the remote one otherwise"""
+    name = "auto"
+
+    def __init__(self, local, remote):
+        self.local = local
+        self.remote = remote
+
+    def pick(self, language_code):
+        return self.local if self.local.supports(language_code) else self.remote
+
+    def recognize(self, segment, rate, language_code):
+        return self.pick(language_code).recognize(segment, rate, language_code)
+
+    def submit(self, segment, rate, language_code):
+        return self.pick(language_code).submit(segment, rate, language_code)
+
+_speech_backends = {}
+_speech_backends_lock = threading.RLock()
+
+def create_speech_backend(name=None):
+    """The process-wide backend for name, so every VoiceAssistant shares its worker threads"""
+    name = name or ASR_BACKEND
+    if name not in ("vosk", "auto"):
+        name = "google"
+    with _speech_backends_lock:
+        if name not in _speech_backends:
+            if name == "vosk":
+                _speech_backends[name] = VoskSpeechBackend()
+            elif name == "auto":
+                _speech_backends[name] = HybridSpeechBackend(create_speech_backend("vosk"), create_speech_backend("google"))
+            else:
+                _speech_backends[name] = GoogleSpeechBackend()
+        return _speech_backends[name]
+
+# Streaming stress/emotion scoring over recorded audio, matching the stress notebook's model
+STRESS_ANALYSIS_ENABLED = os.environ.get("VIRTUAL_DOCTOR_STRESS", "1") == "1"
+STRESS_RATE = 22050  # librosa's default load rate, so features are on the notebook's scale
+STRESS_N_FFT = 2048
+STRESS_HOP = 512
+STRESS_N_MELS = 128
+STRESS_N_MFCC = 13
+STRESS_TOP_DB = 80.0  # power_to_db's default: log-mel values are clipped this far below the loudest
+STRESS_DB_MIN = -100.0  # power_to_db's floor (amin=1e-10)
+STRESS_DB_STEP = 0.25  # Histogram resolution for the clipped log-mel means
+STRESS_DB_BINS = 800
+STRESS_WINDOW_SECONDS = 10  # Sliding window behind the "recent" scores
+STRESS_TEMPO_SECONDS = 8  # Onset history used to estimate speaking tempo
+EMOTION_THRESHOLDS = {
+    'happy': {'energy': 0.7, 'tempo': 120},
+    'sad': {'energy': 0.3, 'tempo': 80},
+    'angry': {'energy': 0.8, 'tempo': 140},
+    'neutral': {'energy': 0.5, 'tempo': 100}
+}
+
+def normalize_value(value, min_val, max_val):
+    """Normalize a value to range 0-1"""
+    return float(np.clip((value - min_val) / (max_val - min_val), 0, 1))
+
+def hz_to_mel(frequencies):
+    """Slaney mel scale: linear below 1 kHz, logarithmic above (librosa's default)"""
+    frequencies = np.asanyarray(frequencies, dtype=np.float64)
+    mels = frequencies / (200.0 / 3)
+    log_region = frequencies >= 1000.0
+    return np.where(log_region, 15.0 + np.log(np.maximum(frequencies, 1e-10) / 1000.0) / (np.log(6.4) / 27.0), mels)
+
+def mel_to_hz(mels):
+    mels = np.asanyarray(mels, dtype=np.float64)
+    return np.where(mels >= 15.0, 1000.0 * np.exp((np.log(6.4) / 27.0) * (mels - 15.0)), mels * (200.0 / 3))
+
+def mel_filterbank(rate, n_fft, n_mels):
+    """Slaney-normalised triangular mel filters, shape (n_mels, n_fft // 2 + 1)"""
+    fft_freqs = np.fft.rfftfreq(n_fft, 1.0 / rate)
+    mel_freqs = mel_to_hz(np.linspace(hz_to_mel(0.0), hz_to_mel(rate / 2.0), n_mels + 2))
+    widths = np.diff(mel_freqs)
+    ramps = mel_freqs[:, None] - fft_freqs[None, :]
+    lower = -ramps[:-2] / widths[:-1, None]
+    upper = ramps[2:] / widths[1:, None]
+    weights = np.maximum(0, np.minimum(lower, upper))
+    weights *= (2.0 / (mel_freqs[2:] - mel_freqs[:-2]))[:, None]
+    return weights.astype(np.float32)
+
+def dct_matrix(n_out, n_in):
+    """Orthonormal DCT-II, as used for MFCCs"""
+    basis = np.cos(np.pi / n_in * (np.arange(n_in) + 0.5)[None, :] * np.arange(n_out)[:, None])
+    basis *= np.sqrt(2.0 / n_in)
+    basis[0] /= np.sqrt(2.0)
+    return basis.astype(np.float32)
+
+# Incremental stress/emotion analyzer: frames go in as they are captured, memory stays constant
+class StreamingStressAnalyzer:
+    """Keeps running feature statistics instead of the audio itself.
+
+    Frames are laid out as librosa does with center=True: half a window of padding before
+    the first sample and after the last (zeros for the STFT and RMS, edge copies for the
+    zero-crossing rate), so analyze() matches the notebook's features. Per frame it computes
+    RMS, zero-crossing rate and spectral centroid/bandwidth/rolloff into whole-utterance sums
+    and a ring covering the last STRESS_WINDOW_SECONDS. MFCCs need the log-mel spectrum
+    clipped at STRESS_TOP_DB below its loudest value, which is only known at the end, so
+    per-band histograms of the log-mel values are kept instead. Tempo comes from a bounded
+    history of onset strengths. analyze() can be called at any point; it scores everything
+    fed so far without consuming it.
+    """
+    FEATURES = ['rms', 'zero_crossing_rate', 'spectral_centroid', 'spectral_bandwidth',
+                'spectral_rolloff'] + [f'mfcc_{i}' for i in range(1, STRESS_N_MFCC + 1)]
+    FRAME_FEATURES = 5  # FEATURES measured directly on each frame; the MFCCs follow from the log-mel means
+
+    def __init__(self, rate, window_seconds=STRESS_WINDOW_SECONDS, tempo_seconds=STRESS_TEMPO_SECONDS):
+        self.resampler = LinearResampler(rate, STRESS_RATE)
+        self.window = np.hanning(STRESS_N_FFT + 1)[:-1].astype(np.float32)  # Periodic Hann, as librosa uses
+        self.freqs = np.fft.rfftfreq(STRESS_N_FFT, 1.0 / STRESS_RATE).astype(np.float32)
+        self.mel = mel_filterbank(STRESS_RATE, STRESS_N_FFT, STRESS_N_MELS)
+        self.dct = dct_matrix(STRESS_N_MFCC, STRESS_N_MELS)
+        self.frame_rate = STRESS_RATE / STRESS_HOP
+        self.pending = None  # Zero-padded samples not yet framed; fewer than STRESS_N_FFT + STRESS_HOP
+        self.pending_edge = None  # The same samples, edge-padded for the zero-crossing rate
+        self.sums = np.zeros(self.FRAME_FEATURES)
+        self.frames = 0
+        self.recent = np.zeros((max(1, int(window_seconds * self.frame_rate)), self.FRAME_FEATURES))
+        self.recent_log_mel = np.zeros((len(self.recent), STRESS_N_MELS), dtype=np.float32)
+        self.mel_counts = np.zeros((STRESS_N_MELS, STRESS_DB_BINS), dtype=np.int64)
+        self.mel_sums = np.zeros((STRESS_N_MELS, STRESS_DB_BINS))
+        self.log_mel_max = -np.inf
+        self.onsets = deque(maxlen=max(4, int(tempo_seconds * self.frame_rate)))
+        self.previous_log_mel = None
+        self.energy_sum = 0.0
+        self.energy_count = 0
+        self.peak_square = 0.0
+
+    def feed(self, samples):
+        """Add float32 samples (array or raw bytes) or int16 samples at the capture rate"""
+        samples = np.frombuffer(samples, dtype=np.float32) if isinstance(samples, (bytes, bytearray, memoryview)) else np.asarray(samples)
+        if samples.dtype == np.int16:
+            samples = samples.astype(np.float32) / 32768.0
+        samples = self.resampler.process(samples.astype(np.float32, copy=False))
+        if not len(samples):
+            return
+        squares = np.square(samples, dtype=np.float64)
+        self.energy_sum += float(squares.sum())
+        self.energy_count += len(samples)
+        self.peak_square = max(self.peak_square, float(squares.max()))
+
+        if self.pending is None:
+            self.pending = np.zeros(STRESS_N_FFT // 2, dtype=np.float32)
+            self.pending_edge = np.full(STRESS_N_FFT // 2, samples[0], dtype=np.float32)
+        self.pending = np.concatenate((self.pending, samples))
+        self.pending_edge = np.concatenate((self.pending_edge, samples))
+        if len(self.pending) < STRESS_N_FFT:
+            return
+        count = 1 + (len(self.pending) - STRESS_N_FFT) // STRESS_HOP
+        self._add_frames(*self._measure(self.pending, self.pending_edge, count))
+        self.pending = self.pending[count * STRESS_HOP:].copy()
+        self.pending_edge = self.pending_edge[count * STRESS_HOP:].copy()
+
+    def _measure(self, samples, edge_samples, count):
+        """(per-frame features, log-mel spectra) of the first count frames of samples"""
+        frames = np.lib.stride_tricks.sliding_window_view(samples, STRESS_N_FFT)[::STRESS_HOP][:count]
+        rms = np.sqrt(np.mean(np.square(frames), axis=1))
+        # librosa.zero_crossings: near-zero samples count as zero, and zero as positive
+        edge_frames = np.lib.stride_tricks.sliding_window_view(edge_samples, STRESS_N_FFT)[::STRESS_HOP][:count]
+        negative = np.signbit(edge_frames) & (np.abs(edge_frames) > 1e-10)
+        zcr = np.sum(negative[:, 1:] != negative[:, :-1], axis=1) / STRESS_N_FFT
+
+        spectrum = np.abs(np.fft.rfft(frames * self.window, axis=1)).astype(np.float32)
+        total = np.maximum(spectrum.sum(axis=1), 1e-10)
+        centroid = spectrum @ self.freqs / total
+        spread = np.square(self.freqs[None, :] - centroid[:, None])
+        bandwidth = np.sqrt(np.sum(spectrum * spread, axis=1) / total)
+        energy = np.cumsum(spectrum, axis=1)
+        rolloff = self.freqs[np.minimum(np.argmax(energy >= 0.85 * energy[:, -1:], axis=1), len(self.freqs) - 1)]
+
+        log_mel = 10.0 * np.log10(np.maximum(np.square(spectrum) @ self.mel.T, 1e-10))
+        return np.column_stack((rms, zcr, centroid, bandwidth, rolloff)).astype(np.float64), log_mel
+
+    def _add_frames(self, values, log_mel):
+        self.log_mel_max = max(self.log_mel_max, float(log_mel.max()))
+        bins = np.clip(((log_mel - STRESS_DB_MIN) / STRESS_DB_STEP).astype(np.int64), 0, STRESS_DB_BINS - 1)
+        flat = (np.arange(STRESS_N_MELS) * STRESS_DB_BINS + bins).ravel()
+        np.add.at(self.mel_counts.reshape(-1), flat, 1)
+        np.add.at(self.mel_sums.reshape(-1), flat, log_mel.ravel())
+
+        # Onset strength: median positive change in the clipped log-mel spectrum between frames
+        clipped = np.maximum(log_mel, self.log_mel_max - STRESS_TOP_DB)
+        stacked = clipped if self.previous_log_mel is None else np.vstack((self.previous_log_mel, clipped))
+        if len(stacked) > 1:
+            self.onsets.extend(np.median(np.maximum(0.0, np.diff(stacked, axis=0)), axis=1).tolist())
+        self.previous_log_mel = clipped[-1:]
+
+        self.sums += values.sum(axis=0)
+        positions = (self.frames + np.arange(len(values))) % len(self.recent)
+        self.recent[positions[-len(self.recent):]] = values[-len(self.recent):]
+        self.recent_log_mel[positions[-len(self.recent):]] = log_mel[-len(self.recent):]
+        self.frames += len(values)
+
+    def _tail(self):
+        """The frames the end padding adds, measured without consuming anything"""
+        if self.pending is None:
+            return np.empty((0, self.FRAME_FEATURES)), np.empty((0, STRESS_N_MELS), dtype=np.float32)
+        padding = STRESS_N_FFT // 2
+        samples = np.concatenate((self.pending, np.zeros(padding, dtype=np.float32)))
+        edge_samples = np.concatenate((self.pending_edge, np.full(padding, self.pending_edge[-1], dtype=np.float32)))
+        count = 1 + (len(samples) - STRESS_N_FFT) // STRESS_HOP if len(samples) >= STRESS_N_FFT else 0
+        return self._measure(samples, edge_samples, count)
+
+    def clipped_log_mel_sums(self, floor):
+        """Per-band sums of max(log-mel, floor) over every added frame, from the histograms"""
+        edge = min(max(int((floor - STRESS_DB_MIN) // STRESS_DB_STEP), 0), STRESS_DB_BINS - 1)
+        below = self.mel_counts[:, :edge].sum(axis=1) * floor
+        straddling = np.maximum(self.mel_sums[:, edge], self.mel_counts[:, edge] * floor)
+        return below + straddling + self.mel_sums[:, edge + 1:].sum(axis=1)
+
+    def tempo(self):
+        """Speaking tempo in BPM from the autocorrelation of recent onset strengths"""
+        onsets = np.asarray(self.onsets)
+        if len(onsets) < 4 or not onsets.any():
+            return 120.0
+        onsets = onsets - onsets.mean()
+        autocorrelation = np.correlate(onsets, onsets, mode="full")[len(onsets) - 1:]
+        lags = np.arange(1, len(autocorrelation))
+        bpms = 60.0 * self.frame_rate / lags
+        valid = (bpms >= 30) & (bpms <= 300)
+        if not valid.any():
+            return 120.0
+        # Log-normal prior around 120 BPM, one octave wide, like librosa's tempo estimator
+        prior = np.exp(-0.5 * np.log2(bpms[valid] / 120.0) ** 2)
+        return float(bpms[valid][np.argmax(autocorrelation[1:][valid] * prior)])
+
+    def features(self, recent=False):
+        """Normalised features for the whole utterance, or only the sliding window"""
+        tail_values, tail_log_mel = self._tail()
+        count = self.frames + len(tail_values)
+        if not count:
+            return None
+        if recent:
+            order = np.arange(max(0, self.frames - len(self.recent)), self.frames) % len(self.recent)
+            values = np.vstack((self.recent[order], tail_values))[-len(self.recent):]
+            log_mel = np.vstack((self.recent_log_mel[order], tail_log_mel))[-len(self.recent):]
+            means = values.mean(axis=0)
+            mel_means = np.maximum(log_mel, log_mel.max() - STRESS_TOP_DB).mean(axis=0)
+        else:
+            means = (self.sums + tail_values.sum(axis=0)) / count
+            floor = max(self.log_mel_max, float(tail_log_mel.max(initial=-np.inf))) - STRESS_TOP_DB
+            mel_means = (self.clipped_log_mel_sums(floor) + np.maximum(tail_log_mel, floor).sum(axis=0)) / count
+        values = dict(zip(self.FEATURES, np.concatenate((means, mel_means @ self.dct.T))))
+        nyquist = STRESS_RATE / 2
+        features = {
+            'rms': float(np.clip(values['rms'] * 10, 0, 1)),
+            'zero_crossing_rate': float(np.clip(values['zero_crossing_rate'], 0, 1)),
+            'spectral_centroid': normalize_value(values['spectral_centroid'], 0, nyquist),
+            'spectral_bandwidth': normalize_value(values['spectral_bandwidth'], 0, nyquist),
+            'spectral_rolloff': normalize_value(values['spectral_rolloff'], 0, nyquist),
+            'tempo': normalize_value(self.tempo(), 50, 200),
+        }
+        for i in range(1, STRESS_N_MFCC + 1):
+            features[f'mfcc_{i}'] = normalize_value(values[f'mfcc_{i}'], -100, 100)
+        # Digital silence has no peak to normalise against; it simply carries no energy
+        features['energy'] = (normalize_value(self.energy_sum / self.energy_count, 0, self.peak_square)
+                              if self.peak_square > 0 else 0.0)
+        return features
+
+    def analyze(self):
+        """Scores for the whole utterance plus the most recent window; None before any audio"""
+        features = self.features()
+        if features is None:
+            return None
+        result = score_emotion(features)
+        result["seconds"] = round(self.energy_count / STRESS_RATE, 2)
+        result["recent"] = score_emotion(self.features(recent=True))
+        return result
+
+def calculate_stress_score(features):
+    return float(np.clip(
+        features['spectral_rolloff'] * 0.4 +
+        features['zero_crossing_rate'] * 0.3 +
+        features['energy'] * 0.3,
+        0, 1
+    ))
+
+def calculate_stress_level(features):
+    stress_score = calculate_stress_score(features)
+    if stress_score > 0.7:
+        return "High Stress"
+    elif stress_score > 0.4:
+        return "Moderate Stress"
+    else:
+        return "Low Stress"
+
+def score_emotion(features):
+    """The stress notebook's AudioEmotionAnalyzer.analyze_emotion on a feature dict"""
+    emotion_scores = {}
+    mfcc_variation = np.clip(np.std([features[f'mfcc_{i}'] for i in range(1, 14)]), 0, 1)
+    for emotion, thresholds in EMOTION_THRESHOLDS.items():
+        energy_score = 1 - abs(features['energy'] - thresholds['energy'])
+        tempo_score = 1 - abs(features['tempo'] - normalize_value(thresholds['tempo'], 50, 200))
+        emotion_scores[emotion] = float(np.clip(
+            energy_score * 0.3 +
+            tempo_score * 0.3 +
+            (1 - mfcc_variation) * 0.2 +
+            features['spectral_centroid'] * 0.2,
+            0, 1
+        ) * 100)
+
+    # Normalize scores to ensure they sum to 100%
+    total = sum(emotion_scores.values())
+    if total > 0:
+        emotion_scores = {k: round(v / total * 100, 2) for k, v in emotion_scores.items()}
+
+    return {
+        'dominant_emotion': max(emotion_scores.items(), key=lambda x: x[1])[0],
+        'emotion_scores': emotion_scores,
+        'stress_level': calculate_stress_level(features),
+        'stress_score': round(calculate_stress_score(features), 4),
+        'confidence': max(emotion_scores.values())
+    }
+
 # Voice Assistant class with multilingual support
 class VoiceAssistant:
-    def __init__(self):
-        self.recognizer = sr.Recognizer()
-        self.audio_queue = queue.Queue()
+    def __init__(self, backend=None, device=None):
+        self.backend = backend or create_speech_backend()
+        self.device = device or get_audio_device()
+        self.audio_queue = self.device.audio_queue  # Filled by the device's capture callback
         self.is_recording = False
+        self.max_record_seconds = 300
+        self.last_stress_analysis = None  # Scores for the most recent listen()/record_audio() utterance
         
+    def create_stress_analyzer(self, rate):
+        return StreamingStressAnalyzer(rate) if STRESS_ANALYSIS_ENABLED else None
+
+    @staticmethod
+    def score_stress(analyzer):
+        """analyzer.analyze(), or None if scoring fails; stress scores never cost the patient their recording"""
+        try:
+            with stage_timer("stress"):
+                return analyzer.analyze()
+        except Exception as e:
+            record_error("stress", e)
+            print(f"Error analyzing voice stress: {e}")
+            return None
+
+    def finish_stress_analysis(self, analyzer):
+        if analyzer is None:
+            return None
+        self.last_stress_analysis = self.score_stress(analyzer)
+        return self.last_stress_analysis
+
+    def analyze_stress(self, frames, rate, block_seconds=1):
+        """Stress/emotion scores for a finished recording, fed to the analyzer in blocks"""
+        if getattr(frames, "stress_analysis", None) is not None:
+            return frames.stress_analysis  # Already scored while it was being recorded
+        analyzer = self.create_stress_analyzer(rate)
+        if analyzer is None:
+            return None
+        try:
+            if isinstance(frames, AudioRingBuffer):
+                samples = frames.samples()
+            elif isinstance(frames, np.ndarray):
+                samples = frames
+            else:
+                samples = np.frombuffer(b''.join(frames), dtype=np.float32)
+            block = int(rate * block_seconds)
+            for start in range(0, len(samples), block):
+                analyzer.feed(samples[start:start + block])
+        except Exception as e:
+            record_error("stress", e)
+            print(f"Error analyzing voice stress: {e}")
+            return None
+        return self.score_stress(analyzer)
+
     def record_audio(self):
-        # Audio recording parameters
-        CHUNK = 1024
-        FORMAT = pyaudio.paFloat32
-        CHANNELS = 1
-        RATE = 44100
-        
-        p = pyaudio.PyAudio()
-        
-        stream = p.open(format=FORMAT,
-                       channels=CHANNELS,
-                       rate=RATE,
-                       input=True,
-                       frames_per_buffer=CHUNK)
-        
+        """Record until Enter is pressed; returns (AudioRingBuffer, rate)"""
         print("\nRecording... Press Enter to stop")
         self.is_recording = True
-        frames = []
-        
-        # Start recording thread
-        def record():
-            while self.is_recording:
-                data = stream.read(CHUNK)
-                frames.append(data)
+        frames = AudioRingBuffer(self.device.rate, self.max_record_seconds)
+        analyzer = self.create_stress_analyzer(self.device.rate)
+
+        def capture(chunk):
+            chunk = chunk[:frames.capacity - frames.written]  # Never wrap over the start of the recording
+            if len(chunk) == 0:
+                return
+            frames.write(chunk)
+            if analyzer is not None:
+                analyzer.feed(chunk)
                 
         # Start input thread
+        stopped = threading.Event()
+
         def wait_for_input():
-            input()  # Wait for Enter key
-            self.is_recording = False
+            if wait_for_enter(stopped):
+                self.is_recording = False
             
-        record_thread = threading.Thread(target=record)
-        input_thread = threading.Thread(target=wait_for_input)
-        
-        record_thread.start()
-        input_thread.start()
+        input_thread = threading.Thread(target=wait_for_input, daemon=True)
+        with stage_timer("record"):
+            self.device.start()
+            input_thread.start()
+            try:
+                while self.is_recording:
+                    chunk = self.device.read()
+                    if chunk is not None:
+                        capture(chunk)
+                        if frames.full:
+                            print(f"\nRecording limit of {self.max_record_seconds} seconds reached; recording stopped.")
+                            self.is_recording = False
+            finally:
+                stopped.set()
+                self.device.stop()
         
-        # Wait for recording to finish
-        record_thread.join()
-        input_thread.join()
-        
-        stream.stop_stream()
-        stream.close()
-        p.terminate()
-        
-        return frames, RATE
+        # Keep what was captured between the key press and the stream stopping
+        while not frames.full:
+            chunk = self.device.read(timeout=0)
+            if chunk is None:
+                break
+            capture(chunk)
+        frames.stress_analysis = self.finish_stress_analysis(analyzer)
+        return frames, self.device.rate
         
+    def to_audio_data(self, frames, rate):
+        """Build an sr.AudioData directly from recorded audio, with no temporary WAV file.
+
+        frames is an AudioRingBuffer (left intact) or a list of raw float32 chunks as returned
+        by older callers.
+        """
+        import speech_recognition as sr
+
+        return sr.AudioData(memoryview(self.to_int16(frames)).cast('B'), rate, 2)  # 2 bytes for int16
+
+    def to_int16(self, frames):
+        if isinstance(frames, np.ndarray) and frames.dtype == np.int16:
+            return frames  # Already converted, e.g. by the service's audio process pool
+        if isinstance(frames, AudioRingBuffer):
+            return float32_to_int16_copy(frames.samples())  # The recording may still be scored or replayed
+        return float32_to_int16_inplace(np.frombuffer(b''.join(frames), dtype=np.float32).copy())
+
     def transcribe_audio(self, frames, rate, language_code="en-US"):
         """Transcribe audio with support for multiple languages"""
-        # Convert frames to audio data
-        audio_data = b''.join(frames)
-        audio_array = np.frombuffer(audio_data, dtype=np.float32)
-        
-        # Convert float32 audio to int16 (required for WAV)
-        audio_array_int = (audio_array * 32767).astype(np.int16)
-        
-        # Create a temporary WAV file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_wav:
-            with wave.open(temp_wav.name, 'wb') as wf:
-                wf.setnchannels(1)
-                wf.setsampwidth(2)  # 2 bytes for int16
-                wf.setframerate(rate)
-                wf.writeframes(audio_array_int.tobytes())
-        
-        # Use speech recognition with the temporary file
-        try:
-            with sr.AudioFile(temp_wav.name) as source:
-                audio = self.recognizer.record(source)
-                # Use the specified language for recognition
-                text = self.recognizer.recognize_google(audio, language=language_code)
-                
-            # Clean up the temporary file
-            os.unlink(temp_wav.name)
-            return text
-            
-        except sr.UnknownValueError:
+        # Use the specified language for recognition
+        with stage_timer("transcribe", backend=self.backend.name):
+            text, error = self.backend.recognize(self.to_int16(frames), rate, language_code)
+        if error is not None:
+            record_error("transcribe", error)
+        if error == "unknown":
             return "Could not understand audio"
-        except sr.RequestError:
+        if error == "request":
             return "Could not request results"
-        finally:
-            # Ensure temp file is deleted even if an error occurs
-            if os.path.exists(temp_wav.name):
-                os.unlink(temp_wav.name)
-                
+        return text
+
+    def recognize_segment(self, segment, rate, language_code):
+        """Recognize one int16 speech segment; returns (text, error) with error None, 'unknown' or 'request'"""
+        return self.backend.recognize(segment, rate, language_code)
+
+    def fallback_backend(self):
+        """Google recognition to retry segments the configured backend failed on (None if it is Google)"""
+        if isinstance(self.backend, HybridSpeechBackend):
+            return self.backend.remote
+        if isinstance(self.backend, GoogleSpeechBackend):
+            return None
+        if getattr(self, "_fallback_backend", None) is None:
+            self._fallback_backend = GoogleSpeechBackend()
+        return self._fallback_backend
+
+    def segment_result(self, future, segment, language_code):
+        """(text, error) for a submitted segment, retrying on Google if the backend raised"""
+        error = future.exception()  # Already counted by the segment's transcribe span
+        if error is None:
+            return future.result()
+        print(f"Error recognizing speech with {self.backend.name}: {error}")
+        try:
+            fallback = self.fallback_backend()
+            if fallback is not None:
+                return fallback.recognize(segment, RECOGNITION_RATE, language_code)
+        except Exception as e:
+            record_error("transcribe", e)
+            print(f"Error recognizing speech: {e}")
+        return "", "request"
+
+    def stream_transcribe(self, source, language_code="en-US", on_segment=None, vad=None):
+        """Capture from source, cut speech segments with the VAD and recognize each as soon as it closes.
+
+        Recognition of earlier segments overlaps with the patient still speaking; only the
+        current segment is held in memory. on_segment(index, text) is called as results arrive.
+        """
+        vad = vad or EnergyVAD()
+        resampler = LinearResampler(source.rate, RECOGNITION_RATE)
+        analyzer = self.create_stress_analyzer(source.rate)
+        self.last_stress_analysis = None
+        futures = []
+
+        def submit(segment):
+            index = len(futures)
+            context = contextvars.copy_context()
+            submitted = time.perf_counter()
+            future = self.backend.submit(segment, RECOGNITION_RATE, language_code)
+
+            def done(f):
+                # Time from the segment closing to its text being ready, recorded on the session's trace
+                failure = f.exception()
+                error = type(failure).__name__ if failure is not None else f.result()[1]
+                context.run(record_span, "transcribe", time.perf_counter() - submitted, error,
+                            backend=self.backend.name, samples=len(segment))
+                if on_segment is not None and failure is None:
+                    on_segment(index, f.result()[0])  # Failed segments are reported after their retry
+            future.add_done_callback(done)
+            futures.append((future, segment))
+
+        with stage_timer("record", language=language_code) as timer:
+            for chunk in source:
+                if analyzer is not None:
+                    analyzer.feed(chunk)
+                for segment in vad.process(float32_to_int16(resampler.process(chunk))):
+                    submit(segment)
+                if vad.end_of_turn():
+                    source.stop()
+            for segment in vad.flush():
+                submit(segment)
+            timer.annotate(segments=len(futures))
+        self.finish_stress_analysis(analyzer)
+        with stage_timer("transcribe_wait"):
+            results = []
+            for index, (future, segment) in enumerate(futures):
+                results.append(self.segment_result(future, segment, language_code))
+                if on_segment is not None and future.exception() is not None:
+                    on_segment(index, results[-1][0])
+
+        text = " ".join(text for text, _ in results if text)
+        if text:
+            return text
+        if any(error == "request" for _, error in results):
+            return "Could not request results"
+        return "Could not understand audio"
+
+    def listen(self, language_code="en-US"):
+        """Record from the microphone with voice-activity endpointing and transcribe while recording"""
+        print("\nRecording... Press Enter to stop (or just pause when you are done)")
+        return self.stream_transcribe(MicrophoneSource(device=self.device), language_code)
+
     # Map language codes to Google Speech Recognition language codes
     def get_speech_recognition_code(self, lang_code):
         """Convert ISO language code to Google Speech Recognition language code"""
@@ -258,30 +2959,328 @@ class VoiceAssistant:
         }
         
         return speech_codes.get(lang_code, "en-US")  # Default to en-US if not found
+
+def _legacy_audio_data(frames, rate):
+    """The old transcribe_audio conversion: join, scale, write a temp WAV and read it back"""
+    import speech_recognition as sr
+
+    audio_array = np.frombuffer(b''.join(frames), dtype=np.float32)
+    audio_array_int = (audio_array * 32767).astype(np.int16)
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_wav:
+        with wave.open(temp_wav.name, 'wb') as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(rate)
+            wf.writeframes(audio_array_int.tobytes())
+    try:
+        with sr.AudioFile(temp_wav.name) as source:
+            return sr.Recognizer().record(source)
+    finally:
+        os.unlink(temp_wav.name)
+
+def benchmark_audio_path(durations=(10, 60, 300), rate=44100, chunk=1024):
+    """Compare peak memory and latency of the temp-WAV and in-memory paths (recognition itself excluded)"""
+    import tracemalloc
+
+    voice = VoiceAssistant()
+    results = []
+    for seconds in durations:
+        total = int(seconds * rate)
+        signal = (0.3 * np.sin(np.arange(total, dtype=np.float32) * (2 * np.pi * 220 / rate))).astype(np.float32)
+        chunks = [signal[i:i + chunk].tobytes() for i in range(0, total, chunk)]
+
+        row = {"seconds": seconds}
+        for name in ("temp_wav", "in_memory"):
+            tracemalloc.start()
+
+            # Capture: the old path appends bytes chunks to a list, the new one fills a preallocated buffer
+            start = time.perf_counter()
+            if name == "temp_wav":
+                frames = []
+                for i in range(0, total, chunk):
+                    frames.append(signal[i:i + chunk].tobytes())
+            else:
+                frames = AudioRingBuffer(rate, max(seconds, 1))
+                for i in range(0, total, chunk):
+                    frames.write(signal[i:i + chunk])
+            capture = time.perf_counter() - start
+
+            # Conversion: the latency the patient waits for after pressing Enter, before recognition
+            start = time.perf_counter()
+            if name == "temp_wav":
+                audio = _legacy_audio_data(frames, rate)
+            else:
+                audio = voice.to_audio_data(frames, rate)
+            conversion = time.perf_counter() - start
+
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            row[f"{name}_capture_ms"] = round(capture * 1000, 1)
+            row[f"{name}_convert_ms"] = round(conversion * 1000, 1)
+            row[f"{name}_peak_mb"] = round(peak / 2 ** 20, 1)
+            del frames, audio
+        results.append(row)
+        print(f"{seconds:>4}s  temp WAV: {row['temp_wav_convert_ms']:8.1f} ms, {row['temp_wav_peak_mb']:7.1f} MB peak | "
+              f"in-memory: {row['in_memory_convert_ms']:8.1f} ms, {row['in_memory_peak_mb']:7.1f} MB peak")
+    return results
+
+def load_wav_corpus(corpus_dir, rate=RECOGNITION_RATE):
+    """Load every WAV in a directory as 16 kHz int16 arrays, sorted by file name"""
+    corpus = []
+    for name in sorted(os.listdir(corpus_dir)):
+        if not name.lower().endswith(".wav"):
+            continue
+        source = WavFileSource(os.path.join(corpus_dir, name))
+        resampler = LinearResampler(source.rate, rate)
+        samples = np.concatenate([resampler.process(chunk) for chunk in source] or [np.empty(0, dtype=np.float32)])
+        corpus.append((name, float32_to_int16(samples)))
+    return corpus
+
+def benchmark_speech_backends(corpus_dir="asr_corpus", language_code="en-US", backends=("google", "vosk")):
+    """Compare per-utterance latency and batch throughput of speech backends on a fixed WAV corpus"""
+    corpus = load_wav_corpus(corpus_dir)
+    if not corpus:
+        print(f"No WAV files found in {corpus_dir}")
+        return []
+    audio_seconds = sum(len(samples) for _, samples in corpus) / RECOGNITION_RATE
+    results = []
+
+    for name in backends:
+        backend = create_speech_backend(name)
+        if not backend.supports(language_code):
+            print(f"{name}: no model for {language_code}, skipped")
+            continue
+
+        # Warm up (loads local models once) before timing
+        backend.recognize(corpus[0][1], RECOGNITION_RATE, language_code)
+
+        latencies = []
+        for _, samples in corpus:
+            start = time.perf_counter()
+            backend.recognize(samples, RECOGNITION_RATE, language_code)
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        futures = [backend.submit(samples, RECOGNITION_RATE, language_code) for _, samples in corpus]
+        transcripts = [future.result()[0] for future in futures]
+        batch_seconds = time.perf_counter() - start
+
+        latencies.sort()
+        row = {
+            "backend": name,
+            "utterances": len(corpus),
+            "audio_s": round(audio_seconds, 1),
+            "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+            "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+            "batch_s": round(batch_seconds, 2),
+            "real_time_factor": round(batch_seconds / audio_seconds, 3),
+            "recognized": sum(1 for text in transcripts if text)
+        }
+        results.append(row)
+        print(json.dumps(row))
+    return results
 #cell7
+# Response cache settings; opt in per deployment with VIRTUAL_DOCTOR_RESPONSE_CACHE=1
+RESPONSE_CACHE_ENABLED = os.environ.get("VIRTUAL_DOCTOR_RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_SIZE = 2000
+RESPONSE_CACHE_TTL = 24 * 3600
+RESPONSE_CACHE_NEAR_DUPLICATE = None  # e.g. 0.85 to reuse answers for near-identical symptom wording
+PROMPT_TEMPLATE_VERSION = "v1"  # Bump whenever the prompt template changes so old answers are not reused
+
+# Prompt budget (in estimated tokens) so prompt cost and latency stay flat as history grows
+PROMPT_TOKEN_BUDGET = 1200
+PROMPT_SYMPTOM_TOKENS = 400
+PROMPT_HISTORY_CANDIDATES = 10  # Latest records considered for the detailed part of the history
+PROMPT_HISTORY_RECORD_TOKENS = 120
+
+def estimate_tokens(text):
+    """Cheap token estimate (about 4 characters per token for English prompts)"""
+    return len(text) // 4 + 1
+
+def truncate_to_tokens(text, max_tokens):
+    """Shorten text to the budget, keeping its start and its end (where follow-up questions are)"""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    head = max_chars // 3
+    tail = max_chars - head - 5
+    return text[:head].rstrip() + " ... " + text[-tail:].lstrip()
+
+# Caches model answers by normalized symptoms + history digest and coalesces identical in-flight requests
+class ResponseCache(LRUCache):
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl_seconds=RESPONSE_CACHE_TTL,
+                 near_duplicate_threshold=RESPONSE_CACHE_NEAR_DUPLICATE):
+        super().__init__(max_entries, ttl_seconds)
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.token_index = OrderedDict()  # key -> (history digest, token set) for near-duplicate lookup
+        self.in_flight = {}  # key -> Future shared by every caller waiting on the same request
+        self.coalesced = 0
+        self.near_hits = 0
+
+    @staticmethod
+    def normalize(symptoms):
+        text = re.sub(r'[^\w\s]', ' ', symptoms.lower())
+        return " ".join(text.split())
+
+    def make_key(self, symptoms, history_text):
+        history_digest = hashlib.sha256(history_text.encode('utf-8')).hexdigest()
+        normalized = self.normalize(symptoms)
+        key = hashlib.sha256(f"{PROMPT_TEMPLATE_VERSION}|{history_digest}|{normalized}".encode('utf-8')).hexdigest()
+        return key, history_digest, frozenset(normalized.split())
+
+    def find_near_duplicate(self, history_digest, tokens):
+        """Return a cached answer whose symptom tokens overlap enough (Jaccard) with these"""
+        if not self.near_duplicate_threshold or not tokens:
+            return None
+        with self.lock:
+            best_key, best_score = None, 0.0
+            for key, (digest, other) in self.token_index.items():
+                if digest != history_digest:
+                    continue
+                score = len(tokens & other) / len(tokens | other)
+                if score > best_score:
+                    best_key, best_score = key, score
+            if best_key is None or best_score < self.near_duplicate_threshold:
+                return None
+            value = self.get(best_key)
+            if value is not None:
+                self.near_hits += 1
+                self.misses -= 1  # Count the request once, as a hit, rather than exact miss + hit
+            return value
+
+    def claim(self, symptoms, history_text):
+        """Return ("hit", answer), ("wait", future) or ("owner", token) for this request"""
+        key, history_digest, tokens = self.make_key(symptoms, history_text)
+        value = self.get(key)
+        if value is not None:
+            metrics.inc("response_cache_hits")
+            return "hit", value
+        value = self.find_near_duplicate(history_digest, tokens)
+        if value is not None:
+            metrics.inc("response_cache_near_hits")
+            return "hit", value
+
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                metrics.inc("response_cache_coalesced")
+                return "wait", future
+            future = Future()
+            self.in_flight[key] = future
+        metrics.inc("response_cache_misses")
+        return "owner", (key, history_digest, tokens, future)
+
+    def resolve(self, token, value=None, error=None):
+        """Finish an owned request: cache the answer and release every coalesced waiter"""
+        key, history_digest, tokens, future = token
+        with self.lock:
+            self.in_flight.pop(key, None)
+            if error is None:
+                self.set(key, value)
+                self.token_index[key] = (history_digest, tokens)
+                self.token_index.move_to_end(key)
+                while len(self.token_index) > self.max_entries:
+                    self.token_index.popitem(last=False)
+        if error is None:
+            future.set_result(value)
+        else:
+            future.set_exception(error)
+
+    def get_or_compute(self, symptoms, history_text, compute):
+        status, value = self.claim(symptoms, history_text)
+        if status == "hit":
+            return value
+        if status == "wait":
+            return value.result()
+        try:
+            result = compute()
+        except Exception as e:
+            self.resolve(value, error=e)
+            raise
+        self.resolve(value, result)
+        return result
+
+    def stats(self):
+        stats = super().stats()
+        with self.lock:
+            stats.update({
+                "near_hits": self.near_hits,
+                "coalesced": self.coalesced,
+                "in_flight": len(self.in_flight)
+            })
+        return stats
+
+default_response_cache = ResponseCache() if RESPONSE_CACHE_ENABLED else None
+
 # Virtual Doctor class with updated error handling for API
 class VirtualDoctor:
-    def __init__(self, gemini_model):
+    def __init__(self, gemini_model, response_cache=None, db=None):
         self.model = gemini_model
-        self.db = PatientDatabase()
-        try:
-            self.sentiment_analyzer = pipeline("sentiment-analysis")
-        except Exception as e:
-            print(f"Sentiment analyzer initialization failed: {e}")
-            self.sentiment_analyzer = None
+        self.db = db or PatientDatabase()
+        self.response_cache = response_cache if response_cache is not None else default_response_cache
+
+    @property
+    def sentiment_analyzer(self):
+        """Shared transformers pipeline, loaded the first time it is actually used"""
+        return model_registry.get("sentiment-analysis")
         
-    def get_medical_response(self, symptoms, patient_history=None):
-        """Generate medical response based on symptoms with improved error handling"""
-        history_text = "No previous records"
-        if patient_history:
-            history_text = "\n".join([
-                f"Date: {record.get('timestamp', 'Unknown')}, " +
-                f"Symptoms: {record.get('symptoms', 'None')}, " +
-                f"Diagnosis: {record.get('response', 'None')[:100]}..."
-                for record in patient_history[:3]  # Last 3 consultations
-            ])
-        
-        prompt = f"""
+    def build_history_text(self, patient_history=None, symptoms="", token_budget=None):
+        """Summary line plus the most recent/relevant records that fit in the token budget.
+
+        patient_history is either PatientDatabase.get_history_context() output or a plain
+        list of records in insertion order (oldest first).
+        """
+        if token_budget is None:
+            token_budget = PROMPT_TOKEN_BUDGET - PROMPT_SYMPTOM_TOKENS - estimate_tokens(self.build_prompt("", history_text=""))
+        if isinstance(patient_history, dict):
+            summary = patient_history.get("summary")
+            recent = patient_history.get("recent") or []
+        else:
+            summary = None
+            recent = list(patient_history or [])
+        recent = recent[-PROMPT_HISTORY_CANDIDATES:]
+        if not recent and not summary:
+            return "No previous records"
+
+        lines = []
+        if summary and summary.get("visits", 0) > len(recent):
+            terms = sorted(summary["terms"].items(), key=lambda item: -item[1])[:8]
+            recurring = ", ".join(f"{term} ({count})" for term, count in terms if count > 1)
+            lines.append(
+                f"{summary['visits']} records since {summary['first_visit']}"
+                + (f"; recurring complaints: {recurring}" if recurring else ""))
+        remaining = token_budget - sum(estimate_tokens(line) for line in lines)
+
+        # Newest first, with records sharing words with today's complaint moved ahead
+        words = set(re.findall(r"[a-z]{3,}", symptoms.lower())) - SUMMARY_STOPWORDS
+        def priority(item):
+            position, record = item
+            complaint = (record.get("symptoms") or record.get("followup_question") or "").lower()
+            overlap = len(words & set(re.findall(r"[a-z]{3,}", complaint)))
+            return (-overlap, -position)
+
+        chosen = []
+        for position, record in sorted(enumerate(recent), key=priority):
+            entry = summarize_consultation(record)
+            label = "Follow-up" if entry["followup"] else "Symptoms"
+            line = truncate_to_tokens(
+                f"Date: {entry['date']}, {label}: {entry['complaint'] or 'None'}, "
+                f"Advice: {entry['advice'] or 'None'}", PROMPT_HISTORY_RECORD_TOKENS)
+            cost = estimate_tokens(line)
+            if cost > remaining:
+                break
+            remaining -= cost
+            chosen.append((position, line))
+        lines.extend(line for _, line in sorted(chosen))
+        return "\n".join(lines) if lines else "No previous records"
+
+    def build_prompt(self, symptoms, patient_history=None, history_text=None):
+        if history_text is None:
+            history_text = self.build_history_text(patient_history, symptoms)
+        symptoms = truncate_to_tokens(symptoms, PROMPT_SYMPTOM_TOKENS)
+        
+        return f"""
         Act as a medical assistant providing preliminary advice. 
         The patient has reported the following symptoms: {symptoms}
         
@@ -295,16 +3294,149 @@ class VirtualDoctor:
         
         Keep responses informative but cautious, and always prioritize patient safety.
         """
+
+    def error_response(self, e):
+        record_error("model", e)
+        if isinstance(e, ModelUnavailableError):
+            return e.fallback_text
+        error_msg = str(e)
+        if "404" in error_msg or "not found" in error_msg:
+            return "I'm experiencing technical difficulties with the AI service. This may be due to an outdated model name or API version. Please contact the developer to update the application with the latest Gemini API specifications."
+        return f"I'm having trouble generating a response. Please try again later. Error: {str(e)}"
+
+    def get_medical_response(self, symptoms, patient_history=None):
+        """Generate medical response based on symptoms with improved error handling"""
+        history_text = self.build_history_text(patient_history, symptoms)
+        prompt = self.build_prompt(symptoms, history_text=history_text)
         
         try:
             # Updated to handle potential API changes
-            response = self.model.generate_content(prompt)
-            return response.text
+            with stage_timer("model", prompt_tokens=estimate_tokens(prompt)):
+                if self.response_cache is not None:
+                    return self.response_cache.get_or_compute(
+                        symptoms, history_text, lambda: self.model.generate_content(prompt).text)
+                response = self.model.generate_content(prompt)
+                return response.text
+        except Exception as e:
+            return self.error_response(e)
+
+    def stream_medical_response(self, symptoms, patient_history=None):
+        """Yield the medical response in chunks as the model generates it"""
+        history_text = self.build_history_text(patient_history, symptoms)
+        prompt = self.build_prompt(symptoms, history_text=history_text)
+
+        token = None
+        if self.response_cache is not None:
+            status, value = self.response_cache.claim(symptoms, history_text)
+            if status == "hit":
+                yield value
+                return
+            if status == "wait":
+                # An identical request is already streaming; reuse its full answer
+                try:
+                    yield value.result()
+                except Exception as e:
+                    yield self.error_response(e)
+                return
+            token = value
+
+        parts = []
+        error = None
+        completed = False
+        start = time.perf_counter()
+        try:
+            for chunk in self.model.generate_content(prompt, stream=True):
+                text = chunk.text
+                if text:
+                    if not parts:
+                        metrics.observe("model_first_chunk_seconds", time.perf_counter() - start)
+                    parts.append(text)
+                    yield text
+            completed = True
         except Exception as e:
-            error_msg = str(e)
-            if "404" in error_msg or "not found" in error_msg:
-                return "I'm experiencing technical difficulties with the AI service. This may be due to an outdated model name or API version. Please contact the developer to update the application with the latest Gemini API specifications."
-            return f"I'm having trouble generating a response. Please try again later. Error: {str(e)}"
+            error = e
+            yield ("\n\n" if parts else "") + self.error_response(e)
+        finally:
+            record_span("model", time.perf_counter() - start, prompt_tokens=estimate_tokens(prompt),
+                        chunks=len(parts), stream=True)
+            if token is not None:
+                # Never cache a partial, failed or empty answer
+                if error is None and (not completed or not parts):
+                    error = RuntimeError("Model stream ended without a complete answer")
+                self.response_cache.resolve(token, "".join(parts), error)
+
+# Splits streamed text into complete sentences as soon as their boundary arrives
+class SentenceSplitter:
+    # Sentence-ending punctuation (not list numbers like "1.") followed by whitespace, or a line break
+    BOUNDARY = re.compile(r'(?<=[.!?\u0964\u3002\uff01\uff1f])(?<![0-9][.])\s+|\n\s*')
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, text):
+        """Add streamed text; return the (sentence, separator) pairs that are now complete"""
+        self.buffer += text
+        sentences = []
+        position = 0
+        for match in self.BOUNDARY.finditer(self.buffer):
+            # A boundary at the very end may still grow (e.g. more newlines), so wait for more text
+            if match.end() == len(self.buffer):
+                break
+            sentences.append((self.buffer[position:match.start()], match.group()))
+            position = match.end()
+        self.buffer = self.buffer[position:]
+        return sentences
+
+    def flush(self):
+        """Return whatever is left once the stream has ended"""
+        rest, self.buffer = self.buffer, ""
+        if not rest:
+            return []
+        stripped = rest.rstrip()
+        return [(stripped, rest[len(stripped):])]
+
+def stream_translated_response(doctor, symptoms, patient_history, lang_code, emit=None):
+    """Stream the model's answer, translating and emitting each sentence while generation continues.
+
+    Returns (full English response, full translated response, timing) where timing holds
+    time_to_first_chunk, time_to_first_sentence and total seconds.
+    """
+    if emit is None:
+        emit = lambda text: print(text, end="", flush=True)
+
+    start = time.perf_counter()
+    timing = {"time_to_first_chunk": None, "time_to_first_sentence": None, "total": None, "sentences": 0}
+    splitter = SentenceSplitter()
+    pool = get_translation_pool()
+    pending = deque()
+    response_parts, translated_parts = [], []
+
+    def emit_ready(block):
+        # Emit translated sentences strictly in order, as soon as the head of the queue is done
+        while pending and (block or pending[0][0].done()):
+            future, separator = pending.popleft()
+            translated = future.result() + separator
+            if timing["time_to_first_sentence"] is None:
+                timing["time_to_first_sentence"] = time.perf_counter() - start
+            timing["sentences"] += 1
+            translated_parts.append(translated)
+            emit(translated)
+
+    def submit(sentences):
+        for sentence, separator in sentences:
+            pending.append((submit_in_context(pool, translate_segment, sentence, "en", lang_code), separator))
+
+    for chunk in doctor.stream_medical_response(symptoms, patient_history):
+        if timing["time_to_first_chunk"] is None:
+            timing["time_to_first_chunk"] = time.perf_counter() - start
+        response_parts.append(chunk)
+        submit(splitter.feed(chunk))
+        emit_ready(block=False)
+
+    submit(splitter.flush())
+    emit_ready(block=True)
+    timing["total"] = time.perf_counter() - start
+    return "".join(response_parts), "".join(translated_parts), timing
 
 #cell8
 # User interface functions
@@ -344,14 +3476,14 @@ def collect_patient_info(lang_code):
     info = {}
     
     questions = {
-        "name": "Please enter your name: ",
-        "age": "Please enter your age: ",
-        "gender": "Please enter your gender (Male/Female/Other): ",
-        "phone": "Please enter your phone number (optional): "
+        "name": "ask_name",
+        "age": "ask_age",
+        "gender": "ask_gender",
+        "phone": "ask_phone"
     }
     
-    for key, question in questions.items():
-        translated_question = safe_translate(question, "en", lang_code)
+    for key, message_key in questions.items():
+        translated_question = translate_ui(message_key, lang_code)
         print(translated_question, end="")
         response = input().strip()
         
@@ -362,11 +3494,399 @@ def collect_patient_info(lang_code):
     return info, lang_code
 
 #cell9
+# Model client settings
+MODEL_NAME = 'gemini-2.0-flash'
+MODEL_FAILOVER_NAMES = ('gemini-1.5-flash',)
+MODEL_REQUESTS_PER_SECOND = 5.0
+MODEL_BURST = 10
+MODEL_DEADLINE = 30.0  # Seconds allowed for a whole call, including retries
+MODEL_STREAM_IDLE_TIMEOUT = 15.0  # Seconds allowed between streamed chunks
+MODEL_MAX_RETRIES = 3
+MODEL_BREAKER_THRESHOLD = 5
+MODEL_BREAKER_RESET = 30.0
+
+FALLBACK_RESPONSE = ("The AI medical assistant is temporarily unavailable because of high demand. "
+                     "If your symptoms are severe or getting worse (for example chest pain, difficulty breathing, "
+                     "confusion, heavy bleeding or a high fever that does not come down), please go to the nearest "
+                     "health centre or call emergency services now. Otherwise, please try again in a few minutes.")
+
+class ModelUnavailableError(Exception):
+    """Raised when the model cannot answer (open circuit, rate limit, deadline or exhausted retries)"""
+    def __init__(self, message, fallback_text=FALLBACK_RESPONSE, rate_limited=False):
+        super().__init__(message)
+        self.fallback_text = fallback_text
+        self.rate_limited = rate_limited
+
+# Token bucket limiting how fast requests are sent upstream
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate  # Seconds until a token is available
+
+    def acquire(self, timeout):
+        """Wait up to timeout seconds for a token; return False if none became available"""
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire()
+            if wait == 0.0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            sleep(wait)
+
+# Circuit breaker: stop calling a failing model for a while, then let one trial call through
+class CircuitBreaker:
+    def __init__(self, failure_threshold=MODEL_BREAKER_THRESHOLD, reset_timeout=MODEL_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_progress = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self.trial_in_progress:
+                self.trial_in_progress = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.trial_in_progress = False
+
+    def release(self):
+        """Give back a half-open trial slot after a call that says nothing about the model's health"""
+        with self.lock:
+            self.trial_in_progress = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_progress = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+PERMANENT_STATUS_CODES = {400, 401, 403, 404}
+RETRYABLE_WORDS = {"quota", "exhausted", "unavailable", "overloaded", "deadline", "timeout", "internal", "connection"}
+PERMANENT_WORDS = {"invalid", "permission", "unauthenticated"}
+
+def is_retryable_error(e):
+    """Quota, overload, timeout and transient server errors are worth retrying; bad requests are not"""
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    code = getattr(e, "code", None)  # google.api_core exceptions carry the HTTP status
+    if isinstance(code, int) and code in RETRYABLE_STATUS_CODES | PERMANENT_STATUS_CODES:
+        return code in RETRYABLE_STATUS_CODES
+    # Match whole words so "generate" or "separate" never pass for "rate"; split CamelCase type names
+    name = re.sub(r"(?<=[a-z])(?=[A-Z])", " ", type(e).__name__)
+    message = f"{name} {e}".lower()
+    words = set(re.findall(r"[a-z0-9]+", message))
+    if words & PERMANENT_WORDS or {str(status) for status in PERMANENT_STATUS_CODES} & words or "not found" in message:
+        return False
+    return bool(words & RETRYABLE_WORDS
+                or {str(status) for status in RETRYABLE_STATUS_CODES} & words
+                or re.search(r"\brate[ -]?limit|\btoo many requests\b|\btimed out\b", message))
+
+# Wraps one or more GenerativeModels with rate limiting, deadlines, retries, a circuit breaker and failover
+class ResilientModelClient:
+    def __init__(self, models, requests_per_second=MODEL_REQUESTS_PER_SECOND, burst=MODEL_BURST,
+                 deadline=MODEL_DEADLINE, max_retries=MODEL_MAX_RETRIES,
+                 stream_idle_timeout=MODEL_STREAM_IDLE_TIMEOUT, breaker_threshold=MODEL_BREAKER_THRESHOLD,
+                 breaker_reset=MODEL_BREAKER_RESET):
+        # models: list of (name, model) tried in order; later entries are failovers
+        self.models = [(name, model, CircuitBreaker(breaker_threshold, breaker_reset)) for name, model in models]
+        self.bucket = TokenBucket(requests_per_second, burst)
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.stream_idle_timeout = stream_idle_timeout
+        self.stats = {"calls": 0, "retries": 0, "failovers": 0, "fallbacks": 0, "timeouts": 0, "rate_limited": 0}
+        self.stats_lock = threading.Lock()
+
+    def count(self, name):
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    def breaker_states(self):
+        return {name: breaker.state for name, _, breaker in self.models}
+
+    def _call_with_deadline(self, func, timeout):
+        """Run func on a daemon thread so a hung upstream call blocks neither the caller nor process exit"""
+        outcome = {}
+        done = threading.Event()
+
+        def run():
+            try:
+                outcome["result"] = func()
+            except BaseException as e:
+                outcome["error"] = e
+            finally:
+                done.set()
+
+        threading.Thread(target=run, daemon=True).start()
+        if not done.wait(max(timeout, 0.001)):
+            self.count("timeouts")
+            raise TimeoutError(f"Model call exceeded its {timeout:.1f}s deadline")
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome["result"]
+
+    def _attempt(self, model, prompt, stream, timeout):
+        """One upstream call; for streams, returns (first chunk, iterator) so retries stay possible until output starts"""
+        if not stream:
+            return self._call_with_deadline(lambda: model.generate_content(prompt), timeout)
+
+        def start_stream():
+            iterator = iter(model.generate_content(prompt, stream=True))
+            return next(iterator, None), iterator
+        return self._call_with_deadline(start_stream, timeout)
+
+    def generate_content(self, prompt, stream=False):
+        self.count("calls")
+        deadline = time.monotonic() + self.deadline
+        last_error = None
+
+        for index, (name, model, breaker) in enumerate(self.models):
+            if isinstance(last_error, ModelUnavailableError) and last_error.rate_limited:
+                break  # Every model shares the bucket, so failing over would not help
+            if index > 0:
+                self.count("failovers")
+            # Check the breaker before taking a token, so an open circuit never spends the shared budget
+            if not breaker.allow():
+                last_error = ModelUnavailableError(f"Circuit open for {name}")
+                continue
+            failed = False
+            for attempt in range(self.max_retries + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if not self.bucket.acquire(timeout=remaining):
+                    self.count("rate_limited")
+                    last_error = ModelUnavailableError("Model rate limit reached", rate_limited=True)
+                    break
+                try:
+                    result = self._attempt(model, prompt, stream, deadline - time.monotonic())
+                    breaker.record_success()
+                    if stream:
+                        return self._stream_rest(*result)
+                    return result
+                except Exception as e:
+                    last_error = e
+                    if not is_retryable_error(e):
+                        # Bad request or unknown model: not the service's health, so fail over without tripping
+                        break
+                    failed = True
+                    if attempt < self.max_retries:
+                        self.count("retries")
+                        # Full-jitter exponential backoff, never sleeping past the deadline
+                        backoff = random.uniform(0, min(8.0, 0.5 * (2 ** attempt)))
+                        sleep(max(0.0, min(backoff, deadline - time.monotonic())))
+            # One breaker failure per call however many attempts it took, so retries cannot trip it alone
+            if failed:
+                breaker.record_failure()
+            else:
+                breaker.release()
+
+        if last_error is not None and not isinstance(last_error, ModelUnavailableError) \
+                and not is_retryable_error(last_error):
+            raise last_error
+
+        self.count("fallbacks")
+        if isinstance(last_error, ModelUnavailableError):
+            raise last_error
+        raise ModelUnavailableError(f"Model unavailable: {last_error}")
+
+    def _stream_rest(self, first_chunk, iterator):
+        """Yield the rest of a stream read by one daemon thread, failing if it stalls for stream_idle_timeout"""
+        if first_chunk is not None:
+            yield first_chunk
+        chunks = queue.Queue()
+
+        def read():
+            try:
+                for chunk in iterator:
+                    chunks.put(("chunk", chunk))
+                chunks.put(("end", None))
+            except BaseException as e:
+                chunks.put(("error", e))
+
+        threading.Thread(target=read, daemon=True, name="model-stream").start()
+        while True:
+            try:
+                kind, value = chunks.get(timeout=self.stream_idle_timeout)
+            except queue.Empty:
+                self.count("timeouts")
+                raise TimeoutError(f"Model stream was idle for more than {self.stream_idle_timeout:.1f}s")
+            if kind == "end":
+                return
+            if kind == "error":
+                raise value
+            yield value
+
+# Local stand-in for GenerativeModel with configurable latency and failures (tests, benchmarks)
+class FakeGenerativeModel:
+    class Response:
+        def __init__(self, text):
+            self.text = text
+
+    def __init__(self, latency=0.2, error_rate=0.0, hang_rate=0.0, error_message="429 Resource has been exhausted (e.g. check quota).",
+                 text="1. Possible conditions: a common viral infection. This is not a diagnosis.\n\n2. Rest and drink plenty of fluids.\n\n3. See a doctor if the fever lasts more than three days.",
+                 chunk_size=40, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.error_message = error_message
+        self.text = text
+        self.chunk_size = chunk_size
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def _maybe_fail(self):
+        with self.lock:
+            self.calls += 1
+            roll = self.random.random()
+        if roll < self.hang_rate:
+            sleep(3600)
+        if roll < self.hang_rate + self.error_rate:
+            raise Exception(self.error_message)
+
+    def generate_content(self, prompt, stream=False):
+        sleep(self.latency)
+        self._maybe_fail()
+        if not stream:
+            return self.Response(self.text)
+        chunks = [self.text[i:i + self.chunk_size] for i in range(0, len(self.text), self.chunk_size)]
+        return iter([self.Response(chunk) for chunk in chunks])
+
+def simulate_model_overload(sessions=200, latency=0.05, error_rate=0.3, requests_per_second=50.0, deadline=2.0):
+    """Drive ResilientModelClient with a flaky FakeGenerativeModel and report how sessions fared"""
+    primary = FakeGenerativeModel(latency=latency, error_rate=error_rate, seed=1)
+    secondary = FakeGenerativeModel(latency=latency * 2, error_rate=error_rate / 3, seed=2)
+    client = ResilientModelClient([("fake-primary", primary), ("fake-secondary", secondary)],
+                                  requests_per_second=requests_per_second, burst=int(requests_per_second),
+                                  deadline=deadline)
+    outcomes = {"answered": 0, "fallback": 0, "error": 0}
+    latencies = []
+    lock = threading.Lock()
+
+    def session():
+        start = time.perf_counter()
+        try:
+            client.generate_content("fever and headache")
+            outcome = "answered"
+        except ModelUnavailableError:
+            outcome = "fallback"
+        except Exception:
+            outcome = "error"
+        with lock:
+            outcomes[outcome] += 1
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=session) for _ in range(sessions)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    report = {
+        "sessions": sessions,
+        "elapsed_s": round(elapsed, 2),
+        "outcomes": outcomes,
+        "p50_s": round(latencies[len(latencies) // 2], 3),
+        "p99_s": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 3),
+        "max_s": round(latencies[-1], 3),
+        "client": dict(client.stats),
+        "breakers": client.breaker_states(),
+        "upstream_calls": {"primary": primary.calls, "secondary": secondary.calls}
+    }
+    print(json.dumps(report, indent=4))
+    return report
+
 # Initialize Gemini API with latest model names
 def initialize_gemini(api_key):
+    import google.generativeai as genai
     genai.configure(api_key=api_key)
-    # Updated to use gemini-2.0-flash model which is available as of March 2025
-    return genai.GenerativeModel('gemini-2.0-flash')
+    # Updated to use gemini-2.0-flash model which is available as of March 2025,
+    # with failover models tried when it is overloaded or unavailable
+    models = [(name, genai.GenerativeModel(name)) for name in (MODEL_NAME,) + tuple(MODEL_FAILOVER_NAMES)]
+    return ResilientModelClient(models)
+
+# Startup benchmark: module import cost (-X importtime) and time until the first prompt is shown
+def benchmark_startup(runs=3, results_file="startup_benchmark.jsonl"):
+    script = os.path.abspath(__file__)
+    script_dir = os.path.dirname(script)
+    module_name = os.path.splitext(os.path.basename(script))[0]
+    import_us, first_prompt_s = [], []
+    slowest = []
+
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+            cwd=script_dir, capture_output=True, text=True)
+        timings = []
+        for line in result.stderr.splitlines():
+            # Format: "import time: self [us] | cumulative | imported package"
+            parts = line.split("|")
+            if not line.startswith("import time:") or len(parts) != 3 or not parts[1].strip().isdigit():
+                continue
+            timings.append((int(parts[1].strip()), parts[2].strip()))
+        module_timing = [us for us, name in timings if name == module_name]
+        if module_timing:
+            import_us.append(module_timing[0])
+        slowest = sorted(timings, reverse=True)[:10]
+
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-u", script], cwd=script_dir,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        try:
+            for line in process.stdout:
+                if "How would you like to interact" in line:
+                    first_prompt_s.append(time.perf_counter() - start)
+                    break
+        finally:
+            process.kill()
+            process.wait()
+
+    report = {
+        "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": sys.version.split()[0],
+        "runs": runs,
+        "import_ms": round(min(import_us) / 1000, 1) if import_us else None,
+        "time_to_first_prompt_ms": round(min(first_prompt_s) * 1000, 1) if first_prompt_s else None,
+        "slowest_imports_ms": [[name, round(us / 1000, 1)] for us, name in slowest]
+    }
+    print(json.dumps(report, indent=4))
+    if results_file:
+        with open(results_file, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(report) + "\n")
+    return report
 
 #cell10
 # Combined main application with text and voice options and improved API key handling
@@ -374,9 +3894,16 @@ def run_virtual_doctor():
     # Use a pre-defined API key instead of asking from the user
     api_key = r"API key"  # Developer should replace this with their actual API key
     
+    startup_pool = ThreadPoolExecutor(max_workers=1)
     try:
-        # Initialize Gemini
-        model = initialize_gemini(api_key)
+        # Initialize Gemini in the background so the menu appears immediately
+        model_future = startup_pool.submit(initialize_gemini, api_key)
+
+        # Pre-translate fixed UI text while the patient picks a mode and language
+        start_translation_warmup()
+        start_language_id_warmup()
+        if METRICS_PORT:
+            start_metrics_server(METRICS_PORT)
         
         # Ask user for input method preference
         print("\nHow would you like to interact with the Virtual Doctor?")
@@ -385,6 +3912,7 @@ def run_virtual_doctor():
         print("Enter your choice (1 or 2): ", end="")
         
         input_choice = input().strip()
+        model = model_future.result()
         
         if input_choice == "2":
             # Voice input mode (now with multilingual support)
@@ -396,10 +3924,13 @@ def run_virtual_doctor():
     except Exception as e:
         print(f"An error occurred: {str(e)}")
         print("Please try again later.")
+    finally:
+        startup_pool.shutdown(wait=False)
 
 
 #cell11
 # Text-based doctor function
+@traced("text_consultation")
 def run_text_doctor(model):
     try:
         # Select language
@@ -410,13 +3941,11 @@ def run_text_doctor(model):
         doctor = VirtualDoctor(model)
         
         # Translate welcome message
-        welcome_msg = "Welcome to the Virtual Doctor Assistant. I'm here to help with your health concerns."
-        translated_welcome = safe_translate(welcome_msg, "en", lang_code)
+        translated_welcome = translate_ui("text_welcome", lang_code)
         print(f"\n{translated_welcome}")
         
         # Collect patient information
-        patient_info_msg = "First, I need to collect some basic information."
-        translated_info_msg = safe_translate(patient_info_msg, "en", lang_code)
+        translated_info_msg = translate_ui("patient_info", lang_code)
         print(f"\n{translated_info_msg}")
         
         # Get patient info without language detection on names
@@ -426,11 +3955,10 @@ def run_text_doctor(model):
         patient_id = f"{patient_info['name']}_{patient_info.get('phone', 'unknown')}"
         
         # Get patient history
-        patient_history = doctor.db.get_patient_history(patient_id)
+        patient_history = doctor.db.get_history_context(patient_id, PROMPT_HISTORY_CANDIDATES)
         
         # Collect symptoms
-        symptoms_prompt = "Please describe your symptoms or health concerns in detail:"
-        translated_symptoms_prompt = safe_translate(symptoms_prompt, "en", lang_code)
+        translated_symptoms_prompt = translate_ui("text_symptoms_prompt", lang_code)
         print(f"\n{translated_symptoms_prompt}")
         
         symptoms_input = input().strip()
@@ -439,20 +3967,18 @@ def run_text_doctor(model):
         if len(symptoms_input.split()) > 3:  # Only detect if more than 3 words
             detected_lang = detect_language_safely(symptoms_input)
             if detected_lang != lang_code and detected_lang != "en":
-                lang_detect_msg = f"I detected that you're writing in a different language. I'll continue in this language."
-                translated_detect_msg = safe_translate(lang_detect_msg, "en", detected_lang)
+                translated_detect_msg = translate_ui("language_switch", detected_lang)
                 print(f"\n{translated_detect_msg}")
                 lang_code = detected_lang
         
         # Translate symptoms to English for processing
         english_symptoms = safe_translate(symptoms_input, lang_code, "en")
         
-        # Generate medical response
-        medical_response = doctor.get_medical_response(english_symptoms, patient_history)
-        
-        # Translate response back to user's language
-        translated_response = safe_translate(medical_response, "en", lang_code)
-        print(f"\n{translated_response}")
+        # Stream the medical response, translating it sentence by sentence
+        print()
+        medical_response, translated_response, response_timing = stream_translated_response(
+            doctor, english_symptoms, patient_history, lang_code)
+        print()
         
         # Save consultation data
         consultation_data = {
@@ -462,22 +3988,21 @@ def run_text_doctor(model):
             "translated_response": translated_response,
             "language": lang_code,
             "patient_info": patient_info,
-            "input_method": "text"
+            "input_method": "text",
+            "response_timing": response_timing
         }
         
         doctor.db.add_patient(patient_id, consultation_data)
         
         # Ask if user wants follow-up questions
-        followup_msg = "\nDo you have any follow-up questions? (yes/no)"
-        translated_followup = safe_translate(followup_msg, "en", lang_code)
-        print(translated_followup)
+        translated_followup = translate_ui("followup", lang_code)
+        print(f"\n{translated_followup}")
         
         followup_response = input().strip().lower()
         followup_response_en = safe_translate(followup_response, lang_code, "en").lower()
         
         if "yes" in followup_response_en or "y" == followup_response_en:
-            followup_prompt = "What else would you like to know?"
-            translated_followup_prompt = safe_translate(followup_prompt, "en", lang_code)
+            translated_followup_prompt = translate_ui("text_followup_prompt", lang_code)
             print(f"\n{translated_followup_prompt}")
             
             followup_input = input().strip()
@@ -485,11 +4010,10 @@ def run_text_doctor(model):
             
             # Generate follow-up response
             followup_context = f"Previous symptoms: {english_symptoms}\nFollow-up question: {english_followup}"
-            followup_response = doctor.get_medical_response(followup_context, patient_history)
-            
-            # Translate follow-up response
-            translated_followup_response = safe_translate(followup_response, "en", lang_code)
-            print(f"\n{translated_followup_response}")
+            print()
+            followup_response, translated_followup_response, _ = stream_translated_response(
+                doctor, followup_context, patient_history, lang_code)
+            print()
             
             # Save follow-up data
             doctor.db.add_patient(patient_id, {
@@ -500,15 +4024,15 @@ def run_text_doctor(model):
             })
         
         # Closing message
-        closing_msg = "\nThank you for using Virtual Doctor Assistant. Remember, this is not a replacement for professional medical advice. Please consult a healthcare provider for proper diagnosis and treatment."
-        translated_closing = safe_translate(closing_msg, "en", lang_code)
-        print(translated_closing)
+        translated_closing = translate_ui("closing", lang_code)
+        print(f"\n{translated_closing}")
         
     except Exception as e:
         print(f"An error occurred: {str(e)}")
         print("Please try again later.")
 #cell12
 # Voice-based doctor function with multilingual support
+@traced("voice_consultation")
 def run_voice_doctor(model):
     try:
         # Initialize voice assistant
@@ -525,13 +4049,11 @@ def run_voice_doctor(model):
         doctor = VirtualDoctor(model)
         
         # Translate welcome message
-        welcome_msg = "Welcome to the Voice-based Virtual Doctor Assistant. I'll help assess your health concerns through voice interaction."
-        translated_welcome = safe_translate(welcome_msg, "en", lang_code)
+        translated_welcome = translate_ui("voice_welcome", lang_code)
         print(f"\n{translated_welcome}")
         
         # Collect patient information
-        patient_info_msg = "First, I need to collect some basic information."
-        translated_info_msg = safe_translate(patient_info_msg, "en", lang_code)
+        translated_info_msg = translate_ui("patient_info", lang_code)
         print(f"\n{translated_info_msg}")
         
         # Get patient info without language detection on names
@@ -540,31 +4062,27 @@ def run_voice_doctor(model):
         patient_id = f"{patient_info['name']}_{patient_info.get('phone', 'unknown')}"
         
         # Get patient history
-        patient_history = doctor.db.get_patient_history(patient_id)
+        patient_history = doctor.db.get_history_context(patient_id, PROMPT_HISTORY_CANDIDATES)
         
         # Collect symptoms through voice
-        symptoms_prompt = "Please describe your symptoms or health concerns when recording starts."
-        translated_symptoms_prompt = safe_translate(symptoms_prompt, "en", lang_code)
+        translated_symptoms_prompt = translate_ui("voice_symptoms_prompt", lang_code)
         print(f"\n{translated_symptoms_prompt}")
         
-        # Record and transcribe audio in the selected language
-        frames, rate = voice.record_audio()
-        symptoms_input = voice.transcribe_audio(frames, rate, speech_lang_code)
+        # Record and transcribe audio in the selected language, recognizing speech while it is captured
+        symptoms_input = voice.listen(speech_lang_code)
         
         # Show transcribed text to user
-        transcribed_msg = f"Transcribed symptoms: {symptoms_input}"
-        translated_transcribed = safe_translate(transcribed_msg, "en", lang_code)
+        translated_transcribed = translate_ui("transcribed_symptoms", lang_code, text=symptoms_input)
         print(f"\n{translated_transcribed}")
         
         # Translate symptoms to English for processing if not already in English
         english_symptoms = safe_translate(symptoms_input, lang_code, "en")
         
-        # Generate medical response
-        medical_response = doctor.get_medical_response(english_symptoms, patient_history)
-        
-        # Translate response back to user's language
-        translated_response = safe_translate(medical_response, "en", lang_code)
-        print(f"\n{translated_response}")
+        # Stream the medical response, translating it sentence by sentence
+        print()
+        medical_response, translated_response, response_timing = stream_translated_response(
+            doctor, english_symptoms, patient_history, lang_code)
+        print()
         
         # Save consultation data
         consultation_data = {
@@ -574,31 +4092,29 @@ def run_voice_doctor(model):
             "translated_response": translated_response,
             "language": lang_code,
             "patient_info": patient_info,
-            "input_method": "voice"
+            "input_method": "voice",
+            "response_timing": response_timing,
+            "stress_analysis": voice.last_stress_analysis
         }
         
         doctor.db.add_patient(patient_id, consultation_data)
         
         # Ask if user wants follow-up questions
-        followup_msg = "Do you have any follow-up questions? (yes/no)"
-        translated_followup = safe_translate(followup_msg, "en", lang_code)
+        translated_followup = translate_ui("followup", lang_code)
         print(f"\n{translated_followup}")
         
         followup_response = input().strip().lower()
         followup_response_en = safe_translate(followup_response, lang_code, "en").lower()
         
         if "yes" in followup_response_en or "y" == followup_response_en:
-            followup_prompt = "Please ask your follow-up question when recording starts."
-            translated_followup_prompt = safe_translate(followup_prompt, "en", lang_code)
+            translated_followup_prompt = translate_ui("voice_followup_prompt", lang_code)
             print(f"\n{translated_followup_prompt}")
             
             # Record and transcribe follow-up in the selected language
-            frames, rate = voice.record_audio()
-            followup_input = voice.transcribe_audio(frames, rate, speech_lang_code)
+            followup_input = voice.listen(speech_lang_code)
             
             # Show transcribed follow-up to user
-            transcribed_followup = f"Transcribed follow-up: {followup_input}"
-            translated_transcribed_followup = safe_translate(transcribed_followup, "en", lang_code)
+            translated_transcribed_followup = translate_ui("transcribed_followup", lang_code, text=followup_input)
             print(f"\n{translated_transcribed_followup}")
             
             # Translate follow-up to English for processing
@@ -606,11 +4122,10 @@ def run_voice_doctor(model):
             
             # Generate follow-up response
             followup_context = f"Previous symptoms: {english_symptoms}\nFollow-up question: {english_followup}"
-            followup_response = doctor.get_medical_response(followup_context, patient_history)
-            
-            # Translate follow-up response back to user's language
-            translated_followup_response = safe_translate(followup_response, "en", lang_code)
-            print(f"\n{translated_followup_response}")
+            print()
+            followup_response, translated_followup_response, _ = stream_translated_response(
+                doctor, followup_context, patient_history, lang_code)
+            print()
             
             # Save follow-up data
             doctor.db.add_patient(patient_id, {
@@ -619,16 +4134,1016 @@ def run_voice_doctor(model):
                 "followup_response": followup_response,
                 "translated_followup_response": translated_followup_response,
                 "language": lang_code,
-                "input_method": "voice"
+                "input_method": "voice",
+                "stress_analysis": voice.last_stress_analysis
             })
         
         # Closing message
-        closing_msg = "Thank you for using Virtual Doctor Assistant. Remember, this is not a replacement for professional medical advice. Please consult a healthcare provider for proper diagnosis and treatment."
-        translated_closing = safe_translate(closing_msg, "en", lang_code)
+        translated_closing = translate_ui("closing", lang_code)
         print(f"\n{translated_closing}")
         
     except Exception as e:
         print(f"An error occurred: {str(e)}")
         print("Please try again later.")
-#cell13# Run the application
-run_virtual_doctor()
+#cell13
+# Asynchronous consultation engine so one process can serve many patients
+class SessionIO(abc.ABC):
+    """Pluggable input/output channel for a single consultation session"""
+    @abc.abstractmethod
+    async def send(self, text):
+        pass
+
+    @abc.abstractmethod
+    async def receive(self):
+        pass
+
+    @abc.abstractmethod
+    async def receive_audio(self):
+        """Return (frames, rate) for one recorded utterance"""
+
+class ConsoleIO(SessionIO):
+    """Terminal I/O; blocking reads run in a worker thread so other sessions keep going"""
+    def __init__(self, voice=None):
+        self.voice = voice
+
+    async def send(self, text):
+        print(text)
+
+    async def receive(self):
+        loop = asyncio.get_running_loop()
+        return (await loop.run_in_executor(None, input)).strip()
+
+    async def receive_audio(self):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.voice.record_audio)
+
+class ScriptedIO(SessionIO):
+    """Replays scripted patient replies and records everything sent back"""
+    def __init__(self, replies, recordings=None):
+        self.replies = list(replies)
+        self.recordings = list(recordings or [])
+        self.sent = []
+
+    async def send(self, text):
+        self.sent.append(text)
+
+    async def receive(self):
+        return self.replies.pop(0).strip() if self.replies else ""
+
+    async def receive_audio(self):
+        return self.recordings.pop(0)
+
+class ConsultationSession:
+    """State machine for one consultation: language -> intake -> symptoms -> response -> follow-up -> closing"""
+    def __init__(self, engine, io, input_method="text"):
+        self.engine = engine
+        self.io = io
+        self.input_method = input_method
+        self.state = "language"
+        self.lang_code = "en"
+        self.lang_name = "English"
+        self.patient_info = {}
+        self.patient_id = None
+        self.patient_history = []
+        self.original_symptoms = None
+        self.english_symptoms = None
+        self.stress_analysis = None  # Voice stress/emotion scores for the latest utterance
+        self.trace = None
+        self.handlers = {
+            "language": self.select_language,
+            "intake": self.collect_patient_info,
+            "symptoms": self.collect_symptoms,
+            "response": self.respond,
+            "followup": self.followup,
+            "closing": self.close
+        }
+
+    async def run(self):
+        with start_trace(f"{self.input_method}_consultation") as trace:
+            self.trace = trace
+            try:
+                while self.state != "done":
+                    with stage_timer(f"state:{self.state}"):
+                        self.state = await self.handlers[self.state]()
+            except Exception as e:
+                record_error("session", e)
+                await self.io.send(f"An error occurred: {str(e)}")
+                await self.io.send("Please try again later.")
+
+    async def ask(self, message_key):
+        await self.io.send(await self.engine.translate_ui(message_key, self.lang_code))
+        return await self.io.receive()
+
+    async def listen(self):
+        """Read the patient's next utterance as text, recording and transcribing it in voice mode"""
+        if self.input_method != "voice":
+            return await self.io.receive()
+        frames, rate = await self.io.receive_audio()
+        speech_code = self.engine.voice.get_speech_recognition_code(self.lang_code)
+        self.stress_analysis = await self.engine.call(self.engine.voice.analyze_stress, frames, rate)
+        return await self.engine.call(self.engine.voice.transcribe_audio, frames, rate, speech_code)
+
+    async def select_language(self):
+        await self.io.send("Welcome to Virtual Doctor Assistant")
+        await self.io.send("Please select your language:")
+        await self.io.send("\n".join(f"{key}. {lang['name']}" for key, lang in LANGUAGES.items()))
+        await self.io.send("Enter the number of your language choice (or type 'other'): ")
+        choice = await self.io.receive()
+
+        if choice in LANGUAGES:
+            self.lang_code, self.lang_name = LANGUAGES[choice]["code"], LANGUAGES[choice]["name"]
+        elif choice.lower() == "other":
+            await self.io.send("Please enter your language code (e.g., 'ja' for Japanese): ")
+            self.lang_code = (await self.io.receive()).lower()
+            await self.io.send("Please enter your language name: ")
+            self.lang_name = await self.io.receive()
+        else:
+            for lang_name, lang_info in ADDITIONAL_LANGS.items():
+                if choice.lower() == lang_info["code"]:
+                    self.lang_code, self.lang_name = lang_info["code"], lang_name
+                    break
+            else:
+                await self.io.send("I couldn't recognize that choice. Please type a sentence in your preferred language:")
+                sample_text = await self.io.receive()
+                self.lang_code = await self.engine.call(detect_language_safely, sample_text)
+                self.lang_name = f"Detected language ({self.lang_code})"
+
+        await self.io.send(f"\nSelected language: {self.lang_name} ({self.lang_code})")
+        return "intake"
+
+    async def collect_patient_info(self):
+        welcome_key = "voice_welcome" if self.input_method == "voice" else "text_welcome"
+        await self.io.send(await self.engine.translate_ui(welcome_key, self.lang_code))
+        await self.io.send(await self.engine.translate_ui("patient_info", self.lang_code))
+
+        for key, message_key in (("name", "ask_name"), ("age", "ask_age"),
+                                 ("gender", "ask_gender"), ("phone", "ask_phone")):
+            self.patient_info[key] = await self.ask(message_key)
+
+        self.patient_id = f"{self.patient_info['name']}_{self.patient_info.get('phone', 'unknown')}"
+        self.patient_history = await self.engine.call(
+            self.engine.doctor.db.get_history_context, self.patient_id, PROMPT_HISTORY_CANDIDATES)
+        return "symptoms"
+
+    async def collect_symptoms(self):
+        prompt_key = "voice_symptoms_prompt" if self.input_method == "voice" else "text_symptoms_prompt"
+        await self.io.send(await self.engine.translate_ui(prompt_key, self.lang_code))
+        self.original_symptoms = await self.listen()
+
+        if self.input_method == "voice":
+            await self.io.send(await self.engine.translate_ui(
+                "transcribed_symptoms", self.lang_code, text=self.original_symptoms))
+        elif len(self.original_symptoms.split()) > 3:
+            detected_lang = await self.engine.call(detect_language_safely, self.original_symptoms)
+            if detected_lang != self.lang_code and detected_lang != "en":
+                await self.io.send(await self.engine.translate_ui("language_switch", detected_lang))
+                self.lang_code = detected_lang
+
+        self.english_symptoms = await self.engine.translate(self.original_symptoms, self.lang_code, "en")
+        return "response"
+
+    async def respond(self):
+        medical_response, translated_response, response_timing = await self.engine.stream_response(
+            self.io, self.english_symptoms, self.patient_history, self.lang_code)
+
+        await self.engine.save(self.patient_id, {
+            "symptoms": self.english_symptoms,
+            "original_symptoms": self.original_symptoms,
+            "response": medical_response,
+            "translated_response": translated_response,
+            "language": self.lang_code,
+            "patient_info": self.patient_info,
+            "input_method": self.input_method,
+            "response_timing": response_timing,
+            "stress_analysis": self.stress_analysis
+        })
+        return "followup"
+
+    async def followup(self):
+        answer = (await self.ask("followup")).lower()
+        answer_en = (await self.engine.translate(answer, self.lang_code, "en")).lower()
+        if not ("yes" in answer_en or "y" == answer_en):
+            return "closing"
+
+        prompt_key = "voice_followup_prompt" if self.input_method == "voice" else "text_followup_prompt"
+        await self.io.send(await self.engine.translate_ui(prompt_key, self.lang_code))
+        followup_input = await self.listen()
+        if self.input_method == "voice":
+            await self.io.send(await self.engine.translate_ui(
+                "transcribed_followup", self.lang_code, text=followup_input))
+        english_followup = await self.engine.translate(followup_input, self.lang_code, "en")
+
+        followup_context = f"Previous symptoms: {self.english_symptoms}\nFollow-up question: {english_followup}"
+        followup_response, translated_followup_response, _ = await self.engine.stream_response(
+            self.io, followup_context, self.patient_history, self.lang_code)
+
+        await self.engine.save(self.patient_id, {
+            "followup_question": english_followup,
+            "original_followup": followup_input,
+            "followup_response": followup_response,
+            "translated_followup_response": translated_followup_response,
+            "language": self.lang_code,
+            "input_method": self.input_method,
+            "stress_analysis": self.stress_analysis
+        })
+        return "closing"
+
+    async def close(self):
+        await self.io.send(await self.engine.translate_ui("closing", self.lang_code))
+        return "done"
+
+class AsyncSessionEngine:
+    """Runs many ConsultationSessions in one event loop, sharing one doctor and bounding in-flight network calls"""
+    def __init__(self, model, max_in_flight=16, voice=None, db=None, translation_router=None, translation_cache=None):
+        self.doctor = VirtualDoctor(model, db=db)
+        self.voice = voice
+        # Sessions use this engine's translation router/cache when given, else the process-wide ones
+        self.translation = (translation_router, translation_cache)
+        self.max_in_flight = max_in_flight
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="session")
+        # One thread per in-flight session: saves wait on the group commit together, so the
+        # database writer folds concurrent consultations into one transaction
+        self.db_executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="session-db")
+        self.semaphore = None
+
+    async def call(self, func, *args):
+        """Run a blocking call (translation, Gemini, speech recognition) without blocking the event loop"""
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            # copy_context() carries the session's trace into the worker thread
+            context = contextvars.copy_context()
+            if self.translation != (None, None):
+                context.run(_translation_override.set, self.translation)
+            return await loop.run_in_executor(self.executor, context.run, functools.partial(func, *args))
+
+    async def translate(self, text, source_lang, target_lang):
+        return await self.call(safe_translate, text, source_lang, target_lang)
+
+    async def translate_ui(self, message_key, lang_code, **values):
+        return await self.call(functools.partial(translate_ui, message_key, lang_code, **values))
+
+    async def translate_long(self, text, source_lang, target_lang):
+        return await self.call(translate_long_text, text, source_lang, target_lang)
+
+    async def stream_response(self, io, symptoms, patient_history, lang_code):
+        """Stream a translated medical response to the session's I/O sentence by sentence.
+
+        The worker only queues sentences for a sender task on the loop, so a slow client never
+        holds an in-flight slot: the slot is freed once the model stream is drained.
+        """
+        loop = asyncio.get_running_loop()
+        outbox = asyncio.Queue()
+
+        async def send_all():
+            while True:
+                text = await outbox.get()
+                if text is None:
+                    return
+                await io.send(text)
+
+        sender = asyncio.create_task(send_all())
+
+        def emit(text):
+            if sender.done():
+                raise ConnectionError("Session output closed while streaming")
+            loop.call_soon_threadsafe(outbox.put_nowait, text)
+
+        try:
+            return await self.call(stream_translated_response, self.doctor, symptoms, patient_history, lang_code, emit)
+        finally:
+            outbox.put_nowait(None)
+            await sender
+
+    async def save(self, patient_id, data):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            self.db_executor, contextvars.copy_context().run, self.doctor.db.add_patient, patient_id, data)
+
+    async def run_session(self, io, input_method="text"):
+        session = ConsultationSession(self, io, input_method)
+        await session.run()
+        return session
+
+    async def serve(self, ios, input_method="text"):
+        """Run one session per I/O channel concurrently and return the finished sessions"""
+        return await asyncio.gather(*(self.run_session(io, input_method) for io in ios))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        self.db_executor.shutdown(wait=True)
+
+def run_concurrent_sessions(model, ios, input_method="text", max_in_flight=16, voice=None):
+    """Serve several consultations at once from a single process"""
+    engine = AsyncSessionEngine(model, max_in_flight=max_in_flight, voice=voice)
+    try:
+        return asyncio.run(engine.serve(ios, input_method))
+    finally:
+        engine.shutdown()
+
+# End-to-end benchmark: scripted text and voice sessions through the real pipeline, with local
+# stand-ins (configurable latency and error rate) for Google Translate, Gemini and speech recognition
+class FakeTranslationBackend(TranslationBackend):
+    name = "remote"
+
+    def __init__(self, latency=0.05, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def translate(self, text, source_lang, target_lang):
+        with self.lock:
+            self.calls += 1
+            failed = self.random.random() < self.error_rate
+        sleep(self.latency)
+        if failed:
+            record_error("translate_remote", "fake translation error")
+            return None
+        return f"[{target_lang}] {text}"
+
+class FakeSpeechBackend(SpeechBackend):
+    """Answers with a fixed transcript per language after latency + real_time_factor * audio length"""
+    name = "fake"
+
+    def __init__(self, transcripts=None, latency=0.1, real_time_factor=0.05, error_rate=0.0, seed=None, workers=8):
+        self.transcripts = transcripts or {}
+        self.latency = latency
+        self.real_time_factor = real_time_factor
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fake-asr")
+
+    def recognize(self, segment, rate, language_code):
+        with self.lock:
+            self.calls += 1
+            failed = self.random.random() < self.error_rate
+        sleep(self.latency + self.real_time_factor * len(segment) / rate)
+        if failed:
+            return "", "request"
+        return self.transcripts.get(language_code, "I have a headache and a fever"), None
+
+    def submit(self, segment, rate, language_code):
+        return self.pool.submit(self.recognize, segment, rate, language_code)
+
+# (menu choice, symptoms, follow-up question) in the patient's own language
+BENCHMARK_SCRIPTS = {
+    "en": ("1", "I have had a fever and a dry cough for three days and my chest hurts when I breathe",
+           "Should I take paracetamol?"),
+    "hi": ("2", "मुझे तीन दिनों से बुखार और सूखी खांसी है और सांस लेते समय सीने में दर्द होता है",
+           "क्या मुझे पैरासिटामोल लेनी चाहिए?"),
+    "es": ("3", "Tengo fiebre y tos seca desde hace tres días y me duele el pecho al respirar",
+           "¿Debo tomar paracetamol?"),
+    "zh-CN": ("6", "我发烧干咳三天了，呼吸时胸口疼", "我应该吃扑热息痛吗？"),
+    "ar": ("7", "أعاني من الحمى والسعال الجاف منذ ثلاثة أيام ويؤلمني صدري عند التنفس",
+           "هل يجب أن أتناول الباراسيتامول؟"),
+    "ta": ("13", "எனக்கு மூன்று நாட்களாக காய்ச்சல் மற்றும் வறட்டு இருமல் உள்ளது",
+           "நான் பாராசிட்டமால் எடுத்துக்கொள்ள வேண்டுமா?")
+}
+
+def write_benchmark_wav(path, seconds=4.0, rate=CAPTURE_RATE, seed=0):
+    """Synthetic 'speech': amplitude-modulated tones with pauses, enough to exercise capture and VAD"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * rate)) / rate
+    envelope = (np.sin(2 * np.pi * 2.5 * t) > -0.3).astype(np.float32)
+    signal = 0.3 * np.sin(2 * np.pi * (180 + 40 * rng.random()) * t) * envelope
+    signal += 0.005 * rng.standard_normal(len(t))
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(float32_to_int16(signal.astype(np.float32)).tobytes())
+
+def load_recording(path):
+    """A WAV file as the (frames, rate) pair SessionIO.receive_audio returns"""
+    source = WavFileSource(path)
+    return [chunk.astype(np.float32).tobytes() for chunk in source], source.rate
+
+def benchmark_script(lang_code, index, followup=True):
+    choice, symptoms, question = BENCHMARK_SCRIPTS[lang_code]
+    replies = [choice, f"Patient{index % 97}", str(20 + index % 60), "Other", f"555{index % 97:04d}", symptoms]
+    replies += ["yes", question] if followup else ["no"]
+    return replies
+
+def run_end_to_end_benchmark(sessions=60, concurrency=16, voice_ratio=0.25, languages=None,
+                             translate_latency=0.05, translate_error_rate=0.02,
+                             model_latency=0.3, model_error_rate=0.02,
+                             asr_latency=0.1, asr_error_rate=0.02,
+                             corpus_dir=None, db_path="benchmark_e2e.db",
+                             results_file="e2e_benchmark.jsonl", seed=0, trace_memory=True):
+    """Run scripted consultations against local stand-ins and append one JSON result line per run"""
+    import tracemalloc
+
+    languages = list(languages or BENCHMARK_SCRIPTS)
+    rng = random.Random(seed)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+    # Voice recordings: a WAV corpus if given, otherwise synthetic WAVs written to a temp directory
+    wav_dir = corpus_dir or tempfile.mkdtemp(prefix="vd-bench-")
+    if corpus_dir is None:
+        for i in range(4):
+            write_benchmark_wav(os.path.join(wav_dir, f"utterance_{i}.wav"), seconds=3.0 + i, seed=i)
+    recordings = [load_recording(os.path.join(wav_dir, name))
+                  for name in sorted(os.listdir(wav_dir)) if name.lower().endswith(".wav")]
+    if corpus_dir is None:
+        import shutil
+        shutil.rmtree(wav_dir, ignore_errors=True)
+
+    translator = FakeTranslationBackend(translate_latency, translate_error_rate, seed)
+    fake_model = FakeGenerativeModel(latency=model_latency, error_rate=model_error_rate, seed=seed)
+    speech = FakeSpeechBackend(latency=asr_latency, error_rate=asr_error_rate, seed=seed)
+    voice = VoiceAssistant(backend=speech, device=AudioDevice(
+        stream_factory=FakeAudioStream.factory(np.zeros(CAPTURE_CHUNK, dtype=np.float32))))
+    speech.transcripts = {
+        voice.get_speech_recognition_code(code): BENCHMARK_SCRIPTS[code][1] for code in languages}
+    model = ResilientModelClient([("fake", fake_model)], requests_per_second=1000.0, burst=1000)
+    db = PatientDatabase(file_path=os.path.splitext(db_path)[0] + ".json", db_path=db_path)
+
+    plan = []
+    for index in range(sessions):
+        lang_code = languages[index % len(languages)]
+        method = "voice" if rng.random() < voice_ratio else "text"
+        replies = benchmark_script(lang_code, index)
+        if method == "voice":
+            # Symptoms and the follow-up question arrive as audio instead of typed text
+            replies = replies[:5] + ["yes"]
+            io = ScriptedIO(replies, [rng.choice(recordings), rng.choice(recordings)])
+        else:
+            io = ScriptedIO(replies)
+        plan.append((lang_code, method, io))
+
+    language_identifier.load()  # Loaded at startup in the app, so keep it out of the timings
+    metrics.reset()
+    records_before, bytes_before = db.count_records(), os.path.getsize(db_path)
+    engine = AsyncSessionEngine(model, max_in_flight=concurrency, voice=voice, db=db,
+                                translation_router=TranslationRouter([translator], mode="remote"),
+                                translation_cache=TranslationCache())
+
+    async def serve():
+        return await asyncio.gather(*(engine.run_session(io, method) for _, method, io in plan))
+
+    try:
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        finished = asyncio.run(serve())
+        elapsed = time.perf_counter() - start
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1e6 if trace_memory else None
+    finally:
+        if trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        engine.shutdown()
+
+    db.flush()
+    db.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    records_after = db.count_records()
+    bytes_after = sum(os.path.getsize(db_path + suffix) for suffix in ("", "-wal") if os.path.exists(db_path + suffix))
+    db.close()
+    speech.pool.shutdown(wait=True)
+
+    snapshot = metrics.snapshot()
+    errors = {}
+    for counter in snapshot["counters"]:
+        if counter["name"] == "errors":
+            errors[counter["labels"]["stage"]] = errors.get(counter["labels"]["stage"], 0) + counter["value"]
+    completed = sum(1 for session in finished if session.state == "done")
+    result = {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "config": {
+            "sessions": sessions, "concurrency": concurrency, "voice_ratio": voice_ratio, "languages": languages,
+            "translate_latency": translate_latency, "translate_error_rate": translate_error_rate,
+            "model_latency": model_latency, "model_error_rate": model_error_rate,
+            "asr_latency": asr_latency, "asr_error_rate": asr_error_rate, "seed": seed,
+            "recordings": len(recordings)
+        },
+        "results": {
+            "wall_seconds": round(elapsed, 3),
+            "sessions_completed": completed,
+            "sessions_per_second": round(completed / elapsed, 2),
+            "voice_sessions": sum(1 for _, method, _ in plan if method == "voice"),
+            "peak_memory_mb": round(peak_mb, 1) if peak_mb is not None else None,
+            "db_records_added": records_after - records_before,
+            "db_bytes_added": bytes_after - bytes_before,
+            "db_bytes_per_record": round((bytes_after - bytes_before) / max(records_after - records_before, 1)),
+            "calls": {"translate": translator.calls, "model": fake_model.calls, "asr": speech.calls},
+            "model_client": dict(model.stats),
+            "errors": errors,
+            "stages": metrics.stage_report()
+        }
+    }
+
+    print(f"{completed}/{sessions} sessions in {elapsed:.2f}s ({result['results']['sessions_per_second']} sessions/s), "
+          f"peak memory {result['results']['peak_memory_mb']} MB, "
+          f"DB +{result['results']['db_records_added']} records / +{result['results']['db_bytes_added']} bytes")
+    print_stage_report(result["results"]["stages"])
+    if results_file:
+        with open(results_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return result
+
+# Service mode: consultations over HTTP/WebSocket for kiosks and phone gateways. One process
+# holds the model client, database, translators and speech backend for every session;
+# decoding and resampling uploaded audio runs in a process pool.
+SERVICE_HOST = os.environ.get("VIRTUAL_DOCTOR_HOST", "127.0.0.1")  # Set 0.0.0.0 explicitly to serve other machines
+# Bearer token required by the patient-record endpoints; without one they stay disabled
+SERVICE_TOKEN = os.environ.get("VIRTUAL_DOCTOR_SERVICE_TOKEN")
+SERVICE_PORT = int(os.environ.get("VIRTUAL_DOCTOR_PORT", "8080"))
+SERVICE_MAX_IN_FLIGHT = 64
+SERVICE_PROCESS_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+SERVICE_REQUEST_TIMEOUT = 60.0  # Seconds a request waits for the session to need input again
+SERVICE_SESSION_TTL = 30 * 60  # Idle sessions are dropped after this long
+
+def decode_audio_upload(data, rate=RECOGNITION_RATE):
+    """WAV bytes -> mono int16 at the recognition rate (runs in the service's process pool)"""
+    with wave.open(io.BytesIO(data), 'rb') as wf:
+        channels, width, source_rate = wf.getnchannels(), wf.getsampwidth(), wf.getframerate()
+        raw = wf.readframes(wf.getnframes())
+    dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[width]
+    samples = np.frombuffer(raw, dtype=dtype).astype(np.float32)
+    if width == 1:
+        samples -= 128.0
+    samples /= float(2 ** (8 * width - 1))
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return float32_to_int16(LinearResampler(source_rate, rate).process(samples))
+
+class ServiceIO(SessionIO):
+    """Feeds a ConsultationSession from HTTP/WebSocket input and fans its output out to subscribers"""
+    def __init__(self):
+        self.messages = []
+        self.inbox = asyncio.Queue()
+        self.audio_inbox = asyncio.Queue()
+        self.idle = asyncio.Event()  # Set while the session waits for input (or has finished)
+        self.expecting = None  # "text" or "audio" while waiting
+        self.subscribers = set()  # asyncio.Queues of WebSocket clients
+        self.last_active = time.monotonic()
+
+    def publish(self, event):
+        for subscriber in list(self.subscribers):
+            subscriber.put_nowait(event)
+
+    async def send(self, text):
+        self.messages.append(text)
+        self.publish({"type": "message", "index": len(self.messages) - 1, "text": text})
+
+    async def receive(self):
+        self.expecting = "text"
+        self.idle.set()
+        self.publish({"type": "waiting", "expecting": "text"})
+        return (await self.inbox.get()).strip()
+
+    async def receive_audio(self):
+        self.expecting = "audio"
+        self.idle.set()
+        self.publish({"type": "waiting", "expecting": "audio"})
+        return await self.audio_inbox.get()
+
+class ConsultationService:
+    def __init__(self, engine, process_workers=SERVICE_PROCESS_WORKERS, request_timeout=SERVICE_REQUEST_TIMEOUT,
+                 session_ttl=SERVICE_SESSION_TTL):
+        self.engine = engine
+        self.request_timeout = request_timeout
+        self.session_ttl = session_ttl
+        self.process_pool = None
+        if process_workers:
+            from concurrent.futures import ProcessPoolExecutor
+            self.process_pool = ProcessPoolExecutor(max_workers=process_workers)
+        self.sessions = {}  # session id -> (ConsultationSession, ServiceIO, task)
+
+    def get(self, session_id):
+        entry = self.sessions.get(session_id)
+        if entry is None:
+            raise KeyError(session_id)
+        return entry
+
+    def describe(self, session_id, since=0):
+        session, io, task = self.get(session_id)
+        return {
+            "session_id": session_id,
+            "state": session.state,
+            "expecting": None if task.done() else io.expecting,
+            "language": session.lang_code,
+            "patient_id": session.patient_id,
+            "messages": io.messages[since:],
+            "next_index": len(io.messages)
+        }
+
+    async def wait_for_input(self, session_id, since):
+        """Wait until the session needs input again (or ends), then return what it sent meanwhile"""
+        _, io, _ = self.get(session_id)
+        try:
+            await asyncio.wait_for(io.idle.wait(), self.request_timeout)
+        except asyncio.TimeoutError:
+            pass  # Still working; the client can poll or follow the WebSocket
+        io.last_active = time.monotonic()
+        return self.describe(session_id, since)
+
+    async def start(self, input_method="text"):
+        io = ServiceIO()
+        session = ConsultationSession(self.engine, io, input_method)
+        session_id = secrets.token_urlsafe(16)  # Anyone holding the id can read and answer the session
+        task = asyncio.ensure_future(session.run())
+        task.add_done_callback(lambda _: (io.idle.set(), io.publish({"type": "done"})))
+        self.sessions[session_id] = (session, io, task)
+        metrics.inc("service_sessions_started", input_method=input_method)
+        return await self.wait_for_input(session_id, 0)
+
+    async def reply(self, session_id, text=None, audio=None):
+        """Deliver the patient's next text reply or WAV upload; raises ValueError if it is not expected"""
+        session, io, task = self.get(session_id)
+        expected = "audio" if audio is not None else "text"
+        if task.done() or not io.idle.is_set() or io.expecting != expected:
+            raise ValueError(f"Session {session_id} is not waiting for {expected} input")
+        since = len(io.messages)
+        io.idle.clear()
+        if audio is None:
+            io.inbox.put_nowait(text or "")
+        else:
+            with stage_timer("decode_audio", bytes=len(audio)):
+                if self.process_pool is not None:
+                    loop = asyncio.get_running_loop()
+                    samples = await loop.run_in_executor(self.process_pool, decode_audio_upload, audio)
+                else:
+                    samples = decode_audio_upload(audio)
+            io.audio_inbox.put_nowait((samples, RECOGNITION_RATE))
+        return await self.wait_for_input(session_id, since)
+
+    async def history(self, patient_id, limit=10):
+        return await self.engine.call(self.engine.doctor.db.get_history_context, patient_id, limit)
+
+    async def reap(self):
+        """Drop finished or abandoned sessions once they have been idle for session_ttl"""
+        while True:
+            await asyncio.sleep(min(60.0, self.session_ttl))
+            cutoff = time.monotonic() - self.session_ttl
+            for session_id, (_, io, task) in list(self.sessions.items()):
+                if io.last_active < cutoff:
+                    task.cancel()
+                    del self.sessions[session_id]
+
+    def shutdown(self):
+        for _, _, task in self.sessions.values():
+            task.cancel()
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False)
+        self.engine.shutdown()
+
+@functools.lru_cache(maxsize=None)
+def service_app_key(name):
+    """The aiohttp application key for name; created once, since keys compare by identity"""
+    from aiohttp import web
+    return web.AppKey(name)
+
+def create_service_app(model, db=None, voice=None, max_in_flight=SERVICE_MAX_IN_FLIGHT,
+                       process_workers=SERVICE_PROCESS_WORKERS, translation_router=None, translation_cache=None,
+                       service_token=SERVICE_TOKEN):
+    """aiohttp application exposing consultations, audio upload, history, a WebSocket stream and metrics"""
+    import hmac
+    from aiohttp import web, WSMsgType
+
+    engine = AsyncSessionEngine(model, max_in_flight=max_in_flight, voice=voice or VoiceAssistant(), db=db,
+                                translation_router=translation_router, translation_cache=translation_cache)
+    service = ConsultationService(engine, process_workers)
+    routes = web.RouteTableDef()
+
+    def not_found(session_id):
+        return web.json_response({"error": f"Unknown session {session_id}"}, status=404)
+
+    def bad_request(error):
+        return web.json_response({"error": str(error)}, status=400)
+
+    def json_object(text):
+        """Decode a JSON object; raises ValueError for malformed JSON or any other JSON value"""
+        body = json.loads(text)
+        if not isinstance(body, dict):
+            raise ValueError("Expected a JSON object")
+        return body
+
+    def query_int(request, name, default):
+        """A non-negative integer query parameter; raises ValueError otherwise"""
+        value = request.query.get(name)
+        if value is None:
+            return default
+        if not re.fullmatch(r"[0-9]+", value):
+            raise ValueError(f"{name} must be a non-negative integer")
+        return int(value)
+
+    def unauthorized(request):
+        """Error response unless the request carries the service token (patient records are never public)"""
+        if not service_token:
+            return web.json_response(
+                {"error": "Patient records are disabled; set VIRTUAL_DOCTOR_SERVICE_TOKEN to enable them"}, status=403)
+        supplied = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(supplied.encode(), f"Bearer {service_token}".encode()):
+            return web.json_response({"error": "Missing or invalid bearer token"}, status=401,
+                                     headers={"WWW-Authenticate": "Bearer"})
+        return None
+
+    @routes.post("/consultations")
+    async def start_consultation(request):
+        try:
+            body = json_object(await request.text()) if request.can_read_body else {}
+        except ValueError as e:
+            return bad_request(e)
+        input_method = body.get("input_method", "text")
+        if input_method not in ("text", "voice"):
+            return web.json_response({"error": "input_method must be 'text' or 'voice'"}, status=400)
+        return web.json_response(await service.start(input_method), status=201)
+
+    @routes.get("/consultations/{session_id}")
+    async def get_consultation(request):
+        session_id = request.match_info["session_id"]
+        try:
+            since = query_int(request, "since", 0)
+        except ValueError as e:
+            return bad_request(e)
+        try:
+            return web.json_response(service.describe(session_id, since))
+        except KeyError:
+            return not_found(session_id)
+
+    @routes.post("/consultations/{session_id}/messages")
+    async def post_message(request):
+        session_id = request.match_info["session_id"]
+        try:
+            body = json_object(await request.text())
+        except ValueError as e:
+            return bad_request(e)
+        try:
+            return web.json_response(await service.reply(session_id, text=str(body.get("text", ""))))
+        except KeyError:
+            return not_found(session_id)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=409)
+
+    @routes.post("/consultations/{session_id}/audio")
+    async def post_audio(request):
+        session_id = request.match_info["session_id"]
+        try:
+            return web.json_response(await service.reply(session_id, audio=await request.read()))
+        except KeyError:
+            return not_found(session_id)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=409)
+        except (wave.Error, EOFError) as e:
+            return web.json_response({"error": f"Invalid WAV upload: {e}"}, status=400)
+
+    @routes.get("/consultations/{session_id}/ws")
+    async def consultation_socket(request):
+        """Streams every message (response sentences as they are translated) and accepts replies"""
+        session_id = request.match_info["session_id"]
+        try:
+            _, io, _ = service.get(session_id)
+        except KeyError:
+            return not_found(session_id)
+        try:
+            since = query_int(request, "since", 0)
+        except ValueError as e:
+            return bad_request(e)
+        ws = web.WebSocketResponse(heartbeat=30.0)
+        await ws.prepare(request)
+        events = asyncio.Queue()
+        io.subscribers.add(events)
+        for index, text in enumerate(io.messages[since:], start=since):
+            events.put_nowait({"type": "message", "index": index, "text": text})
+
+        async def forward():
+            while True:
+                event = await events.get()
+                await ws.send_json(event)
+                if event["type"] == "done":
+                    return
+
+        forwarder = asyncio.ensure_future(forward())
+        try:
+            async for message in ws:
+                try:
+                    if message.type == WSMsgType.TEXT:
+                        await service.reply(session_id, text=str(json_object(message.data).get("text", "")))
+                    elif message.type == WSMsgType.BINARY:
+                        await service.reply(session_id, audio=message.data)
+                except (ValueError, wave.Error, EOFError) as e:
+                    await ws.send_json({"type": "error", "error": str(e)})
+        finally:
+            forwarder.cancel()
+            io.subscribers.discard(events)
+        return ws
+
+    @routes.get("/patients/{patient_id}/history")
+    async def patient_history(request):
+        error = unauthorized(request)
+        if error is not None:
+            return error
+        try:
+            limit = query_int(request, "limit", PROMPT_HISTORY_CANDIDATES)
+        except ValueError as e:
+            return bad_request(e)
+        return web.json_response(await service.history(request.match_info["patient_id"], limit))
+
+    @routes.post("/patients/{patient_id}/screening")
+    async def post_screening(request):
+        """Crisis-screening answers from a kiosk or health worker, scored by the next batch run"""
+        error = unauthorized(request)
+        if error is not None:
+            return error
+        try:
+            answers = await request.json()
+            await engine.call(engine.doctor.db.add_screening, request.match_info["patient_id"], answers)
+        except ValueError as e:  # Includes malformed JSON
+            return web.json_response({"error": str(e)}, status=400)
+        return web.json_response({"stored": True}, status=201)
+
+    @routes.get("/patients/{patient_id}/risk")
+    async def patient_risk(request):
+        error = unauthorized(request)
+        if error is not None:
+            return error
+        patient_id = request.match_info["patient_id"]
+        risk = await engine.call(engine.doctor.db.get_risk_score, patient_id)
+        if risk is None:
+            return web.json_response({"error": f"No risk score for patient {patient_id}"}, status=404)
+        return web.json_response(risk)
+
+    @routes.get("/patients/flagged")
+    async def flagged_patients(request):
+        """Patients the latest scoring run flagged for crisis follow-up, highest risk first"""
+        error = unauthorized(request)
+        if error is not None:
+            return error
+        rows = await engine.call(engine.doctor.db.flagged_patients, request.query.get("model_version"))
+        return web.json_response([{"patient_id": patient_id, "risk": risk} for patient_id, risk in rows])
+
+    @routes.get("/health")
+    async def health(request):
+        return web.json_response({"sessions": len(service.sessions), "cpu_seconds": time.process_time()})
+
+    @routes.get("/metrics")
+    async def metrics_text(request):
+        return web.Response(text=metrics.to_prometheus(), content_type="text/plain")
+
+    async def on_startup(app):
+        app[service_app_key("reaper")] = asyncio.ensure_future(service.reap())
+
+    async def on_cleanup(app):
+        app[service_app_key("reaper")].cancel()
+        service.shutdown()
+
+    app = web.Application(client_max_size=50 * 1024 * 1024)  # Room for a few minutes of WAV
+    app.add_routes(routes)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app[service_app_key("service")] = service
+    return app
+
+def run_service(host=SERVICE_HOST, port=SERVICE_PORT, api_key=None):
+    """Long-running service mode: `python main21.py serve`"""
+    from aiohttp import web
+
+    model = initialize_gemini(api_key or os.environ.get("GEMINI_API_KEY", "API key"))
+    start_translation_warmup()
+    start_language_id_warmup()
+    web.run_app(create_service_app(model), host=host, port=int(port))
+
+def _serve_with_fakes(port, model_latency, translate_latency, db_path):
+    """Service process for load_test_service: real service code, fake upstreams"""
+    router = TranslationRouter([FakeTranslationBackend(translate_latency)], mode="remote")
+    model = ResilientModelClient([("fake", FakeGenerativeModel(latency=model_latency))],
+                                 requests_per_second=10_000.0, burst=10_000)
+    voice = VoiceAssistant(backend=FakeSpeechBackend(latency=0.0, real_time_factor=0.0), device=AudioDevice(
+        stream_factory=FakeAudioStream.factory(np.zeros(CAPTURE_CHUNK, dtype=np.float32))))
+    db = PatientDatabase(file_path=os.path.splitext(db_path)[0] + ".json", db_path=db_path)
+    language_identifier.load()
+
+    from aiohttp import web
+    web.run_app(create_service_app(model, db=db, voice=voice, translation_router=router),
+                host="127.0.0.1", port=port, print=None)
+
+def load_test_service(sessions=200, concurrency=32, voice_ratio=0.0, model_latency=0.05, translate_latency=0.01,
+                      db_path="service_load_test.db", results_file="service_load_test.jsonl"):
+    """Drive a service process over HTTP with scripted consultations and report requests/s per core"""
+    import socket
+    import aiohttp
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    base = f"http://127.0.0.1:{port}"
+    # Not a daemon: the service starts its own audio process pool
+    server = multiprocessing.Process(target=_serve_with_fakes, args=(port, model_latency, translate_latency, db_path))
+    server.start()
+
+    wav_path = os.path.join(tempfile.mkdtemp(prefix="vd-load-"), "utterance.wav")
+    write_benchmark_wav(wav_path, seconds=3.0)
+    with open(wav_path, "rb") as f:
+        wav_bytes = f.read()
+    import shutil
+    shutil.rmtree(os.path.dirname(wav_path), ignore_errors=True)
+    languages = list(BENCHMARK_SCRIPTS)
+    latencies = []
+    failures = []
+
+    async def timed(http, method, path, **kwargs):
+        start = time.perf_counter()
+        async with http.request(method, base + path, **kwargs) as response:
+            body = await response.json()
+            latencies.append(time.perf_counter() - start)
+            if response.status >= 400:
+                failures.append(body.get("error"))
+            return body
+
+    async def consultation(http, index, semaphore):
+        async with semaphore:
+            voice = index < sessions * voice_ratio
+            state = await timed(http, "POST", "/consultations", json={"input_method": "voice" if voice else "text"})
+            replies = benchmark_script(languages[index % len(languages)], index)
+            if voice:
+                replies = replies[:5] + ["yes"]
+            while state.get("expecting"):
+                if state["expecting"] == "audio":
+                    state = await timed(http, "POST", f"/consultations/{state['session_id']}/audio", data=wav_bytes)
+                else:
+                    text = replies.pop(0) if replies else ""
+                    state = await timed(http, "POST", f"/consultations/{state['session_id']}/messages",
+                                        json={"text": text})
+
+    async def run():
+        async with aiohttp.ClientSession() as http:
+            for _ in range(100):
+                try:
+                    async with http.get(base + "/health") as response:
+                        await response.json()
+                    break
+                except aiohttp.ClientError:
+                    await asyncio.sleep(0.1)
+            async with http.get(base + "/health") as response:
+                cpu_before = (await response.json())["cpu_seconds"]
+            semaphore = asyncio.Semaphore(concurrency)
+            start = time.perf_counter()
+            await asyncio.gather(*(consultation(http, i, semaphore) for i in range(sessions)))
+            elapsed = time.perf_counter() - start
+            async with http.get(base + "/health") as response:
+                cpu_after = (await response.json())["cpu_seconds"]
+            return elapsed, cpu_after - cpu_before
+
+    try:
+        elapsed, server_cpu = asyncio.run(run())
+    finally:
+        server.terminate()
+        server.join()
+
+    latencies.sort()
+    requests = len(latencies)
+    result = {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "config": {"sessions": sessions, "concurrency": concurrency, "voice_ratio": voice_ratio,
+                   "model_latency": model_latency, "translate_latency": translate_latency,
+                   "cpu_count": os.cpu_count()},
+        "results": {
+            "requests": requests,
+            "failures": len(failures),
+            "wall_seconds": round(elapsed, 3),
+            "requests_per_second": round(requests / elapsed, 1),
+            "server_cpu_seconds": round(server_cpu, 3),
+            # Service event loop + thread pool CPU only; the upstream latency is simulated
+            "requests_per_cpu_second": round(requests / server_cpu, 1) if server_cpu else None,
+            "p50_ms": round(latencies[requests // 2] * 1000, 1),
+            "p95_ms": round(latencies[int(requests * 0.95)] * 1000, 1),
+            "p99_ms": round(latencies[min(requests - 1, int(requests * 0.99))] * 1000, 1)
+        }
+    }
+    print(json.dumps(result["results"], indent=2))
+    if results_file:
+        with open(results_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result) + "\n")
+    return result
+
+#cell14
+# Run the application (or a maintenance command, e.g. `python main21.py benchmark-db`)
+COMMANDS = {
+    "benchmark-db": benchmark_patient_database,
+    "stress-db": stress_test_concurrent_writers,
+    "overload-model": simulate_model_overload,
+    "build-catalogs": build_message_catalogs,
+    "benchmark-startup": benchmark_startup,
+    "benchmark-e2e": run_end_to_end_benchmark,
+    "serve": run_service,
+    "load-test": load_test_service,
+    "benchmark-langid": benchmark_language_id,
+    "benchmark-audio": benchmark_audio_path,
+    "benchmark-asr": benchmark_speech_backends
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]]()
+    else:
+        run_virtual_doctor()
@@ -0,0 +1,26 @@
+import json
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# main21.py is a flat script at the repository root
+sys.path.insert(0, REPO_ROOT)
+
+# Pin the remote translator so routing never depends on the router's random exploration
+os.environ.setdefault("VIRTUAL_DOCTOR_TRANSLATION", "remote")
+
+
+@pytest.fixture
+def notebook():
+    """Run selected code cells of a notebook at the repository root and return their namespace"""
+    def load(name, cells, **namespace):
+        with open(os.path.join(REPO_ROOT, name), encoding="utf-8") as f:
+            source = json.load(f)["cells"]
+        namespace.setdefault("__name__", "notebook")  # Skips the cells' __main__ demos
+        for index in cells:
+            exec(compile("".join(source[index]["source"]), f"{name}[{index}]", "exec"), namespace)
+        return namespace
+    return load
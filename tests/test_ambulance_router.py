@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.sparse.csgraph import dijkstra
+
+
+def grid_data(size=8, seed=0):
+    """generate_large_dataset in miniature: right/down edges on a size x size grid"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for x in range(size):
+        for y in range(size):
+            for nx, ny in ((x + 1, y), (x, y + 1)):
+                if nx < size and ny < size:
+                    base_time = int(rng.integers(5, 30))
+                    density = round(float(rng.uniform(0, 1)), 2)
+                    rows.append([f"Node_{x}_{y}", f"Node_{nx}_{ny}", density, base_time, base_time * (1 + 0.5 * density)])
+    return pd.DataFrame(rows, columns=['start_node', 'end_node', 'traffic_density', 'base_time', 'travel_time'])
+
+
+@pytest.fixture
+def routing(notebook):
+    return notebook("Shortestpath.ipynb", [2], np=np, pd=pd)
+
+
+def path_cost(data, path):
+    weights = data.set_index(['start_node', 'end_node'])['travel_time']
+    return sum(weights[(u, v)] for u, v in zip(path, path[1:]))
+
+
+def test_routes_match_dijkstra(routing):
+    data = grid_data()
+    router = routing["FastAmbulanceRouter"](data, num_landmarks=4)
+    reference = dijkstra(router.graph_matrix(), directed=True)
+
+    for start, goal in routing["sample_reachable_pairs"](router, 40):
+        path, cost = router.find_optimal_route(start, goal)
+        assert path[0] == start and path[-1] == goal
+        assert cost == pytest.approx(path_cost(data, path), abs=0.006)
+        assert cost == pytest.approx(reference[router.node_ids([start])[0], router.node_ids([goal])[0]], abs=0.006)
+
+
+def test_unknown_or_unreachable_nodes(routing):
+    router = routing["FastAmbulanceRouter"](grid_data(4), num_landmarks=2)
+    assert router.find_optimal_route("Node_0_0", "Node_9_9") == ([], 0)
+    assert router.find_optimal_route("Node_3_3", "Node_0_0") == ([], 0)  # Edges only run right and down
+
+
+def test_nearest_hospital_table(routing):
+    data = grid_data()
+    hospitals = ["Node_3_4", "Node_7_7", "Node_6_1"]
+    router = routing["FastAmbulanceRouter"](data, hospitals=hospitals, num_landmarks=0)
+
+    for start in ["Node_0_0", "Node_2_5", "Node_6_0", "Node_7_7"]:
+        hospital, path, cost = router.nearest_hospital(start)
+        candidates = [router.find_optimal_route(start, h)[1] for h in hospitals]
+        best = min(c for c, h in zip(candidates, hospitals) if c or h == start)
+        assert cost == best and path[0] == start and path[-1] == hospital
+    assert router.nearest_hospital("Node_7_6") == ("Node_7_7", ["Node_7_6", "Node_7_7"], router.find_optimal_route("Node_7_6", "Node_7_7")[1])
+
+
+def test_names_without_grid_coordinates_use_landmarks_only(routing):
+    rng = np.random.default_rng(3)
+    names = [f"Station {chr(65 + i)}" for i in range(12)]
+    edges = {(a, b) for a, b in rng.integers(0, 12, size=(60, 2)) if a != b}
+    data = pd.DataFrame([(names[a], names[b], float(rng.uniform(1, 10))) for a, b in sorted(edges)],
+                        columns=['start_node', 'end_node', 'travel_time'])
+    router = routing["FastAmbulanceRouter"](data, num_landmarks=3)
+    assert router.coord_x is None and len(router.landmarks) == 3
+
+    reference = dijkstra(router.graph_matrix(), directed=True)
+    for start in router.node_names:
+        for goal in router.node_names:
+            _, cost = router.find_optimal_route(start, goal)
+            expected = reference[router.node_ids([start])[0], router.node_ids([goal])[0]]
+            assert cost == (pytest.approx(expected, abs=0.006) if np.isfinite(expected) else 0)
+
+
+def test_small_graph_without_coordinates_clamps_landmarks(routing):
+    data = pd.DataFrame([("A", "B", 4.0), ("B", "C", 3.0), ("A", "C", 9.0), ("C", "D", 2.0)],
+                        columns=['start_node', 'end_node', 'travel_time'])
+    router = routing["FastAmbulanceRouter"](data)  # Asks for the default 8 landmarks
+
+    assert router.coord_x is None
+    assert sorted(node for node, _, _ in router.landmarks) == [0, 1, 2, 3]
+    assert router.find_optimal_route("A", "D") == (["A", "B", "C", "D"], 9.0)
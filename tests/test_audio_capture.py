@@ -0,0 +1,293 @@
+import json
+import sys
+import threading
+import time
+import types
+import wave
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+
+import main21
+from main21 import (AudioDevice, AudioRingBuffer, FakeAudioStream, FakeSpeechBackend, HybridSpeechBackend, LinearResampler,
+                    ModelRegistry, SpeechBackend, StreamingStressAnalyzer, VoiceAssistant, VoskSpeechBackend, WavFileSource,
+                    create_speech_backend, float32_to_int16_inplace)
+
+
+def make_device(samples, rate=16000, chunk=1024):
+    return AudioDevice(rate=rate, chunk=chunk, stream_factory=FakeAudioStream.factory(samples, realtime=False),
+                       overflow="block")
+
+
+def test_record_audio_stops_at_the_limit_without_overwriting():
+    rate = 16000
+    samples = np.arange(3 * rate, dtype=np.float32) / (3 * rate)  # Ramp, so any wrap-around would show
+    voice = VoiceAssistant(backend=object(), device=make_device(samples, rate))
+    voice.max_record_seconds = 1
+
+    frames, recorded_rate = voice.record_audio()
+
+    assert recorded_rate == rate
+    assert frames.full and frames.written == rate
+    np.testing.assert_array_equal(frames.samples(), samples[:rate])
+
+
+def tone(frequency, rate, seconds=1.0):
+    return np.sin(2 * np.pi * frequency * np.arange(int(rate * seconds)) / rate).astype(np.float32)
+
+
+def rms(samples):
+    return float(np.sqrt(np.mean(samples ** 2)))
+
+
+def test_wav_file_source_yields_mono_float_chunks(tmp_path):
+    rate = 8000
+    left = (tone(440, rate) * 16000).astype(np.int16)
+    right = -left
+    path = str(tmp_path / "stereo.wav")
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(2)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(np.column_stack((left, right // 2)).tobytes())
+
+    source = WavFileSource(path, chunk=1000)
+    chunks = list(source)
+
+    assert source.rate == rate
+    assert all(len(chunk) == 1000 and chunk.dtype == np.float32 for chunk in chunks)
+    expected = (left.astype(np.float32) + (right // 2).astype(np.float32)) / 2 / 32768
+    np.testing.assert_allclose(np.concatenate(chunks), expected, atol=1e-6)
+
+
+def test_resampler_keeps_the_speech_band_and_removes_aliases():
+    speech = LinearResampler(44100, 16000).process(tone(1000, 44100))
+    alias = LinearResampler(44100, 16000).process(tone(12000, 44100))  # Would fold back to 4 kHz
+
+    assert abs(len(speech) - 16000) < 50
+    assert rms(speech[100:-100]) > 0.69
+    assert rms(alias[100:-100]) < 0.01
+
+
+def test_resampler_output_does_not_depend_on_chunking():
+    samples = np.random.default_rng(1).standard_normal(44100).astype(np.float32)
+    whole = LinearResampler(44100, 16000).process(samples)
+    resampler = LinearResampler(44100, 16000)
+    chunked = np.concatenate([resampler.process(samples[i:i + 1000]) for i in range(0, len(samples), 1000)])
+
+    assert len(chunked) == len(whole)
+    np.testing.assert_allclose(chunked, whole, atol=1e-5)
+
+
+class CrashingSpeechBackend(SpeechBackend):
+    name = "crashing"
+
+    def recognize(self, segment, rate, language_code):
+        raise RuntimeError("recognizer crashed")
+
+    def submit(self, segment, rate, language_code):
+        future = Future()
+        future.set_exception(RuntimeError("recognizer crashed"))
+        return future
+
+
+def write_utterance(path, rate=16000):
+    speech = np.concatenate((tone(300, rate, 1.0) * 0.5, np.zeros(int(2.5 * rate), dtype=np.float32)))
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes((speech * 32767).astype(np.int16).tobytes())
+
+
+def test_speech_backend_is_abstract():
+    with pytest.raises(TypeError):
+        SpeechBackend()
+
+
+def test_failed_segments_fall_back_to_the_remote_backend(tmp_path):
+    path = str(tmp_path / "utterance.wav")
+    write_utterance(path)
+    remote = FakeSpeechBackend({"en-US": "I have a cough"}, latency=0, real_time_factor=0)
+    voice = VoiceAssistant(backend=HybridSpeechBackend(CrashingSpeechBackend(), remote), device=AudioDevice())
+    segments = []
+
+    text = voice.stream_transcribe(WavFileSource(path), "en-US", on_segment=lambda i, t: segments.append((i, t)))
+
+    assert text == "I have a cough"
+    assert segments == [(0, "I have a cough")]
+    assert remote.calls == 1
+
+
+def read_chunks(device, count):
+    chunks = []
+    while len(chunks) < count:
+        chunk = device.read(timeout=1)
+        assert chunk is not None, "capture stalled"
+        chunks.append(chunk)
+    return chunks
+
+
+def test_audio_device_delivers_fake_stream_in_order():
+    samples = np.arange(8 * 256, dtype=np.float32)
+    device = make_device(samples, chunk=256)
+    device.start()
+    try:
+        chunks = read_chunks(device, 10)
+    finally:
+        device.stop()
+    captured = np.concatenate(chunks)
+    np.testing.assert_array_equal(captured[:len(samples)], samples)
+    assert not captured[len(samples):].any()  # Silence once the fake runs out of samples
+    assert device.overruns == 0
+
+
+def test_audio_device_drops_oldest_chunks_when_the_queue_is_full():
+    samples = np.arange(64 * 128, dtype=np.float32)
+    device = AudioDevice(rate=16000, chunk=128, max_queue_seconds=4 * 128 / 16000,
+                         stream_factory=FakeAudioStream.factory(samples, realtime=False))
+    device.start()
+    while device.chunks < 64:
+        time.sleep(0.001)
+    device.stop()
+
+    stats = device.stats()
+    assert stats["queued"] == 4
+    assert stats["overruns"] == stats["chunks"] - 4
+
+
+
+def test_stress_analysis_of_silence_is_neutral():
+    voice = VoiceAssistant(backend=FakeSpeechBackend(latency=0), device=AudioDevice())
+    result = voice.analyze_stress(np.zeros(2 * 16000, dtype=np.float32), 16000)
+
+    assert result["stress_level"] == "Low Stress"
+    assert np.isfinite(result["stress_score"])
+
+
+def test_stress_scoring_failure_is_not_fatal():
+    class BrokenAnalyzer:
+        def analyze(self):
+            raise FloatingPointError("bad frame")
+
+    voice = VoiceAssistant(backend=FakeSpeechBackend(latency=0), device=AudioDevice())
+    assert voice.finish_stress_analysis(BrokenAnalyzer()) is None
+    assert voice.last_stress_analysis is None
+
+
+def speech_like_clip(rate, seconds=3.3, seed=0):
+    """A gliding, amplitude-modulated tone with noise and a pause of digital silence"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * rate)) / rate
+    y = 0.05 * np.sin(2 * np.pi * (150 + 60 * t) * t) * (0.6 + 0.4 * np.sin(2 * np.pi * 3 * t))
+    y += 0.003 * rng.standard_normal(len(t))
+    y[int(1.2 * rate):int(1.6 * rate)] = 0  # Far below the loudest frame, so top_db clipping matters
+    return y.astype(np.float32)
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")  # audioread's imports, pulled in by librosa.load
+def test_streaming_stress_features_match_the_notebook(notebook, tmp_path):
+    pytest.importorskip("librosa")
+    sf = pytest.importorskip("soundfile")
+    rate = 22050  # librosa.load's default, so the notebook reads the clip unresampled
+    y = speech_like_clip(rate)
+    path = str(tmp_path / "clip.wav")
+    sf.write(path, y, rate, subtype="FLOAT")
+    expected = notebook("stress.ipynb", [1])["AudioEmotionAnalyzer"]().extract_features(path)
+
+    analyzer = StreamingStressAnalyzer(rate)
+    for start in range(0, len(y), 1000):  # Blocks that do not line up with the hop
+        analyzer.feed(y[start:start + 1000])
+    features = analyzer.features()
+
+    del expected["tempo"], features["tempo"]  # Tempo is estimated differently from librosa's beat tracker
+    assert 0 < features["rms"] < 1
+    assert features == pytest.approx(expected, abs=1e-4)
+
+
+def test_stress_analysis_mid_stream_does_not_consume_audio():
+    rate = 16000
+    y = speech_like_clip(rate)
+    whole, interrupted = StreamingStressAnalyzer(rate), StreamingStressAnalyzer(rate)
+    whole.feed(y)
+    interrupted.feed(y[:rate])
+    assert interrupted.analyze()["seconds"] > 0
+    interrupted.feed(y[rate:])
+
+    assert interrupted.features() == pytest.approx(whole.features())
+    assert StreamingStressAnalyzer(rate).analyze() is None
+
+
+def test_to_int16_leaves_the_recording_intact():
+    frames = AudioRingBuffer(rate=16000, max_seconds=1)
+    samples = np.linspace(-1.2, 1.2, 12000, dtype=np.float32)
+    frames.write(samples)
+    voice = VoiceAssistant(backend=FakeSpeechBackend(latency=0), device=AudioDevice())
+
+    first = voice.to_int16(frames)
+
+    np.testing.assert_array_equal(frames.samples(), samples)
+    np.testing.assert_array_equal(voice.to_int16(frames), first)
+    np.testing.assert_array_equal(first, float32_to_int16_inplace(samples.copy()))
+
+
+@pytest.fixture
+def fake_vosk(monkeypatch, tmp_path):
+    """A stand-in vosk module whose recognizers only finish when four run at the same time"""
+    barrier = threading.Barrier(4, timeout=5)
+    vosk = types.SimpleNamespace(models=[], recognizers=[], SetLogLevel=lambda level: None)
+
+    class Model:
+        def __init__(self, path):
+            vosk.models.append(path)
+
+    class KaldiRecognizer:
+        def __init__(self, model, rate):
+            self.model = model
+            self.data = b""
+            vosk.recognizers.append(self)
+
+        def AcceptWaveform(self, data):
+            assert not self.data, "recognizer used by two utterances at once"
+            self.data = data
+            barrier.wait()
+
+        def FinalResult(self):
+            text, self.data = f"{len(self.data) // 2} samples", b""
+            return json.dumps({"text": text})
+
+    vosk.Model, vosk.KaldiRecognizer = Model, KaldiRecognizer
+    monkeypatch.setitem(sys.modules, "vosk", vosk)
+    monkeypatch.setattr(main21, "model_registry", ModelRegistry())
+    (tmp_path / "en").mkdir()
+    return vosk, str(tmp_path)
+
+
+def test_vosk_batch_is_recognized_in_parallel_over_one_model(fake_vosk):
+    vosk, model_dir = fake_vosk
+    backend = VoskSpeechBackend(model_dir=model_dir, models={"en-US": "en"}, workers=4)
+    items = [(np.zeros(100 * (i + 1), dtype=np.int16), 16000, "en-US") for i in range(4)]
+
+    assert backend.recognize_batch(items) == [(f"{100 * (i + 1)} samples", None) for i in range(4)]
+    assert len(vosk.models) == 1
+    assert len(vosk.recognizers) == 4
+    assert len({id(recognizer.model) for recognizer in vosk.recognizers}) == 1
+
+    # Each worker keeps its recognizer for the next batch
+    futures = [backend.submit(*item) for item in items]
+    assert [future.result(timeout=5)[1] for future in futures] == [None] * 4
+    assert len(vosk.recognizers) == 4
+
+
+def test_voice_assistants_share_one_speech_backend(monkeypatch):
+    remote = FakeSpeechBackend(latency=0)
+    monkeypatch.setattr(main21, "_speech_backends", {"google": remote})
+    monkeypatch.setattr(main21, "ASR_BACKEND", "auto")
+
+    first, second = VoiceAssistant(device=AudioDevice()), VoiceAssistant(device=AudioDevice())
+
+    assert first.backend is second.backend
+    assert first.backend.local is create_speech_backend("vosk")
+    assert first.backend.remote is remote
+    assert create_speech_backend("unknown") is remote
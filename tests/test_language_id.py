@@ -0,0 +1,58 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from main21 import LanguageIdentifier
+
+
+def test_single_language_scripts_skip_the_model():
+    identifier = LanguageIdentifier()
+    samples = {
+        "எனக்கு தலைவலி உள்ளது": "ta",
+        "నాకు జ్వరం ఉంది": "te",
+        "我头痛发烧已经三天了": "zh-CN",
+        "三日前から頭痛と熱があります": "ja",  # Kanji-heavy, but the kana make it Japanese
+        "사흘 동안 두통과 열이 있어요": "ko",
+    }
+    assert {text: identifier.detect(text) for text in samples} == samples
+    assert identifier.stats()["model_calls"] == 0
+    assert identifier.stats()["script_hits"] == len(samples)
+
+
+def test_shared_scripts_and_latin_text_use_the_restricted_model():
+    identifier = LanguageIdentifier()
+    assert identifier.detect("मुझे तीन दिनों से सिरदर्द और बुखार है") == "hi"
+    assert identifier.detect("Tengo dolor de cabeza y fiebre desde hace tres días") == "es"
+    assert identifier.detect("I have had a headache and fever for three days") == "en"
+    assert identifier.stats()["model_calls"] == 3
+
+
+def test_results_are_cached_and_repeatable():
+    text = "J'ai mal à la tête et de la fièvre depuis trois jours"
+    first = LanguageIdentifier()
+    labels = [first.detect(text), first.detect(f"  {text} ")]
+    assert labels == ["fr", "fr"]
+    assert first.stats()["model_calls"] == 1
+    assert LanguageIdentifier().detect(text) == "fr"
+
+
+def test_undetectable_text_falls_back_to_default():
+    assert LanguageIdentifier().detect("12345 !!!", default="en") == "en"
+
+
+def test_counters_are_updated_under_the_stats_lock():
+    identifier = LanguageIdentifier()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        with identifier.stats_lock:
+            pending = pool.submit(identifier.detect, "எனக்கு தலைவலி உள்ளது")
+            time.sleep(0.1)
+            assert not pending.done()
+        assert pending.result(timeout=5) == "ta"
+    assert identifier.stats()["script_hits"] == 1
+
+
+def test_counters_are_exact_under_concurrent_detection():
+    identifier = LanguageIdentifier(cache_size=1)
+    texts = [f"எனக்கு தலைவலி {i}" for i in range(2000)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(identifier.detect, texts * 4))
+    assert identifier.stats()["script_hits"] == 8000
@@ -0,0 +1,96 @@
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.sparse.csgraph import dijkstra
+from sklearn.linear_model import LinearRegression
+
+from test_ambulance_router import grid_data
+
+
+@pytest.fixture
+def live(notebook, tmp_path):
+    """LiveTrafficRouter factory backed by a small linear travel-time model"""
+    routing = notebook("Shortestpath.ipynb", [2, 3], np=np, pd=pd, joblib=joblib)
+    data = grid_data()
+    model_path = tmp_path / "travel_time_predictor.pkl"
+    joblib.dump(LinearRegression().fit(data[['base_time', 'traffic_density']], data['travel_time']), model_path)
+
+    def build(node_data=data, **kwargs):
+        return routing["LiveTrafficRouter"](node_data, model_path=str(model_path), **kwargs)
+    build.routing = routing
+    return build
+
+
+def assert_fresh(router, pairs):
+    sources = router.node_ids([p[0] for p in pairs])
+    targets = router.node_ids([p[1] for p in pairs])
+    truth = dijkstra(router.graph_matrix(), directed=True, indices=sources)[np.arange(len(pairs)), targets]
+    answers = [router.find_optimal_route(start, goal)[1] for start, goal in pairs]
+    np.testing.assert_allclose(answers, truth, atol=0.006)
+
+
+def test_updates_rescore_only_named_edges(live):
+    router = live(num_landmarks=0)
+    before = router.weights.copy()
+    changed = router.apply_traffic_updates([("Node_0_0", "Node_0_1", 1.0), ("Node_0_0", "Node_0_1", 0.0),
+                                            ("Node_0_0", "Node_5_5", 0.5)])  # Unknown edge is ignored
+    row = router.edge_rows(["Node_0_0"], ["Node_0_1"])[0]
+    assert changed == 1
+    assert router.stats['updates'] == 2
+    # The last update for an edge in a batch wins
+    assert router.traffic_density[row] == 0.0
+    assert router.weights[router.edge_slot[row]] == pytest.approx(router.predict(router.base_time[[row]], np.array([0.0]))[0])
+    assert np.count_nonzero(router.weights != before) == 1
+
+
+def test_cached_routes_follow_traffic(live):
+    router = live(num_landmarks=4)
+    pairs = live.routing["sample_reachable_pairs"](router, 30)
+    assert_fresh(router, pairs)
+    assert router.stats['cache_misses'] == len(set(pairs))
+
+    feed = live.routing["synthetic_traffic_feed"](router, 20, seed=1, step=0.5)
+    for _ in range(10):
+        router.apply_traffic_updates(next(feed))
+        if router.landmarks_stale:
+            router.refresh_landmarks()
+        assert_fresh(router, pairs)
+    assert router.stats['cache_hits'] > 0
+    assert router.stats['invalidated'] > 0
+
+
+def test_jammed_route_edge_forces_a_detour(live):
+    router = live(hospitals=["Node_7_7"], num_landmarks=2)
+    path, cost = router.find_optimal_route("Node_0_0", "Node_7_7")
+    _, _, table_cost = router.nearest_hospital("Node_0_0")
+    assert table_cost == cost
+
+    router.apply_traffic_updates([(path[0], path[1], 50.0)])  # Jam the first road of the route
+    detour, new_cost = router.find_optimal_route("Node_0_0", "Node_7_7")
+    assert (detour[0], detour[1]) != (path[0], path[1])
+    assert router.nearest_hospital("Node_0_0")[2] == new_cost
+    assert_fresh(router, [("Node_0_0", "Node_7_7")])
+
+
+def test_parallel_edges_record_the_slot_the_route_used(live):
+    data = grid_data()
+    first = data.iloc[0]
+    # A faster second road between the same two junctions; name lookups still resolve to the first row
+    bypass = pd.DataFrame([[first['start_node'], first['end_node'], 0.0, 5, 5.0]], columns=data.columns)
+    router = live(pd.concat([data, bypass], ignore_index=True), num_landmarks=2)
+    fast_slot = int(router.edge_slot[len(data)])
+    slow_row = router.edge_rows([first['start_node']], [first['end_node']])[0]
+    assert slow_row == 0
+
+    path, cost = router.find_optimal_route(first['start_node'], "Node_7_7")
+    slots = router.route_cache[tuple(router.node_ids([first['start_node'], "Node_7_7"]))][2]
+    assert path[:2] == [first['start_node'], first['end_node']]
+    assert slots[0] == fast_slot
+    assert sum(router.weights[slots]) == pytest.approx(cost, abs=0.006)
+
+    # Slowing the unused parallel road leaves the cached route alone
+    router.apply_traffic_updates([(first['start_node'], first['end_node'], 1.0)])
+    assert router.stats['invalidated'] == 0
+    assert router.find_optimal_route(first['start_node'], "Node_7_7") == (path, cost)
+    assert router.stats['cache_hits'] == 1
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+import main21
+from main21 import UI_MESSAGES, MessageCatalog, build_message_catalogs, catalog_path, translate_template, translate_ui
+
+
+def shout(text):
+    return text.upper()
+
+
+def test_placeholders_survive_translation():
+    assert translate_template("Transcribed symptoms: {text}", shout) == "TRANSCRIBED SYMPTOMS: {text}"
+
+
+def test_mangled_markers_fall_back_to_translating_around_placeholders():
+    calls = []
+
+    def drops_markers(text):
+        calls.append(text)
+        return text.replace("[0]", "").upper()
+
+    assert translate_template("Hello {name}, welcome", drops_markers) == "HELLO {name}, WELCOME"
+    assert calls == ["Hello [0], welcome", "Hello", ", welcome"]
+
+
+@pytest.fixture
+def catalogs(tmp_path, monkeypatch):
+    monkeypatch.setattr(main21, "MESSAGE_CATALOG_DIR", str(tmp_path))
+    monkeypatch.setattr(main21, "_catalogs", {})
+    monkeypatch.setattr(main21, "_translate_uncached", lambda text, source, target: f"{target}:{text}")
+    return tmp_path
+
+
+def test_built_catalog_serves_messages_without_runtime_translation(catalogs, monkeypatch):
+    results = build_message_catalogs(lang_codes=["hi", "ta"])
+    assert results == {"hi": {"messages": len(UI_MESSAGES), "missing": []},
+                       "ta": {"messages": len(UI_MESSAGES), "missing": []}}
+
+    def no_runtime_translation(*args, **kwargs):
+        raise AssertionError("catalog miss")
+
+    monkeypatch.setattr(main21, "safe_translate", no_runtime_translation)
+    assert translate_ui("transcribed_symptoms", "hi", text="fever") == "hi:Transcribed symptoms: fever"
+    assert translate_ui("transcribed_symptoms", "en", text="fever") == "Transcribed symptoms: fever"
+
+
+def test_entries_built_from_older_english_are_ignored(catalogs):
+    build_message_catalogs(lang_codes=["hi"])
+    path = catalog_path("hi")
+    with open(path, encoding="utf-8") as f:
+        bundle = json.load(f)
+    bundle["messages"]["closing"]["source_hash"] = "stale"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(bundle, f)
+
+    catalog = MessageCatalog.load("hi")
+    assert catalog.get("closing") is None
+    assert catalog.get("transcribed_followup") == "hi:Transcribed follow-up: {text}"
+    assert not catalog.covers(UI_MESSAGES)
+    assert MessageCatalog.load("xx").messages == {}
@@ -0,0 +1,35 @@
+import threading
+
+import main21
+from main21 import Metrics
+
+
+def test_exports_while_new_series_are_added(monkeypatch):
+    monkeypatch.setattr(main21, "METRICS_ENABLED", True)
+    metrics = Metrics()
+
+    def writer():
+        for i in range(2000):
+            metrics.inc("requests", route=f"/r{i}")
+            metrics.observe("stage_seconds", 0.01, stage=f"s{i % 50}")
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    while thread.is_alive():
+        metrics.to_prometheus()
+        metrics.snapshot()
+        metrics.stage_report()
+    thread.join()
+
+
+def test_prometheus_text(monkeypatch):
+    monkeypatch.setattr(main21, "METRICS_ENABLED", True)
+    metrics = Metrics(prefix="test")
+    metrics.inc("db_commits", 2)
+    metrics.observe("stage_seconds", 0.2, stage="record")
+
+    text = metrics.to_prometheus()
+
+    assert "test_db_commits_total 2" in text
+    assert 'test_stage_seconds_count{stage="record"} 1' in text
+    assert metrics.snapshot()["histograms"][0]["count"] == 1
@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from main21 import ModelRegistry
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_concurrent_first_use_builds_the_model_once():
+    registry = ModelRegistry()
+    builds = []
+
+    def factory():
+        builds.append(threading.current_thread().name)
+        time.sleep(0.05)
+        return object()
+
+    registry.register("sentiment-analysis", factory)
+    assert not registry.is_loaded("sentiment-analysis")
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        instances = list(pool.map(lambda _: registry.get("sentiment-analysis"), range(8)))
+
+    assert len(builds) == 1
+    assert all(instance is instances[0] for instance in instances)
+    assert registry.is_loaded("sentiment-analysis")
+    assert registry.load_seconds["sentiment-analysis"] >= 0.05
+
+
+def test_unloaded_model_is_rebuilt_on_next_use():
+    registry = ModelRegistry()
+    registry.register("whisper", object)
+    first = registry.get("whisper")
+    registry.unload("whisper")
+    assert not registry.is_loaded("whisper")
+    assert registry.get("whisper") is not first
+
+
+def test_import_does_not_load_heavy_libraries():
+    heavy = ("torch", "transformers", "google.generativeai", "speech_recognition", "pyaudio")
+    code = f"import sys, main21; print([name for name in {heavy!r} if name in sys.modules])"
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == "[]"
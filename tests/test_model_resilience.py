@@ -0,0 +1,139 @@
+import threading
+import time
+
+import pytest
+
+import main21
+from main21 import FakeGenerativeModel, ModelUnavailableError, ResilientModelClient, is_retryable_error
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    # Only the client's backoff sleeps; the fakes' latency is zero in these tests
+    monkeypatch.setattr(main21, "sleep", lambda seconds: None)
+
+
+@pytest.mark.parametrize("error, retryable", [
+    (Exception("429 Resource has been exhausted (e.g. check quota)."), True),
+    (Exception("503 The model is overloaded"), True),
+    (Exception("Rate limit exceeded"), True),
+    (TimeoutError("slow"), True),
+    (Exception("Could not generate a response"), False),
+    (Exception("Failed to separate the candidates"), False),
+    (Exception("400 Invalid argument: prompt is empty"), False),
+    (Exception("404 models/unknown is not found"), False),
+])
+def test_is_retryable_error_matches_whole_words(error, retryable):
+    assert is_retryable_error(error) is retryable
+
+
+def test_is_retryable_error_uses_status_code():
+    class ApiError(Exception):
+        code = 503
+
+    class BadRequest(Exception):
+        code = 400
+
+    assert is_retryable_error(ApiError("backend hiccup"))
+    assert not is_retryable_error(BadRequest("rate of something"))
+
+
+def test_returns_model_text_and_streams():
+    model = FakeGenerativeModel(latency=0, seed=1)
+    client = ResilientModelClient([("fake", model)], requests_per_second=100, burst=10, deadline=2)
+    assert client.generate_content("fever").text == model.text
+    assert "".join(chunk.text for chunk in client.generate_content("fever", stream=True)) == model.text
+
+
+def test_retries_count_once_against_the_breaker(no_backoff):
+    model = FakeGenerativeModel(latency=0, error_rate=1.0, seed=1)
+    client = ResilientModelClient([("fake", model)], requests_per_second=100, burst=10, deadline=2,
+                                  max_retries=2, breaker_threshold=2)
+    with pytest.raises(ModelUnavailableError):
+        client.generate_content("fever")
+    assert model.calls == 3
+    assert client.models[0][2].failures == 1
+    assert client.breaker_states() == {"fake": "closed"}
+
+    with pytest.raises(ModelUnavailableError):
+        client.generate_content("fever")
+    assert client.breaker_states() == {"fake": "open"}
+
+
+def test_open_circuit_does_not_spend_a_token():
+    primary = FakeGenerativeModel(latency=0, seed=1)
+    secondary = FakeGenerativeModel(latency=0, seed=2)
+    client = ResilientModelClient([("primary", primary), ("secondary", secondary)],
+                                  requests_per_second=0.01, burst=1, deadline=1)
+    breaker = client.models[0][2]
+    breaker.state, breaker.opened_at = "open", time.monotonic()
+
+    assert client.generate_content("fever").text == secondary.text
+    assert primary.calls == 0
+    assert client.stats["rate_limited"] == 0
+
+
+def test_bad_request_fails_over_without_tripping():
+    primary = FakeGenerativeModel(latency=0, error_rate=1.0, error_message="400 Invalid argument", seed=1)
+    secondary = FakeGenerativeModel(latency=0, seed=2)
+    client = ResilientModelClient([("primary", primary), ("secondary", secondary)],
+                                  requests_per_second=100, burst=10, deadline=2)
+    assert client.generate_content("fever").text == secondary.text
+    assert primary.calls == 1
+    assert client.models[0][2].failures == 0
+
+
+def test_hung_model_hits_the_deadline():
+    model = FakeGenerativeModel(latency=0, hang_rate=1.0, seed=1)
+    client = ResilientModelClient([("fake", model)], requests_per_second=100, burst=10, deadline=0.2)
+    started = time.monotonic()
+    with pytest.raises(ModelUnavailableError):
+        client.generate_content("fever")
+    assert time.monotonic() - started < 1.5
+    assert client.stats["timeouts"] >= 1
+
+
+class StallingStream:
+    """Yields a few chunks, then hangs like an upstream stream that stopped sending"""
+    def __init__(self, chunks, stall=3600):
+        self.chunks = chunks
+        self.stall = stall
+
+    def generate_content(self, prompt, stream=False):
+        def chunks():
+            for text in self.chunks:
+                yield FakeGenerativeModel.Response(text)
+            time.sleep(self.stall)
+        return chunks()
+
+
+def test_stream_uses_one_reader_thread(monkeypatch):
+    model = FakeGenerativeModel(latency=0, chunk_size=5, seed=1)
+    client = ResilientModelClient([("fake", model)], requests_per_second=100, burst=10, deadline=2)
+    stream = client.generate_content("fever", stream=True)
+    next(stream)
+
+    started = []
+    start = threading.Thread.start
+
+    def counting_start(thread):
+        started.append(thread.name)
+        start(thread)
+
+    monkeypatch.setattr(threading.Thread, "start", counting_start)
+    rest = [chunk.text for chunk in stream]
+    assert len(rest) > 10
+    assert len(started) == 1
+
+
+def test_stalled_stream_times_out_after_idle_timeout():
+    client = ResilientModelClient([("fake", StallingStream(["Rest ", "and ", "fluids."]))], requests_per_second=100,
+                                  burst=10, deadline=2, stream_idle_timeout=0.2)
+    received = []
+    start = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        for chunk in client.generate_content("fever", stream=True):
+            received.append(chunk.text)
+    assert received == ["Rest ", "and ", "fluids."]
+    assert time.perf_counter() - start < 1.5
+    assert client.stats["timeouts"] == 1
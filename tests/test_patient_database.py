@@ -0,0 +1,190 @@
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+import main21
+from main21 import (AsyncSessionEngine, PatientDatabase, benchmark_patient_database, metrics,
+                    stress_test_concurrent_writers)
+
+
+def make_db(tmp_path, **kwargs):
+    return PatientDatabase(file_path=str(tmp_path / "records.json"), db_path=str(tmp_path / "records.db"), **kwargs)
+
+
+def test_concurrent_writer_processes_lose_nothing(tmp_path):
+    assert stress_test_concurrent_writers(processes=4, writes_per_process=50, db_path=str(tmp_path / "stress.db"))
+
+
+def test_history_reads_back_in_order(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        for i in range(3):
+            db.add_patient("patient_1", {"symptoms": f"symptom {i}"})
+        db.add_patient("patient_2", {"symptoms": "other"})
+        history = db.get_patient_history("patient_1")
+        assert [record["symptoms"] for record in history] == ["symptom 0", "symptom 1", "symptom 2"]
+        assert db.count_records() == 4
+    finally:
+        db.close()
+
+
+def test_legacy_json_records_are_migrated_once(tmp_path):
+    legacy = {
+        "patient_1": [{"timestamp": "2024-01-01 09:00:00", "symptoms": "fever"},
+                      {"timestamp": "2024-01-03 09:00:00", "symptoms": "cough"}],
+        "patient_2": [{"timestamp": "2024-01-02 09:00:00", "symptoms": "rash"}],
+    }
+    json_path = tmp_path / "records.json"
+    json_path.write_text(json.dumps(legacy), encoding="utf-8")
+
+    db = make_db(tmp_path)
+    db.close()
+    assert not json_path.exists() and (tmp_path / "records.json.migrated").exists()
+
+    # A restored JSON file is not imported a second time
+    os.replace(tmp_path / "records.json.migrated", json_path)
+    db = make_db(tmp_path)
+    try:
+        assert db.count_records() == 3
+        assert db.get_patient_history("patient_1") == legacy["patient_1"]
+        assert db.get_patient_history("patient_2") == legacy["patient_2"]
+        assert db.get_patient_summary("patient_1")["visits"] == 2
+    finally:
+        db.close()
+
+
+def test_history_reads_only_touch_one_patient(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        for i in range(30):
+            db.add_patient(f"patient_{i % 3}", {"symptoms": f"visit {i}"})
+        assert [r["symptoms"] for r in db.get_patient_history("patient_1")] == [f"visit {i}" for i in range(1, 30, 3)]
+        assert [r["symptoms"] for r in db.get_recent_history("patient_2", limit=2)] == ["visit 26", "visit 29"]
+        assert db.get_patient_history("nobody") == []
+        plan = " ".join(row[-1] for row in db.conn.execute(
+            "EXPLAIN QUERY PLAN SELECT data FROM consultations WHERE patient_id = ? ORDER BY id", ("patient_1",)))
+        assert "USING INDEX" in plan or "USING COVERING INDEX" in plan
+    finally:
+        db.close()
+
+
+def test_database_benchmark_cleans_up_after_itself(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    results = benchmark_patient_database(sizes=(100, 200), sample_writes=5, directory=str(tmp_path))
+    assert [result["records"] for result in results] == [100, 200]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_engine_saves_share_group_commits(tmp_path, monkeypatch):
+    monkeypatch.setattr(main21, "METRICS_ENABLED", True)
+    metrics.reset()
+    db = make_db(tmp_path, commit_interval=0.05)
+    engine = AsyncSessionEngine(model=None, max_in_flight=8, db=db)
+
+    async def save_all():
+        await asyncio.gather(*(engine.save(f"patient_{i}", {"symptoms": "fever"}) for i in range(16)))
+
+    try:
+        asyncio.run(save_all())
+        commits = metrics.counters.get(metrics.key("db_commits", {}), 0)
+        assert db.count_records() == 16
+        assert 0 < commits < 16
+    finally:
+        engine.shutdown()
+        db.close()
+        metrics.reset()
+
+
+def failing_insert(rows):
+    raise sqlite3.OperationalError("database is locked")
+
+
+@pytest.mark.parametrize("group_commit", [True, False])
+def test_failed_commit_is_raised_to_waiting_callers(tmp_path, monkeypatch, group_commit):
+    db = make_db(tmp_path, group_commit=group_commit)
+    monkeypatch.setattr(db, "_insert_rows", failing_insert)
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            db.add_patient("p1", {"symptoms": "fever"})
+        with pytest.raises(sqlite3.OperationalError):
+            db.add_screening("p1", {"phq9_score": 12})
+    finally:
+        db.close()
+
+
+def test_flush_after_close_returns(tmp_path):
+    db = make_db(tmp_path)
+    db.close()
+    flusher = threading.Thread(target=db.flush, daemon=True)
+    flusher.start()
+    flusher.join(timeout=2)
+    assert not flusher.is_alive()
+
+
+def test_queued_writes_are_committed_at_exit(tmp_path):
+    db_path = tmp_path / "records.db"
+    script = (
+        "import main21\n"
+        f"db = main21.PatientDatabase(file_path={str(tmp_path / 'records.json')!r}, db_path={str(db_path)!r},"
+        " commit_interval=5.0)\n"
+        "for i in range(50):\n"
+        "    db.add_patient(f'patient_{i % 5}', {'seq': i}, wait=False)\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(os.path.dirname(__file__)),
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+
+    db = make_db(tmp_path)
+    try:
+        assert db.count_records() == 50
+    finally:
+        db.close()
+
+
+def test_non_numeric_screening_answers_become_nan(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        db.add_screening("p1", {"phq9_score": 12, "gad7_score": 7})
+        db.add_patient("p2", {"symptoms": "cough"})  # Ordinary consultation, skipped
+        db.add_patient("p3", {"input_method": "screening", "screening": {"phq9_score": "severe", "gad7_score": 5}})
+
+        chunks = list(db.iter_screenings(chunk_size=10))
+        assert len(chunks) == 1
+        ids, patient_ids, X = chunks[0]
+        assert list(patient_ids) == ["p1", "p3"]
+        assert X.shape == (2, len(main21.SCREENING_FEATURES))
+        assert X[0, 0] == 12 and X[1, 1] == 5
+        assert np.isnan(X[1, 0])
+    finally:
+        db.close()
+
+
+def test_add_screening_rejects_bad_answers(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        for answers in ({"phq9_score": "high"}, {"mood": 3}, [1, 2]):
+            with pytest.raises(ValueError):
+                db.add_screening("p1", answers)
+        assert db.count_records() == 0
+    finally:
+        db.close()
+
+
+def test_risk_scores_round_trip(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        db.save_risk_scores(np.array([1, 2]), np.array(["p1", "p2"], dtype=object), np.array([0.9, 0.1]),
+                            np.array([True, False]), "v1", 2)
+        assert db.risk_watermark("v1") == 2
+        assert db.get_risk_score("p1")["flag"] == 1
+        assert db.get_risk_score("missing") is None
+        assert db.flagged_patients("v1") == [("p1", 0.9)]
+    finally:
+        db.close()
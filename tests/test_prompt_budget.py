@@ -0,0 +1,60 @@
+import pytest
+
+from main21 import (PROMPT_HISTORY_CANDIDATES, PROMPT_TOKEN_BUDGET, PatientDatabase, VirtualDoctor, estimate_tokens,
+                    truncate_to_tokens, update_patient_summary)
+
+
+@pytest.fixture
+def doctor(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    doctor = VirtualDoctor(gemini_model=None)
+    yield doctor
+    doctor.db.close()
+
+
+def record(day, symptoms, advice="Rest and drink fluids."):
+    return {"timestamp": f"2024-01-{day:02d}T09:00:00", "symptoms": symptoms, "response": f"**{advice}**\nMore text."}
+
+
+def test_prompt_stays_within_budget_as_history_grows(tmp_path, doctor):
+    db = PatientDatabase(file_path=str(tmp_path / "records.json"), db_path=str(tmp_path / "records.db"))
+    try:
+        for day in range(1, 29):
+            db.add_patient("p1", record(day, f"persistent headache and nausea, day {day} " + "details " * 80))
+        context = db.get_history_context("p1", PROMPT_HISTORY_CANDIDATES)
+    finally:
+        db.close()
+
+    assert context["summary"]["visits"] == 28
+    assert len(context["recent"]) == PROMPT_HISTORY_CANDIDATES
+    prompt = doctor.build_prompt("headache again " * 500, context)
+    assert estimate_tokens(prompt) <= PROMPT_TOKEN_BUDGET
+    assert "Patient history: 28 records since" in prompt
+    assert "headache (28)" in prompt
+
+
+def test_related_records_are_kept_before_newer_unrelated_ones(doctor):
+    history = [record(1, "sprained ankle while running")] + [record(day, f"seasonal cough {day}") for day in range(2, 10)]
+    text = doctor.build_history_text(history, symptoms="ankle still swollen", token_budget=60)
+    lines = text.splitlines()
+    # Oldest first in the prompt; the related visit survives, the older unrelated ones do not
+    assert lines[0] == "Date: 2024-01-01T09:00:00, Symptoms: sprained ankle while running, Advice: Rest and drink fluids."
+    assert lines[-1].startswith("Date: 2024-01-09T09:00:00, Symptoms: seasonal cough 9")
+    assert 1 < len(lines) < len(history)
+    assert sum(estimate_tokens(line) for line in lines) <= 60
+
+
+def test_summary_terms_stay_bounded():
+    summary = None
+    for day in range(1, 200):
+        summary = update_patient_summary(summary, record(day % 28 + 1, f"symptom{chr(97 + day % 26)}{day} fever"))
+    assert summary["visits"] == 199
+    assert len(summary["terms"]) <= 40
+    assert len(summary["recent"]) == 5
+
+
+def test_truncation_keeps_start_and_end():
+    text = "Started with a fever. " + "filler " * 400 + "Is it serious?"
+    truncated = truncate_to_tokens(text, 50)
+    assert len(truncated) <= 200
+    assert truncated.startswith("Started with a fever.") and truncated.endswith("Is it serious?")
@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+
+import main21
+from main21 import FakeGenerativeModel, PatientDatabase, ResponseCache, VirtualDoctor, metrics
+
+
+@pytest.fixture
+def counters(monkeypatch):
+    monkeypatch.setattr(main21, "METRICS_ENABLED", True)
+    metrics.reset()
+    yield lambda name: metrics.counters.get(metrics.key(name, {}), 0)
+    metrics.reset()
+
+
+@pytest.fixture
+def make_doctor(tmp_path):
+    doctors = []
+
+    def make(model, **cache_args):
+        db = PatientDatabase(file_path=str(tmp_path / "records.json"), db_path=str(tmp_path / "records.db"))
+        doctors.append(VirtualDoctor(model, response_cache=ResponseCache(**cache_args), db=db))
+        return doctors[-1]
+    yield make
+    for doctor in doctors:
+        doctor.db.close()
+
+
+def run_together(*calls):
+    results = [None] * len(calls)
+    barrier = threading.Barrier(len(calls))
+
+    def run(index, call):
+        barrier.wait()
+        results[index] = call()
+
+    threads = [threading.Thread(target=run, args=(index, call)) for index, call in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_identical_requests_make_one_upstream_call(make_doctor, counters):
+    model = FakeGenerativeModel(latency=0.2)
+    doctor = make_doctor(model)
+
+    answers = run_together(lambda: doctor.get_medical_response("Fever and headache"),
+                           lambda: doctor.get_medical_response("fever, and headache!"))
+
+    assert model.calls == 1
+    assert answers[0] == answers[1] == model.text
+    assert counters("response_cache_misses") == 1
+    assert counters("response_cache_coalesced") == 1
+
+
+def test_concurrent_identical_streams_make_one_upstream_call(make_doctor, counters):
+    model = FakeGenerativeModel(latency=0.2, chunk_size=20)
+    doctor = make_doctor(model)
+
+    answers = run_together(lambda: "".join(doctor.stream_medical_response("dry cough")),
+                           lambda: "".join(doctor.stream_medical_response("Dry cough.")))
+
+    assert model.calls == 1
+    assert answers[0] == answers[1] == model.text
+    assert counters("response_cache_coalesced") == 1
+
+
+def test_hits_and_near_hits_are_exported(make_doctor, counters):
+    model = FakeGenerativeModel(latency=0)
+    doctor = make_doctor(model, near_duplicate_threshold=0.7)
+
+    doctor.get_medical_response("sore throat and mild fever since monday")
+    doctor.get_medical_response("Sore throat and mild fever since Monday.")
+    doctor.get_medical_response("sore throat and a mild fever since monday")
+
+    assert model.calls == 1
+    assert (counters("response_cache_misses"), counters("response_cache_hits"),
+            counters("response_cache_near_hits")) == (1, 1, 1)
+    assert doctor.response_cache.stats()["near_hits"] == 1
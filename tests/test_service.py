@@ -0,0 +1,135 @@
+import asyncio
+import sqlite3
+import warnings
+
+import numpy as np
+import pytest
+
+pytest.importorskip("aiohttp")
+from aiohttp.test_utils import TestClient, TestServer
+
+from main21 import (CAPTURE_CHUNK, AudioDevice, FakeAudioStream, FakeGenerativeModel, FakeSpeechBackend,
+                    FakeTranslationBackend, PatientDatabase, ResilientModelClient, TranslationRouter,
+                    VoiceAssistant, create_service_app, service_app_key)
+
+
+def make_app(tmp_path, token=None):
+    model = ResilientModelClient([("fake", FakeGenerativeModel(latency=0))], requests_per_second=1000, burst=1000)
+    voice = VoiceAssistant(backend=FakeSpeechBackend(latency=0, real_time_factor=0), device=AudioDevice(
+        stream_factory=FakeAudioStream.factory(np.zeros(CAPTURE_CHUNK, dtype=np.float32))))
+    db = PatientDatabase(file_path=str(tmp_path / "records.json"), db_path=str(tmp_path / "records.db"))
+    router = TranslationRouter([FakeTranslationBackend(0)], mode="remote")
+    return create_service_app(model, db=db, voice=voice, process_workers=0, translation_router=router,
+                              service_token=token)
+
+
+def serve(app, scenario):
+    async def run():
+        async with TestClient(TestServer(app)) as client:
+            return await scenario(client)
+    return asyncio.run(run())
+
+
+def test_patient_history_requires_the_service_token(tmp_path):
+    async def scenario(client):
+        anonymous = await client.get("/patients/p1/history")
+        wrong = await client.get("/patients/p1/history", headers={"Authorization": "Bearer nope"})
+        allowed = await client.get("/patients/p1/history", headers={"Authorization": "Bearer secret"})
+        return anonymous.status, wrong.status, allowed.status
+
+    assert serve(make_app(tmp_path, token="secret"), scenario) == (401, 401, 200)
+
+
+def test_patient_history_is_disabled_without_a_token(tmp_path):
+    async def scenario(client):
+        return (await client.get("/patients/p1/history")).status
+
+    assert serve(make_app(tmp_path), scenario) == 403
+
+
+def test_websocket_replay_keeps_message_indexes(tmp_path):
+    async def scenario(client):
+        started = await (await client.post("/consultations", json={})).json()
+        ws = await client.ws_connect(f"/consultations/{started['session_id']}/ws?since=1")
+        replayed = [await ws.receive_json(timeout=5) for _ in range(started["next_index"] - 1)]
+        await ws.close()
+        return started, replayed
+
+    started, replayed = serve(make_app(tmp_path), scenario)
+    assert started["next_index"] >= 2
+    assert [event["index"] for event in replayed] == list(range(1, started["next_index"]))
+    assert [event["text"] for event in replayed] == started["messages"][1:]
+
+
+def test_screening_answers_and_risk_endpoints(tmp_path):
+    app = make_app(tmp_path, token="secret")
+    auth = {"Authorization": "Bearer secret"}
+
+    async def scenario(client):
+        stored = await client.post("/patients/p1/screening", json={"phq9_score": 18, "sleep_hours": 4}, headers=auth)
+        rejected = await client.post("/patients/p1/screening", json={"phq9_score": "high"}, headers=auth)
+        anonymous = await client.post("/patients/p1/screening", json={"phq9_score": 3})
+        unscored = await client.get("/patients/p1/risk", headers=auth)
+        flagged = await (await client.get("/patients/flagged", headers=auth)).json()
+        return stored.status, rejected.status, anonymous.status, unscored.status, flagged
+
+    assert serve(app, scenario) == (201, 400, 401, 404, [])
+    db = app[service_app_key("service")].engine.doctor.db
+    ids, patient_ids, X = next(db.iter_screenings())
+    assert list(patient_ids) == ["p1"] and X[0, 0] == 18
+
+
+def test_screening_write_failure_is_not_reported_as_stored(tmp_path, monkeypatch):
+    app = make_app(tmp_path, token="secret")
+    db = app[service_app_key("service")].engine.doctor.db
+
+    def failing_insert(rows):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(db, "_insert_rows", failing_insert)
+
+    async def scenario(client):
+        response = await client.post("/patients/p1/screening", json={"phq9_score": 18},
+                                     headers={"Authorization": "Bearer secret"})
+        return response.status
+
+    assert serve(app, scenario) == 500
+
+
+def test_malformed_requests_are_rejected_with_400(tmp_path):
+    async def scenario(client):
+        started = await (await client.post("/consultations", json={})).json()
+        session = f"/consultations/{started['session_id']}"
+        auth = {"Authorization": "Bearer secret"}
+        responses = [
+            await client.post("/consultations", data="{not json"),
+            await client.post("/consultations", json=["text"]),
+            await client.post(f"{session}/messages", data="{not json"),
+            await client.post(f"{session}/messages", json="hello"),
+            await client.get(f"{session}?since=abc"),
+            await client.get(f"{session}?since=-1"),
+            await client.get(f"{session}/ws?since=abc"),
+            await client.get("/patients/p1/history?limit=ten", headers=auth),
+        ]
+        ws = await client.ws_connect(f"{session}/ws?since={started['next_index']}")
+        await ws.send_str("[1, 2]")
+        error = await ws.receive_json(timeout=5)
+        await ws.close()
+        return started, [response.status for response in responses], error
+
+    started, statuses, error = serve(make_app(tmp_path, token="secret"), scenario)
+    assert statuses == [400] * 8
+    assert error == {"type": "error", "error": "Expected a JSON object"}
+    assert len(started["session_id"]) >= 22  # 128 random bits
+
+
+def test_app_state_uses_typed_keys(tmp_path):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        app = make_app(tmp_path)
+
+    async def scenario(client):
+        return client.app[service_app_key("reaper")].done()
+
+    assert serve(app, scenario) is False
+    assert app[service_app_key("service")].engine.doctor.db is not None
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+
+import main21
+from main21 import (AsyncSessionEngine, FakeGenerativeModel, FakeTranslationBackend, PatientDatabase, ScriptedIO,
+                    TranslationCache, TranslationRouter, run_end_to_end_benchmark)
+
+
+def make_engine(tmp_path, model=None, max_in_flight=4):
+    db = PatientDatabase(file_path=str(tmp_path / "records.json"), db_path=str(tmp_path / "records.db"))
+    router = TranslationRouter([FakeTranslationBackend(latency=0)], mode="remote")
+    return AsyncSessionEngine(model or FakeGenerativeModel(latency=0, chunk_size=25), max_in_flight=max_in_flight,
+                              db=db, translation_router=router, translation_cache=TranslationCache())
+
+
+def close_engine(engine):
+    engine.shutdown()
+    engine.doctor.db.close()
+
+
+def test_calls_never_exceed_max_in_flight(tmp_path):
+    engine = make_engine(tmp_path, max_in_flight=3)
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def blocking_call():
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+
+    async def run_all():
+        await asyncio.gather(*(engine.call(blocking_call) for _ in range(12)))
+
+    try:
+        asyncio.run(run_all())
+    finally:
+        close_engine(engine)
+    assert peak[0] == 3
+
+
+class SlowIO(ScriptedIO):
+    async def send(self, text):
+        await asyncio.sleep(0.05)
+        await super().send(text)
+
+
+def test_slow_client_does_not_hold_an_in_flight_slot(tmp_path):
+    engine = make_engine(tmp_path, max_in_flight=1)
+    io = SlowIO([])
+
+    async def run():
+        stream = asyncio.create_task(engine.stream_response(io, "fever", [], "en"))
+        await asyncio.sleep(0.05)  # Model stream and translation finish almost at once
+        other = await engine.call(lambda: len(io.sent))
+        response, translated, _ = await stream
+        return other, response, translated
+
+    try:
+        sent_when_other_ran, response, translated = asyncio.run(run())
+    finally:
+        close_engine(engine)
+    assert sent_when_other_ran < 3  # The other call ran while sentences were still being sent
+    assert "".join(io.sent) == translated == response
+
+
+def test_session_walks_every_state(tmp_path, monkeypatch):
+    engine = make_engine(tmp_path)
+    states = []
+    stage_timer = main21.stage_timer
+
+    def tracking_timer(stage, **attributes):
+        if stage.startswith("state:"):
+            states.append(stage[len("state:"):])
+        return stage_timer(stage, **attributes)
+
+    monkeypatch.setattr(main21, "stage_timer", tracking_timer)
+    io = ScriptedIO(["1", "Asha", "34", "F", "555", "I have had a fever and a cough for two days",
+                     "yes", "Should I take paracetamol?"])
+    try:
+        session = asyncio.run(engine.run_session(io))
+        history = engine.doctor.db.get_patient_history("Asha_555")
+    finally:
+        close_engine(engine)
+
+    assert states == ["language", "intake", "symptoms", "response", "followup", "closing"]
+    assert session.state == "done" and session.lang_code == "en"
+    assert history[0]["symptoms"] == "I have had a fever and a cough for two days"
+    assert history[1]["followup_question"] == "Should I take paracetamol?"
+    assert io.sent[-1] == main21.UI_MESSAGES["closing"]
+
+
+def test_declined_followup_goes_straight_to_closing(tmp_path):
+    engine = make_engine(tmp_path)
+    io = ScriptedIO(["1", "Ravi", "40", "M", "556", "Sore throat since yesterday morning", "no"])
+    try:
+        session = asyncio.run(engine.run_session(io))
+        history = engine.doctor.db.get_patient_history("Ravi_556")
+    finally:
+        close_engine(engine)
+    assert session.state == "done"
+    assert len(history) == 1 and history[0]["symptoms"] == "Sore throat since yesterday morning"
+
+
+def test_handler_error_ends_the_session_with_a_message(tmp_path, monkeypatch):
+    engine = make_engine(tmp_path)
+
+    def disk_full(patient_id, data):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(engine.doctor.db, "add_patient", disk_full)
+    io = ScriptedIO(["1", "Mei", "29", "F", "557", "Headache and dizziness all week"])
+    try:
+        session = asyncio.run(engine.run_session(io))
+    finally:
+        close_engine(engine)
+    assert session.state == "response"
+    assert io.sent[-2:] == ["An error occurred: disk full", "Please try again later."]
+
+
+def test_benchmark_uses_its_own_translation_without_touching_globals(tmp_path):
+    router, cache = main21.translation_router, main21.translation_cache
+
+    result = run_end_to_end_benchmark(sessions=6, concurrency=4, model_latency=0.01, translate_latency=0.001,
+                                      asr_latency=0.01, db_path=str(tmp_path / "e2e.db"),
+                                      results_file=str(tmp_path / "e2e.jsonl"), trace_memory=False)
+
+    assert result["results"]["sessions_completed"] == 6
+    assert result["results"]["calls"]["translate"] > 0
+    assert result["results"]["db_records_added"] == 12
+    assert main21.translation_router is router and main21.translation_cache is cache
@@ -0,0 +1,43 @@
+import time
+
+import main21
+from main21 import SentenceSplitter, stream_translated_response
+
+
+def test_splitter_waits_for_complete_sentences():
+    splitter = SentenceSplitter()
+    assert splitter.feed("Rest well. Drink") == [("Rest well.", " ")]
+    assert splitter.feed(" water.\n1. Take par") == [("Drink water.", "\n")]
+    # "1." is a list number, not the end of a sentence
+    assert splitter.feed("acetamol.\n") == []
+    assert splitter.flush() == [("1. Take paracetamol.", "\n")]
+    assert splitter.flush() == []
+
+
+class StreamingDoctor:
+    def __init__(self, chunks, emitted):
+        self.chunks = chunks
+        self.emitted = emitted
+        self.emitted_before_last_chunk = None
+
+    def stream_medical_response(self, symptoms, patient_history):
+        for index, chunk in enumerate(self.chunks):
+            if index == len(self.chunks) - 1:
+                self.emitted_before_last_chunk = list(self.emitted)
+            yield chunk
+            time.sleep(0.1)  # Give the translation pool time to finish the sentence just submitted
+
+
+def test_sentences_are_emitted_in_order_while_streaming(monkeypatch):
+    monkeypatch.setattr(main21, "translate_segment", lambda text, source, target: f"<{text}>")
+    emitted = []
+    doctor = StreamingDoctor(["You have a cold. ", "Rest for two days.\n", "See a doctor ", "if it gets worse."], emitted)
+
+    response, translated, timing = stream_translated_response(doctor, "cold", [], "hi", emit=emitted.append)
+
+    assert response == "You have a cold. Rest for two days.\nSee a doctor if it gets worse."
+    assert translated == "<You have a cold.> <Rest for two days.>\n<See a doctor if it gets worse.>"
+    assert emitted == ["<You have a cold.> ", "<Rest for two days.>\n", "<See a doctor if it gets worse.>"]
+    assert doctor.emitted_before_last_chunk[:1] == ["<You have a cold.> "]
+    assert timing["sentences"] == 3
+    assert timing["time_to_first_sentence"] < timing["total"]
@@ -0,0 +1,42 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+sf = pytest.importorskip("soundfile")
+
+
+@pytest.fixture
+def stress(notebook):
+    namespace = notebook("stress.ipynb", [1, 2])
+    # Cell functions are not importable by worker processes; threads run the same code
+    namespace["ProcessPoolExecutor"] = ThreadPoolExecutor
+    return namespace
+
+
+@pytest.mark.filterwarnings("ignore")  # librosa falls back to audioread for the broken file
+def test_benchmark_skips_files_that_fail_to_decode(stress, tmp_path):
+    rate = 16000
+    t = np.arange(2 * rate) / rate
+    sf.write(str(tmp_path / "call.wav"), (0.3 * np.sin(2 * np.pi * 150 * t)).astype(np.float32), rate)
+    (tmp_path / "broken.wav").write_bytes(b"not audio")
+
+    report = stress["benchmark_batch_features"](str(tmp_path), workers=2)
+
+    assert report["files"] == 2
+    assert report["failed"] == 1
+    assert report["same_stress_level"] in ("0/1", "1/1")
+    assert report["max_feature_drift"] < 0.5
+
+
+def test_failed_cache_write_leaves_no_temp_file(stress, tmp_path):
+    cache = stress["FeatureCache"](str(tmp_path))
+
+    with pytest.raises(TypeError):
+        cache.put("abc", {"rms": object()})
+
+    assert os.listdir(tmp_path) == []
+    assert cache.get("abc") is None
+    cache.put("abc", {"rms": 0.5})
+    assert cache.get("abc") == {"rms": 0.5}
@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+
+import main21
+from main21 import TranslationCache, split_into_segments, translate_batch, translate_long_text, translate_segment
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Replace the remote translator with a recording fake and give each test a fresh cache"""
+    calls = []
+    lock = threading.Lock()
+
+    def fake(text, source_lang, target_lang):
+        with lock:
+            calls.append(text)
+        return f"<{text}>"
+
+    monkeypatch.setattr(main21, "translation_cache", TranslationCache())
+    monkeypatch.setattr(main21, "_translate_uncached", fake)
+    monkeypatch.setattr(main21, "sleep", lambda seconds: None)
+    return calls
+
+
+def test_batch_runs_concurrently_and_keeps_order(upstream, monkeypatch):
+    barrier = threading.Barrier(4, timeout=5)
+
+    def fake(text, source_lang, target_lang):
+        barrier.wait()  # Only passes if four segments are in flight at once
+        return f"<{text}>"
+
+    monkeypatch.setattr(main21, "_translate_uncached", fake)
+    segments = [f"segment {i}" for i in range(4)]
+    assert translate_batch(segments, "en", "hi") == [f"<segment {i}>" for i in range(4)]
+
+
+def test_segment_retries_then_falls_back_to_original(upstream, monkeypatch):
+    attempts = {"flaky": 0, "broken": 0}
+
+    def fake(text, source_lang, target_lang):
+        attempts[text] += 1
+        return "ok" if text == "flaky" and attempts[text] == 2 else None
+
+    monkeypatch.setattr(main21, "_translate_uncached", fake)
+    assert translate_segment("flaky", "en", "hi", retries=2) == "ok"
+    assert translate_segment("broken", "en", "hi", retries=2) == "broken"
+    assert attempts == {"flaky": 2, "broken": 3}
+
+
+def test_cached_segments_skip_the_translator(upstream):
+    translate_batch(["fever", "cough"], "en", "hi")
+    assert translate_batch(["cough", "fever", "  "], "en", "hi") == ["<cough>", "<fever>", "  "]
+    assert sorted(upstream) == ["cough", "fever"]
+
+
+def test_long_text_is_split_and_reassembled(upstream):
+    paragraph = " ".join(f"Sentence number {i} is here." for i in range(40))
+    text = f"Assessment:\n\n{paragraph}\nTake rest."
+    segments, separators = split_into_segments(text, max_chars=200)
+
+    assert all(len(segment) <= 200 for segment in segments)
+    assert "".join(segment + separator for segment, separator in zip(segments, separators)).split() == text.split()
+    translated = translate_long_text(text, "en", "hi")
+    assert translated.startswith("<Assessment:>\n\n") and translated.endswith("\n<Take rest.>")
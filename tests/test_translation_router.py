@@ -0,0 +1,66 @@
+import main21
+from main21 import TranslationBackend, TranslationCache, TranslationRouter, translate_batch
+
+
+class FakeBackend(TranslationBackend):
+    def __init__(self, name, fail=False, loaded=True):
+        self.name = name
+        self.fail = fail
+        self.loaded = loaded
+        self.batches = []
+
+    def is_loaded(self, source_lang, target_lang):
+        return self.loaded
+
+    def translate_many(self, texts, source_lang, target_lang):
+        self.batches.append(list(texts))
+        if self.fail:
+            return [None] * len(texts)
+        return [f"{self.name}:{text}" for text in texts]
+
+
+def test_cold_local_model_loses_to_remote_until_it_is_warm():
+    remote, local = FakeBackend("remote"), FakeBackend("local", loaded=False)
+    router = TranslationRouter([remote, local], mode="auto", explore_rate=0)
+    assert not router.prefers_local("en", "hi")
+    local.loaded = True
+    assert router.prefers_local("en", "hi")
+
+
+def test_measured_latency_decides_the_order():
+    remote, local = FakeBackend("remote"), FakeBackend("local")
+    router = TranslationRouter([remote, local], mode="auto", explore_rate=0)
+    router.record(local, "en", "hi", 1.5, ok=True)
+    router.record(remote, "en", "hi", 0.3, ok=True)
+    assert [backend.name for backend in router.candidates("en", "hi")] == ["remote", "local"]
+    # Other pairs keep their own measurements
+    assert router.prefers_local("en", "ta")
+
+
+def test_failed_backend_falls_through_and_cools_down():
+    remote, local = FakeBackend("remote"), FakeBackend("local", fail=True)
+    router = TranslationRouter([remote, local], mode="local", failure_cooldown=60, explore_rate=0)
+
+    assert router.translate_many(["fever", "cough"], "en", "hi") == ["remote:fever", "remote:cough"]
+    assert local.batches == [["fever", "cough"]]
+    assert [backend.name for backend in router.candidates("en", "hi")] == ["remote"]
+
+
+def test_mode_pins_the_backend():
+    remote, local = FakeBackend("remote"), FakeBackend("local")
+    router = TranslationRouter([remote, local], mode="remote", explore_rate=0)
+    assert router.translate("fever", "en", "hi") == "remote:fever"
+    assert local.batches == []
+
+
+def test_batch_uses_one_local_call_for_uncached_segments(monkeypatch):
+    remote, local = FakeBackend("remote"), FakeBackend("local")
+    cache = TranslationCache()
+    cache.set_translation("cough", "en", "hi", "cached:cough")
+    monkeypatch.setattr(main21, "translation_router", TranslationRouter([remote, local], mode="local"))
+    monkeypatch.setattr(main21, "translation_cache", cache)
+
+    assert translate_batch(["fever", "cough", "", "rash"], "en", "hi") == ["local:fever", "cached:cough", "", "local:rash"]
+    assert local.batches == [["fever", "rash"]]
+    assert remote.batches == []
+    assert cache.get_translation("rash", "en", "hi") == "local:rash"